@@ -18,9 +18,10 @@ goog.addDependency('../../../js/base/quat4.js', ['base.Quat4'], ['base.Mat3', 'b
 goog.addDependency('../../../js/base/vec3.js', ['base.Vec3', 'base.Vec4'], ['base.Pool']);
 goog.addDependency('../../../js/files/binaryfile.js', ['files.BinaryFile'], []);
 goog.addDependency('../../../js/files/bsp.js', ['files.bsp'], ['base', 'base.Bsp', 'base.Map', 'base.Mat4', 'base.Vec3', 'files.BinaryFile']);
+goog.addDependency('../../../js/files/ktx.js', ['files.ktx'], []);
 goog.addDependency('../../../js/files/md3.js', ['files.md3'], ['base', 'files.BinaryFile', 'goog.asserts']);
-goog.addDependency('../../../js/files/resourceManager.js', ['files.ResourceManager'], ['base', 'base.JobsPool', 'files.ShaderScriptLoader', 'files.zipjs', 'goog.array', 'goog.async.Deferred', 'goog.async.DeferredList', 'goog.debug.Logger']);
-goog.addDependency('../../../js/files/shaderscriptloader.js', ['files.ShaderScriptLoader'], ['base.ShaderScript']);
+goog.addDependency('../../../js/files/resourceManager.js', ['files.ResourceManager'], ['base', 'base.JobsPool', 'files.ShaderScriptLoader', 'files.zipjs', 'goog.array', 'goog.async.Deferred', 'goog.async.DeferredList', 'goog.debug.Logger', 'goog.object']);
+goog.addDependency('../../../js/files/shaderscriptloader.js', ['files.ShaderScriptLoader'], ['base.ShaderScript', 'goog.asserts']);
 goog.addDependency('../../../js/files/zipjs/zip.js', ['files.zipjs'], []);
 goog.addDependency('../../../js/flags.js', ['flags'], []);
 goog.addDependency('../../../js/game/charactercontroller.js', ['game.CharacterController'], ['base.Bsp', 'base.IHud', 'base.Vec3', 'game.InputBuffer', 'game.MachineGun', 'game.ModelManager', 'game.Player', 'game.Weapon', 'game.globals', 'network']);
@@ -28,7 +29,7 @@ goog.addDependency('../../../js/game/dummyhud.js', ['game.DummyHud'], ['base.Bro
 goog.addDependency('../../../js/game/dummyrendererscene.js', ['game.DummyRendererScene'], ['base.IRendererScene']);
 goog.addDependency('../../../js/game/entity.js', ['game.Entity'], ['base.Vec3']);
 goog.addDependency('../../../js/game/freecamera.js', ['game.FreeCamera'], ['base.Mat4', 'base.Vec3', 'game.InputBuffer', 'network']);
-goog.addDependency('../../../js/game/game.js', ['game'], ['base', 'base.Broker', 'base.IRendererScene', 'base.Map', 'base.Mat3', 'base.events', 'flags', 'game.CharacterController', 'game.DummyHud', 'game.DummyRendererScene', 'game.FreeCamera', 'game.InputBuffer', 'game.ModelManager', 'game.Player', 'game.Scene', 'game.globals', 'network', 'network.Client', 'network.Server']);
+goog.addDependency('../../../js/game/game.js', ['game'], ['base', 'base.Broker', 'base.Bsp', 'base.IRendererScene', 'base.Map', 'base.Mat3', 'base.events', 'flags', 'game.CharacterController', 'game.DummyHud', 'game.DummyRendererScene', 'game.FreeCamera', 'game.InputBuffer', 'game.ModelManager', 'game.Player', 'game.Scene', 'game.globals', 'network', 'network.Client', 'network.Server']);
 goog.addDependency('../../../js/game/globals.js', ['game.globals'], []);
 goog.addDependency('../../../js/game/inputbuffer.js', ['game.InputBuffer'], ['base.InputState', 'goog.array']);
 goog.addDependency('../../../js/game/modelmanager.js', ['game.ModelManager'], ['base.IRendererScene', 'base.ModelInstance', 'goog.debug.Logger']);
@@ -47,7 +48,7 @@ goog.addDependency('../../../js/network/tests/common.js', ['network.tests.common
 goog.addDependency('../../../js/renderer/billboard.js', ['renderer.billboard'], ['base.Mesh', 'base.Model', 'renderer', 'renderer.Renderer']);
 goog.addDependency('../../../js/renderer/common.js', ['renderer', 'renderer.Material', 'renderer.MeshInstance', 'renderer.Shader', 'renderer.ShaderProgram', 'renderer.Stage', 'renderer.State'], ['base.Material', 'goog.webgl']);
 goog.addDependency('../../../js/renderer/line.js', ['renderer.line'], ['base.Mat4', 'base.Mesh', 'base.Model', 'base.Vec3', 'renderer', 'renderer.Renderer']);
-goog.addDependency('../../../js/renderer/materialmanager.js', ['renderer.MaterialManager'], ['base.Mat4', 'base.Material', 'goog.debug.Logger', 'goog.debug.Logger.Level', 'renderer.Material', 'renderer.Shader', 'renderer.ShaderProgram', 'renderer.Stage']);
+goog.addDependency('../../../js/renderer/materialmanager.js', ['renderer.MaterialManager'], ['base.Mat4', 'base.Material', 'files.ktx', 'goog.debug.Logger', 'goog.debug.Logger.Level', 'renderer.Material', 'renderer.Shader', 'renderer.ShaderProgram', 'renderer.Stage']);
 goog.addDependency('../../../js/renderer/renderer.js', ['renderer.Renderer'], ['base', 'base.Mat4', 'base.Vec3', 'goog.debug.Logger', 'goog.debug.Logger.Level', 'renderer.Material', 'renderer.MaterialManager', 'renderer.Shader', 'renderer.ShaderProgram', 'renderer.Stage', 'renderer.State']);
 goog.addDependency('../../../js/renderer/scene.js', ['renderer.Scene'], ['base', 'base.IRendererScene', 'base.Mat4', 'base.Vec3', 'goog.debug.Logger', 'renderer.Renderer', 'renderer.Sky', 'renderer.billboard', 'renderer.line']);
 goog.addDependency('../../../js/renderer/sky.js', ['renderer.Sky'], ['base.Mat4', 'goog.asserts', 'renderer', 'renderer.State']);
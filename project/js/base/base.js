@@ -390,6 +390,12 @@ base.Mesh = function(geometry, indicesOffset, indicesCount, materialNames, light
      * ids of materials
      */
     this.materials = [];
+    /**
+     * Index ranges (offset, count) drawn instead of the whole mesh; set by
+     * renderer for map meshes from the visibility table
+     * @type {Array.<number>}
+     */
+    this.visibleRanges = null;
 };
 
 /**
@@ -23,44 +23,63 @@ goog.require('goog.asserts');
 goog.provide('base.Bsp');
 
 /**
+ * Collision tree in flat typed arrays, as written by the packer
+ * (tools/bspcompiler.py) or built by base.Bsp.Builder. Planes are stored inline
+ * as normal(3), distance. Leaves list only solid brushes with sides.
  * @constructor
- * @private
+ * @param {Float32Array} nodePlanes plane of every node
+ * @param {Int32Array} nodeChildren front and back child of every node; leaf l
+ * is -(l + 1)
+ * @param {Int32Array} leafClusters
+ * @param {Int32Array} leafBrushRanges first leaf brush and count of every leaf
+ * @param {Int32Array} leafBrushes brush indices
+ * @param {Int32Array} brushSideRanges first side and count of every brush
+ * @param {Float32Array} brushBounds distances of brush's sides facing +x, +y,
+ * +z, -x, -y, -z; Infinity if it has no such side
+ * @param {Float32Array} sidePlanes plane of every brush side
  */
-base.Bsp = function () {
+base.Bsp = function (nodePlanes, nodeChildren, leafClusters, leafBrushRanges,
+                     leafBrushes, brushSideRanges, brushBounds, sidePlanes) {
     /**
-     * @private
-     * @type {Array.<base.Bsp.Plane>}
+     * @const
+     * @type {Float32Array}
      */
-    this.planes = [];
+    this.nodePlanes = nodePlanes;
     /**
-     * @private
-     * @type {Array.<base.Bsp.Node>}
+     * @const
+     * @type {Int32Array}
      */
-    this.nodes = [];
+    this.nodeChildren = nodeChildren;
     /**
-     * @private
-     * @type {Array.<base.Bsp.Leaf>}
+     * @const
+     * @type {Int32Array}
      */
-    this.leaves = [];
+    this.leafClusters = leafClusters;
     /**
-     * @private
-     * @type {Array.<number>}
+     * @const
+     * @type {Int32Array}
      */
-    this.leafFaces = [];
+    this.leafBrushRanges = leafBrushRanges;
     /**
-     * @private
-     * @type {Array.<number>}
+     * @const
+     * @type {Int32Array}
      */
-    this.leafBrushes = [];/**
-     * @private
-     * @type {Array.<base.Bsp.Brush>}
+    this.leafBrushes = leafBrushes;
+    /**
+     * @const
+     * @type {Int32Array}
      */
-    this.brushes = [];
+    this.brushSideRanges = brushSideRanges;
     /**
-     * @private
-     * @type {Array.<base.Bsp.BrushSide>}
+     * @const
+     * @type {Float32Array}
      */
-    this.brushSides = [];
+    this.brushBounds = brushBounds;
+    /**
+     * @const
+     * @type {Float32Array}
+     */
+    this.sidePlanes = sidePlanes;
 };
 
 /**
@@ -100,6 +119,26 @@ base.Bsp.trace = function(bsp, start, end, radius) {
     return output;
 };
 
+/**
+ * @public
+ * @param {base.Bsp} bsp
+ * @param {base.Vec3} point
+ * @return {number} cluster of the leaf containing point; -1 if it's outside
+ * of the map
+ */
+base.Bsp.findCluster = function (bsp, point) {
+    var index = 0, planes = bsp.nodePlanes, p;
+    if (bsp.nodeChildren.length === 0) {
+        return -1;
+    }
+    while (index >= 0) {
+        p = 4 * index;
+        index = bsp.nodeChildren[2 * index + (planes[p] * point[0] + planes[p + 1] * point[1] +
+                                              planes[p + 2] * point[2] >= planes[p + 3] ? 0 : 1)];
+    }
+    return bsp.leafClusters[-(index + 1)];
+};
+
 /**
  * @const
  * @type {number}
@@ -123,35 +162,35 @@ base.Bsp.traceNode = function(bsp, nodeIdx,
                               rayStart, rayEnd,
                               startFraction, endFraction,
                               start, end, radius, output) {
-    var i,
-        leaf, brush, surface,
-        node, plane, startDist, endDist,
+    var i, last, leaf,
+        planes, p, startDist, endDist,
         side, fraction1, fraction2, middleFraction, middle,
         iDist;
     if (nodeIdx < 0) { // Leaf node?
-        leaf = bsp.leaves[-(nodeIdx + 1)];
-        for (i = 0; i < leaf.leafBrushesCount; i++) {
-            brush = bsp.brushes[bsp.leafBrushes[leaf.firstLeafBrush + i]];
-            if (brush.brushSidesCount > 0 && brush.flags & base.Bsp.BrushFlags.SOLID) {
-                base.Bsp.traceBrush(bsp, brush, rayStart, rayEnd, radius, output);
-            }
+        leaf = -(nodeIdx + 1);
+        i = bsp.leafBrushRanges[2 * leaf];
+        last = i + bsp.leafBrushRanges[2 * leaf + 1];
+        for (; i < last; i++) {
+            base.Bsp.traceBrush(bsp, bsp.leafBrushes[i], rayStart, rayEnd, radius, output);
         }
         return;
     }
     
     // Tree node
-    node = bsp.nodes[nodeIdx];
-    plane = bsp.planes[node.plane];
+    planes = bsp.nodePlanes;
+    p = 4 * nodeIdx;
     
-    startDist = base.Vec3.dot(plane.normal, start) - plane.distance;
-    endDist = base.Vec3.dot(plane.normal, end) - plane.distance;
+    startDist = planes[p] * start[0] + planes[p + 1] * start[1] + planes[p + 2] * start[2] -
+        planes[p + 3];
+    endDist = planes[p] * end[0] + planes[p + 1] * end[1] + planes[p + 2] * end[2] -
+        planes[p + 3];
     
     if (startDist >= radius && endDist >= radius) {
-        base.Bsp.traceNode(bsp, node.children[0], rayStart, rayEnd,
+        base.Bsp.traceNode(bsp, bsp.nodeChildren[2 * nodeIdx], rayStart, rayEnd,
                            startFraction, endFraction,
                            start, end, radius, output );
     } else if (startDist < -radius && endDist < -radius) {
-        base.Bsp.traceNode(bsp, node.children[1], rayStart, rayEnd,
+        base.Bsp.traceNode(bsp, bsp.nodeChildren[2 * nodeIdx + 1], rayStart, rayEnd,
                            startFraction, endFraction,
                            start, end, radius, output );
     } else {
@@ -184,7 +223,7 @@ base.Bsp.traceNode = function(bsp, nodeIdx,
             middle[i] = start[i] + fraction1 * (end[i] - start[i]);
         }
         
-        base.Bsp.traceNode(bsp, node.children[side], rayStart,
+        base.Bsp.traceNode(bsp, bsp.nodeChildren[2 * nodeIdx + side], rayStart,
                            rayEnd, startFraction,
                            middleFraction, start, middle, radius, output );
         
@@ -194,26 +233,47 @@ base.Bsp.traceNode = function(bsp, nodeIdx,
             middle[i] = start[i] + fraction2 * (end[i] - start[i]);
         }
         
-        base.Bsp.traceNode(bsp, node.children[side===0?1:0],
+        base.Bsp.traceNode(bsp, bsp.nodeChildren[2 * nodeIdx + (side===0?1:0)],
                            rayStart, rayEnd,
                            middleFraction, endFraction, middle, end, radius, output );
     }
 };
 
+/**
+ * @private
+ * @param {base.Bsp} bsp
+ * @param {number} brush
+ * @param {base.Vec3} start
+ * @param {base.Vec3} end
+ * @param {number} radius
+ * @param {base.Bsp.TraceOutput} output
+ */
 base.Bsp.traceBrush = function(bsp, brush, start, end, radius, output) {
     var startFraction = -1;
     var endFraction = 1;
     var startsOut = false;
     var endsOut = false;
-    var collisionPlane = null;
-    var i, brushSide, plane, startDist, endDist, fraction;
-    
-    for (i = 0; i < brush.brushSidesCount; i++) {
-        brushSide = bsp.brushSides[brush.firstBrushSide + i];
-        plane = bsp.planes[brushSide.plane];
-        
-        startDist = base.Vec3.dot( start, plane.normal ) - (plane.distance + radius);
-        endDist = base.Vec3.dot( end, plane.normal ) - (plane.distance + radius);
+    var collisionSide = -1;
+    var bounds = bsp.brushBounds, planes = bsp.sidePlanes;
+    var i, last, b, p, distance, startDist, endDist, fraction;
+
+    // the ray is outside of an axial side, as checked in the loop below
+    for (i = 0, b = 6 * brush; i < 3; i++, b++) {
+        distance = bounds[b] + radius;
+        if (start[i] - distance > 0 && end[i] - distance > 0) { return; }
+        distance = bounds[b + 3] + radius;
+        if (-start[i] - distance > 0 && -end[i] - distance > 0) { return; }
+    }
+
+    i = bsp.brushSideRanges[2 * brush];
+    last = i + bsp.brushSideRanges[2 * brush + 1];
+    for (; i < last; i++) {
+        p = 4 * i;
+        distance = planes[p + 3] + radius;
+        startDist = start[0] * planes[p] + start[1] * planes[p + 1] + start[2] * planes[p + 2] -
+            distance;
+        endDist = end[0] * planes[p] + end[1] * planes[p + 1] + end[2] * planes[p + 2] -
+            distance;
 
         if (startDist > 0) startsOut = true;
         if (endDist > 0) endsOut = true;
@@ -226,7 +286,7 @@ base.Bsp.traceBrush = function(bsp, brush, start, end, radius, output) {
             fraction = (startDist - base.Bsp.TRACE_OFFSET) / (startDist - endDist);
             if (fraction > startFraction) {
                 startFraction = fraction;
-                collisionPlane = plane;
+                collisionSide = i;
             }
         } else { // line is leaving the brush
             fraction = (startDist + base.Bsp.TRACE_OFFSET) / (startDist - endDist);
@@ -244,7 +304,9 @@ base.Bsp.traceBrush = function(bsp, brush, start, end, radius, output) {
 
     if (startFraction < endFraction) {
         if (startFraction > -1 && startFraction < output.fraction) {
-            output.plane = collisionPlane;
+            p = 4 * collisionSide;
+            output.plane = new base.Bsp.Plane(
+                base.Vec3.createVal(planes[p], planes[p + 1], planes[p + 2]), planes[p + 3]);
             if (startFraction < 0)
                 startFraction = 0;
             output.fraction = startFraction;
@@ -316,77 +378,184 @@ base.Bsp.SurfaceFlags = {
     DUST: 0x40000 // leave a dust trail when walking on this surface
 };
 /**
+ * Builds base.Bsp from bsp lumps, when the packer didn't compile it.
  * @constructor
  */
 base.Bsp.Builder = function () {
     /**
      * @private
-     * @type {base.Bsp}
+     * @type {Array.<base.Bsp.Plane>}
      */
-    this.bsp = new base.Bsp();
+    this.planes = [];
+    /**
+     * @private
+     * @type {Array.<base.Bsp.Node>}
+     */
+    this.nodes = [];
+    /**
+     * @private
+     * @type {Array.<base.Bsp.Leaf>}
+     */
+    this.leaves = [];
+    /**
+     * @private
+     * @type {Array.<number>}
+     */
+    this.leafBrushes = [];
+    /**
+     * @private
+     * @type {Array.<base.Bsp.Brush>}
+     */
+    this.brushes = [];
+    /**
+     * @private
+     * @type {Array.<base.Bsp.BrushSide>}
+     */
+    this.brushSides = [];
 };
 /**
  * @public
  * @param {Array.<base.Bsp.Plane>} planes
  */
 base.Bsp.Builder.prototype.addPlanes = function (planes) {
-    this.bsp.planes = planes;
+    this.planes = planes;
 };
 /**
  * @public
  * @param {Array.<base.Bsp.Node>} nodes
  */
 base.Bsp.Builder.prototype.addNodes = function (nodes) {
-    this.bsp.nodes = nodes;    
+    this.nodes = nodes;    
 };
 /**
  * @public
  * @param {Array.<base.Bsp.Leaf>} leaves
  */
 base.Bsp.Builder.prototype.addLeaves = function (leaves) {
-    this.bsp.leaves = leaves;
-};
-/**
- * @public
- * @param {Array.<number>} leafFaces
- */
-base.Bsp.Builder.prototype.addLeafFaces = function (leafFaces) {
-    this.bsp.leafFaces = leafFaces;
+    this.leaves = leaves;
 };
 /**
  * @public
  * @param {Array.<number>} leafBrushes
  */
 base.Bsp.Builder.prototype.addLeafBrushes = function (leafBrushes) {
-    this.bsp.leafBrushes = leafBrushes;
+    this.leafBrushes = leafBrushes;
 };
 /**
  * @public
  * @param {Array.<base.Bsp.Brush>} brushes
  */
 base.Bsp.Builder.prototype.addBrushes = function (brushes) {
-    this.bsp.brushes = brushes;
+    this.brushes = brushes;
 };
 /**
  * @public
  * @param {Array.<base.Bsp.BrushSide>} brushSides
  */
 base.Bsp.Builder.prototype.addBrushSides = function (brushSides) {
-    this.bsp.brushSides = brushSides;
+    this.brushSides = brushSides;
 };
 /**
+ * Lays the tree out as tools/bspcompiler.py does.
  * @public
  * @return {base.Bsp}
  */
 base.Bsp.Builder.prototype.getBsp = function () {
-    goog.asserts.assert(this.bsp.planes.length);
-    goog.asserts.assert(this.bsp.nodes.length);
-    goog.asserts.assert(this.bsp.leaves.length);
-    goog.asserts.assert(this.bsp.leafFaces.length);
-    goog.asserts.assert(this.bsp.leafBrushes.length);
-    goog.asserts.assert(this.bsp.brushes.length);
-    goog.asserts.assert(this.bsp.brushSides.length);
-    return this.bsp;
+    var i, j, k, brush, leaf, index, axis;
+    var brushIndices = [], sidesCount = 0;
+    var nodePlanes, nodeChildren, leafClusters, leafBrushRanges, leafBrushes,
+        brushSideRanges, brushBounds, sidePlanes;
+
+    goog.asserts.assert(this.planes.length);
+    goog.asserts.assert(this.nodes.length);
+    goog.asserts.assert(this.leaves.length);
+    goog.asserts.assert(this.leafBrushes.length);
+    goog.asserts.assert(this.brushes.length);
+    goog.asserts.assert(this.brushSides.length);
+
+    nodePlanes = new Float32Array(this.nodes.length * 4);
+    nodeChildren = new Int32Array(this.nodes.length * 2);
+    for (i = 0; i < this.nodes.length; ++i) {
+        base.Bsp.Builder.setPlane_(nodePlanes, i, this.planes[this.nodes[i].plane]);
+        nodeChildren[2 * i] = this.nodes[i].children[0];
+        nodeChildren[2 * i + 1] = this.nodes[i].children[1];
+    }
+
+    // only brushes trace can hit, renumbered
+    for (i = 0; i < this.brushes.length; ++i) {
+        brush = this.brushes[i];
+        if (brush.brushSidesCount > 0 && brush.flags & base.Bsp.BrushFlags.SOLID) {
+            brushIndices.push(sidesCount);
+            sidesCount += brush.brushSidesCount;
+        } else {
+            brushIndices.push(-1);
+        }
+    }
+    brushSideRanges = [];
+    sidePlanes = new Float32Array(sidesCount * 4);
+    for (i = 0; i < this.brushes.length; ++i) {
+        brush = this.brushes[i];
+        if (brushIndices[i] >= 0) {
+            brushSideRanges.push(brushIndices[i], brush.brushSidesCount);
+            brushIndices[i] = brushSideRanges.length / 2 - 1;
+            for (j = 0; j < brush.brushSidesCount; ++j) {
+                base.Bsp.Builder.setPlane_(sidePlanes, brushSideRanges[2 * brushIndices[i]] + j,
+                    this.planes[this.brushSides[brush.firstBrushSide + j].plane]);
+            }
+        }
+    }
+    brushSideRanges = new Int32Array(brushSideRanges);
+
+    // tightest axial side in every direction
+    brushBounds = new Float32Array(brushSideRanges.length * 3);
+    for (i = 0; i < brushBounds.length; ++i) {
+        brushBounds[i] = Infinity;
+    }
+    for (i = 0; i < brushSideRanges.length / 2; ++i) {
+        for (j = 0; j < brushSideRanges[2 * i + 1]; ++j) {
+            index = 4 * (brushSideRanges[2 * i] + j);
+            for (axis = 0; axis < 3; ++axis) {
+                if (Math.abs(sidePlanes[index + axis]) === 1 &&
+                    sidePlanes[index + (axis + 1) % 3] === 0 &&
+                    sidePlanes[index + (axis + 2) % 3] === 0) {
+                    k = 6 * i + axis + (sidePlanes[index + axis] > 0 ? 0 : 3);
+                    brushBounds[k] = Math.min(brushBounds[k], sidePlanes[index + 3]);
+                }
+            }
+        }
+    }
+
+    leafClusters = new Int32Array(this.leaves.length);
+    leafBrushRanges = new Int32Array(this.leaves.length * 2);
+    leafBrushes = [];
+    for (i = 0; i < this.leaves.length; ++i) {
+        leaf = this.leaves[i];
+        leafClusters[i] = leaf.cluster;
+        leafBrushRanges[2 * i] = leafBrushes.length;
+        for (j = 0; j < leaf.leafBrushesCount; ++j) {
+            index = brushIndices[this.leafBrushes[leaf.firstLeafBrush + j]];
+            if (index >= 0) {
+                leafBrushes.push(index);
+            }
+        }
+        leafBrushRanges[2 * i + 1] = leafBrushes.length - leafBrushRanges[2 * i];
+    }
+
+    return new base.Bsp(nodePlanes, nodeChildren, leafClusters, leafBrushRanges,
+                        new Int32Array(leafBrushes), brushSideRanges, brushBounds,
+                        sidePlanes);
+};
+/**
+ * @private
+ * @param {Float32Array} planes
+ * @param {number} index
+ * @param {base.Bsp.Plane} plane
+ */
+base.Bsp.Builder.setPlane_ = function (planes, index, plane) {
+    planes[4 * index] = plane.normal[0];
+    planes[4 * index + 1] = plane.normal[1];
+    planes[4 * index + 2] = plane.normal[2];
+    planes[4 * index + 3] = plane.distance;
 };
 
 /**
@@ -38,8 +38,9 @@ base.IRendererScene.prototype.buildShaders._CROSS_WORKER_ = true;
  * @public
  * @param {Array.<base.Model>} models
  * @param {base.Map.LightmapData} lightmapData
+ * @param {base.Map.Visibility} [visibility]
  */
-base.IRendererScene.prototype.registerMap = function (models, lightmapData) {};
+base.IRendererScene.prototype.registerMap = function (models, lightmapData, visibility) {};
 base.IRendererScene.prototype.registerMap._CROSS_WORKER_ = true;
 
 /**
@@ -94,8 +95,9 @@ base.IRendererScene.prototype.setModelsVisibility._CROSS_WORKER_ = true;
 /**
  * @public
  * @param {base.Mat4} cameraMatrix inversed view matrix
+ * @param {number} [cluster] bsp cluster of the camera; -1 or none draws the whole map
  */
-base.IRendererScene.prototype.updateCamera = function (cameraMatrix) {};
+base.IRendererScene.prototype.updateCamera = function (cameraMatrix, cluster) {};
 base.IRendererScene.prototype.updateCamera._CROSS_WORKER_ = true;
 
 /**
@@ -30,8 +30,9 @@ goog.provide('base.Map');
  * @param {base.Bsp} bsp
  * @param {Array.<Object>} entities
  * @param {Array.<Object>} entitiesModels
+ * @param {base.Map.Visibility} [visibility] table precomputed by the packer
  */
-base.Map = function(models, lightmapData, bsp, entities, entitiesModels) {
+base.Map = function(models, lightmapData, bsp, entities, entitiesModels, visibility) {
     /**
      * @const
      * @type {Array.<base.Model>}
@@ -56,6 +57,11 @@ base.Map = function(models, lightmapData, bsp, entities, entitiesModels) {
      * @const
      */
     this.entitiesModels = entitiesModels;
+    /**
+     * @const
+     * @type {?base.Map.Visibility}
+     */
+    this.visibility = visibility || null;
 };
 
 /**
@@ -112,6 +118,28 @@ base.Map.LightmapData = function(lightmaps, size) {
     this.size = size;
 };
 
+/**
+ * Index runs of map meshes visible from every cluster, made by
+ * tools/bspcompiler.py. Runs of cluster c are runs[3 * i...] for i from
+ * clusters[2 * c] to clusters[2 * c] + clusters[2 * c + 1]; every run is mesh
+ * index (in the first map model), index offset in bytes and element count.
+ * @constructor
+ * @param {Uint32Array} clusters
+ * @param {Uint32Array} runs
+ */
+base.Map.Visibility = function (clusters, runs) {
+    /**
+     * @const
+     * @type {Uint32Array}
+     */
+    this.clusters = clusters;
+    /**
+     * @const
+     * @type {Uint32Array}
+     */
+    this.runs = runs;
+};
+
 base.Map.getSpawnPoints = function (map) {
     return map.entities['info_player_deathmatch'] || null;
     // return this.entities.filter(function (ent) {
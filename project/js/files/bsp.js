@@ -61,16 +61,43 @@ goog.provide('files.bsp');
 files.bsp.TESSELATION_LEVEL = 10;
 
 
-files.bsp.load = function(map) {
-    return files.bsp.parse_(new files.BinaryFile(map));
+/**
+ * Version of precompiled geometry (.cbsp) written by tools/bspcompiler.py
+ * @const
+ */
+files.bsp.COMPILED_VERSION = 1;
+
+/**
+ * Version of visibility table (.pvs) written by tools/bspcompiler.py
+ * @const
+ */
+files.bsp.VISIBILITY_VERSION = 1;
+
+/**
+ * Version of collision tree (.ccol) written by tools/bspcompiler.py
+ * @const
+ * @type {number}
+ */
+files.bsp.COLLISION_VERSION = 1;
+
+/**
+ * @param {ArrayBuffer} map
+ * @param {?ArrayBuffer=} compiled geometry precompiled by the packer
+ * @param {?ArrayBuffer=} lightmaps RGBA lightmap atlas baked by the packer
+ * @param {?ArrayBuffer=} visibility table of meshes visible from clusters
+ * @param {?ArrayBuffer=} collision collision tree compiled by the packer
+ */
+files.bsp.load = function(map, compiled, lightmaps, visibility, collision) {
+    return files.bsp.parse_(new files.BinaryFile(map), compiled, lightmaps, visibility,
+                            collision);
 };
 
 /** @private*/
 // Parses the BSP file
-files.bsp.parse_ = function(src) {
+files.bsp.parse_ = function(src, compiled, lightmaps, visibility, collision) {
 
     var entities, shaders, lightmapData, verts, meshVerts, faces, models,
-        compiledModels, map, bspBuilder;
+        compiledModels, map, bsp = null, bspBuilder, visibilityData = null;
     var header = files.bsp.readHeader_(src);
     
     if(header.tag != 'IBSP' && header.version != 46) { // Check for appropriate format
@@ -82,32 +109,56 @@ files.bsp.parse_ = function(src) {
 
     // Load visual map components
     shaders = files.bsp.readShaders_(header.lumps[1], src);
-    lightmapData = files.bsp.readLightmaps_(header.lumps[14], src);
-    verts = files.bsp.readVerts_(header.lumps[10], src);
-    meshVerts = files.bsp.readMeshVerts_(header.lumps[11], src);
-    faces = files.bsp.readFaces_(header.lumps[13], src);
+    if (lightmaps) {
+        lightmapData = files.bsp.getLightmapsLayout_(header.lumps[14]);
+    } else {
+        lightmapData = files.bsp.readLightmaps_(header.lumps[14], src);
+    }
     models = files.bsp.readModels_(header.lumps[7], src);
 
     // Load bsp components
-    bspBuilder = new base.Bsp.Builder();
-    bspBuilder.addPlanes(files.bsp.readPlanes_(header.lumps[2], src));
-    bspBuilder.addNodes(files.bsp.readNodes_(header.lumps[3], src));
-    bspBuilder.addLeaves(files.bsp.readLeaves_(header.lumps[4], src));
-    bspBuilder.addLeafFaces(files.bsp.readLeafFaces_(header.lumps[5], src));
-    bspBuilder.addLeafBrushes(files.bsp.readLeafBrushes_(header.lumps[6], src));
-    bspBuilder.addBrushes(files.bsp.readBrushes_(header.lumps[8], src, shaders));
-    bspBuilder.addBrushSides(files.bsp.readBrushSides_(header.lumps[9], src, shaders));
+    if (collision) {
+        bsp = files.bsp.readCollision_(collision);
+    }
+    if (!bsp) {
+        bspBuilder = new base.Bsp.Builder();
+        bspBuilder.addPlanes(files.bsp.readPlanes_(header.lumps[2], src));
+        bspBuilder.addNodes(files.bsp.readNodes_(header.lumps[3], src));
+        bspBuilder.addLeaves(files.bsp.readLeaves_(header.lumps[4], src));
+        bspBuilder.addLeafBrushes(files.bsp.readLeafBrushes_(header.lumps[6], src));
+        bspBuilder.addBrushes(files.bsp.readBrushes_(header.lumps[8], src, shaders));
+        bspBuilder.addBrushSides(files.bsp.readBrushSides_(header.lumps[9], src, shaders));
+        bsp = bspBuilder.getBsp();
+    }
     
-    compiledModels = files.bsp.compileMapModels_(verts, faces, meshVerts, lightmapData, shaders);
+    if (compiled) {
+        compiledModels = files.bsp.readCompiledModels_(compiled, shaders, lightmapData);
+    }
+    if (!compiledModels) {
+        verts = files.bsp.readVerts_(header.lumps[10], src);
+        meshVerts = files.bsp.readMeshVerts_(header.lumps[11], src);
+        faces = files.bsp.readFaces_(header.lumps[13], src);
+        compiledModels = files.bsp.compileMapModels_(verts, faces, meshVerts, lightmapData,
+                                                     shaders);
+    }
 
-    map = new base.Map(compiledModels, lightmapData, bspBuilder.getBsp(), entities, models);
+    if (lightmaps) {
+        // renderer gets the whole atlas as one lightmap
+        lightmapData = new base.Map.LightmapData(
+            [new base.Map.Lightmap(0, 0, lightmapData.size, lightmapData.size,
+                                   new Uint8Array(lightmaps))],
+            lightmapData.size);
+    }
+
+    if (visibility) {
+        visibilityData = files.bsp.readVisibility_(visibility,
+                                                   compiledModels[0].meshes.length);
+    }
+
+    map = new base.Map(compiledModels, lightmapData, bsp, entities, models,
+                       visibilityData);
 
     return map;
-    
-    // not needed for now
-    // var visData = files.bsp.readVisData_(header.lumps[16], src);
-    // var visBuffer = visData.buffer;
-    // var visSize = visData.size;
 };
 
 // Read all lump headers
@@ -292,6 +343,26 @@ files.bsp.readLightmaps_ = function(lump, src) {
     return new base.Map.LightmapData(lightmaps, textureSize);
 };
 
+// Positions of lightmaps in the atlas without their data; for atlas baked
+// offline by the packer (tools/bspcompiler.py)
+/** @private*/
+files.bsp.getLightmapsLayout_ = function(lump) {
+    var count = lump.length / (128 * 128 * 3);
+    var gridSize = 2;
+
+    while(gridSize * gridSize < count) {
+        gridSize *= 2;
+    }
+
+    var lightmaps = [];
+    for(var i = 0; i < count; ++i) {
+        lightmaps.push(new base.Map.Lightmap(
+            (i % gridSize) * 128, Math.floor(i / gridSize) * 128, 128, 128, null));
+    }
+
+    return new base.Map.LightmapData(lightmaps, gridSize * 128);
+};
+
 /** @private*/
 files.bsp.readVerts_ = function(lump, src) {
     var count = lump.length/44;
@@ -522,6 +593,109 @@ files.bsp.readVisData_ = function(lump, src) {
     };
 };
 
+/**
+ * Reads visibility table made by tools/bspcompiler.py. Its runs refer to
+ * meshes built by compileMapModels_ or readCompiledModels_, which have the
+ * same layout.
+ * @private
+ * @param {ArrayBuffer} buffer
+ * @param {number} meshesCount
+ * @return {?base.Map.Visibility} null if table doesn't fit the meshes
+ */
+files.bsp.readVisibility_ = function(buffer, meshesCount) {
+    var header, clusters, runs, i;
+
+    if (buffer.byteLength < 20 ||
+        String.fromCharCode.apply(null, new Uint8Array(buffer, 0, 4)) != 'CPVS') {
+        return null;
+    }
+    header = new Uint32Array(buffer, 0, 5);
+    if (header[1] != files.bsp.VISIBILITY_VERSION || header[3] != meshesCount ||
+        20 + header[2] * 8 + header[4] * 12 != buffer.byteLength) {
+        return null;
+    }
+    clusters = new Uint32Array(buffer, 20, header[2] * 2);
+    runs = new Uint32Array(buffer, 20 + clusters.byteLength, header[4] * 3);
+    for (i = 0; i < clusters.length; i += 2) {
+        if (clusters[i] + clusters[i + 1] > header[4]) {
+            return null;
+        }
+    }
+    for (i = 0; i < runs.length; i += 3) {
+        if (runs[i] >= meshesCount) {
+            return null;
+        }
+    }
+    return new base.Map.Visibility(clusters, runs);
+};
+
+/**
+ * Creates base.Bsp over arrays of collision tree file (see
+ * tools/bspcompiler.py).
+ * @private
+ * @param {ArrayBuffer} buffer
+ * @return {?base.Bsp} null if buffer isn't valid collision tree
+ */
+files.bsp.readCollision_ = function(buffer) {
+    var header, offset = 28, arrays = [], sizes, i;
+
+    if (buffer.byteLength < 28 ||
+        String.fromCharCode.apply(null, new Uint8Array(buffer, 0, 4)) != 'CCOL') {
+        return null;
+    }
+    header = new Uint32Array(buffer, 0, 7);
+    if (header[1] != files.bsp.COLLISION_VERSION) {
+        return null;
+    }
+    // [array type, element count] in order of the file
+    sizes = [[Float32Array, header[2] * 4], [Int32Array, header[2] * 2],
+             [Int32Array, header[3]], [Int32Array, header[3] * 2],
+             [Int32Array, header[4]], [Int32Array, header[5] * 2],
+             [Float32Array, header[5] * 6], [Float32Array, header[6] * 4]];
+    for (i = 0; i < sizes.length; ++i) {
+        if (offset + sizes[i][1] * 4 > buffer.byteLength) {
+            return null;
+        }
+        arrays.push(new sizes[i][0](buffer, offset, sizes[i][1]));
+        offset += sizes[i][1] * 4;
+    }
+    if (offset != buffer.byteLength) {
+        return null;
+    }
+    for (i = 0; i < arrays[1].length; ++i) {
+        if (arrays[1][i] >= header[2] || -(arrays[1][i] + 1) >= header[3]) {
+            return null;
+        }
+    }
+    if (!files.bsp.checkRanges_(arrays[3], header[4]) ||
+        !files.bsp.checkRanges_(arrays[5], header[6])) {
+        return null;
+    }
+    for (i = 0; i < arrays[4].length; ++i) {
+        if (arrays[4][i] < 0 || arrays[4][i] >= header[5]) {
+            return null;
+        }
+    }
+    return new base.Bsp(arrays[0], arrays[1], arrays[2], arrays[3], arrays[4], arrays[5],
+                        arrays[6], arrays[7]);
+};
+
+/**
+ * @private
+ * @param {Int32Array} ranges first, count pairs
+ * @param {number} length of array they index
+ * @return {boolean}
+ */
+files.bsp.checkRanges_ = function(ranges, length) {
+    var i;
+    for (i = 0; i < ranges.length; i += 2) {
+        if (ranges[i] < 0 || ranges[i + 1] < 0 || ranges[i] + ranges[i + 1] > length) {
+            return false;
+        }
+    }
+    return true;
+};
+
 /** @private*/
 files.bsp.readModels_ = function(lump, src) {
     var count = lump.length / 40;
@@ -731,6 +905,47 @@ files.bsp.compileMapModels_ = function(verts, faces, meshVerts, lightmapData, sh
 };
 
 
+/**
+ * Creates models from geometry precompiled by tools/bspcompiler.py. Its buffers
+ * have the same layout as buffers built by compileMapModels_, so they are used
+ * directly.
+ * @private
+ * @return {?Array.<base.Model>} null if compiled data doesn't fit this map
+ */
+files.bsp.readCompiledModels_ = function(buffer, shaders, lightmapData) {
+    var header = new Uint32Array(buffer, 0, 7);
+    var magic = String.fromCharCode.apply(null, new Uint8Array(buffer, 0, 4));
+    var i, offset, ranges, vertices, indices, geometryData, shader, meshes = [];
+
+    if (magic != 'CBSP' || header[1] != files.bsp.COMPILED_VERSION ||
+        header[4] != 2 || // only 16 bit indices are supported
+        header[6] != lightmapData.size) {
+        return null;
+    }
+
+    offset = header.byteLength;
+    ranges = new Int32Array(buffer, offset, header[5] * 4);
+    offset += ranges.byteLength;
+    vertices = new Float32Array(buffer, offset, header[2] * 14);
+    offset += vertices.byteLength;
+    indices = new Uint16Array(buffer, offset, header[3]);
+
+    geometryData = new base.GeometryData(indices, [vertices]);
+
+    for (i = 0; i < ranges.length; i += 4) {
+        shader = shaders[ranges[i]];
+        if (ranges[i + 1] !== 0) {
+            shader.geomType = ranges[i + 1];
+        }
+        shader.indexOffset = ranges[i + 2];
+        shader.elementCount = ranges[i + 3];
+        meshes.push(new base.Mesh(geometryData, shader.indexOffset, shader.elementCount,
+                                  [shader.shaderName], base.LightningType.LIGHT_MAP));
+    }
+
+    return [new base.Model(-1, meshes, 1, [], base.Model.Type.BSP)];
+};
+
 /** @private*/
 files.bsp.buildModels_ = function(leaves, leafFaces, faces, verts, meshVerts, models) {
     var i;
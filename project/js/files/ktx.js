@@ -0,0 +1,97 @@
+/**
+ * copyright (C) 2012 Adam Rzepka
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+'use strict';
+
+goog.provide('files.ktx');
+
+/**
+ * Compressed formats written by the packer (tools/texcompress.py)
+ * @enum {number}
+ */
+files.ktx.Format = {
+    COMPRESSED_RGB_S3TC_DXT1_EXT: 0x83F0,
+    COMPRESSED_RGBA_S3TC_DXT5_EXT: 0x83F3,
+    ETC1_RGB8_OES: 0x8D64
+};
+
+/**
+ * @const
+ * @private
+ * @type {Array.<number>}
+ */
+files.ktx.IDENTIFIER_ = [0xAB, 0x4B, 0x54, 0x58, 0x20, 0x31, 0x31, 0xBB, 0x0D, 0x0A, 0x1A, 0x0A];
+
+/**
+ * @const
+ * @private
+ * @type {number}
+ */
+files.ktx.HEADER_SIZE_ = 64;
+
+/**
+ * @typedef {{internalFormat: number, width: number, height: number,
+ *            levels: Array.<Uint8Array>}}
+ */
+files.ktx.Texture;
+
+/**
+ * Reads KTX file. Only little endian files with compressed 2D texture are
+ * supported. Mip levels are views of the buffer, the largest one first.
+ * @public
+ * @param {ArrayBuffer} buffer
+ * @return {?files.ktx.Texture} null if buffer isn't supported KTX file
+ */
+files.ktx.parse = function (buffer) {
+    var bytes = new Uint8Array(buffer);
+    var view, i, count, offset, size, levels = [];
+
+    if (buffer.byteLength < files.ktx.HEADER_SIZE_) {
+        return null;
+    }
+    for (i = 0; i < files.ktx.IDENTIFIER_.length; ++i) {
+        if (bytes[i] !== files.ktx.IDENTIFIER_[i]) {
+            return null;
+        }
+    }
+    view = new DataView(buffer);
+    if (view.getUint32(12, true) !== 0x04030201 || view.getUint32(16, true) !== 0) {
+        return null; // other endianness or not compressed
+    }
+
+    count = Math.max(1, view.getUint32(56, true));
+    offset = files.ktx.HEADER_SIZE_ + view.getUint32(60, true);
+    for (i = 0; i < count; ++i) {
+        if (offset + 4 > buffer.byteLength) {
+            return null;
+        }
+        size = view.getUint32(offset, true);
+        offset += 4;
+        if (offset + size > buffer.byteLength) {
+            return null;
+        }
+        levels.push(new Uint8Array(buffer, offset, size));
+        offset += size + (3 - (size + 3) % 4);
+    }
+
+    return {
+        internalFormat: view.getUint32(28, true),
+        width: view.getUint32(36, true),
+        height: view.getUint32(40, true),
+        levels: levels
+    };
+};
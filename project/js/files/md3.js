@@ -24,10 +24,26 @@ goog.require('goog.asserts');
 goog.provide('files.md3');
 
 /**
- * @param {ArrayBuffer} arrayBuffer
+ * Version of compiled models (.cmd3) made by tools/md3compiler.py
+ * @const
+ * @type {number}
+ */
+files.md3.COMPILED_VERSION = 1;
+
+/**
+ * Version of compiled models with compressed animation
+ * @const
+ * @type {number}
+ */
+files.md3.ANIMATED_VERSION = 2;
+
+/**
+ * @param {?ArrayBuffer} arrayBuffer null if the archive has only compiled model
  * @param {Object.<string, string>} skinFiles
+ * @param {ArrayBuffer} [compiled] Model compiled offline; md3 file is parsed if
+ * it's missing or unsupported
  */
-files.md3.load = function(arrayBuffer, skinFiles) {
+files.md3.load = function(arrayBuffer, skinFiles, compiled) {
 
     var skins = [],
         key,
@@ -38,7 +54,7 @@ files.md3.load = function(arrayBuffer, skinFiles) {
 	model,
 	i = 0,
         j = 0,
-	binaryFile = new files.BinaryFile(arrayBuffer);
+	binaryFile;
 
     // local functions
     function parseHeader_() {
@@ -186,7 +202,6 @@ files.md3.load = function(arrayBuffer, skinFiles) {
 	    vertex,
 	    frame,
 	    geometryData,
-            skinNames,
             off;
 
 	meshes = [];
@@ -204,7 +219,6 @@ files.md3.load = function(arrayBuffer, skinFiles) {
 	    
 	    count = surface.indices.length;
 	    verticesOffset = vertices[0].length;
-            materials = [];
 	    for (j = 0; j < count; ++j) {
 		indices.push(surface.indices[j] + verticesOffset);
 	    }
@@ -227,22 +241,16 @@ files.md3.load = function(arrayBuffer, skinFiles) {
 						 vertices.map(function(v) {
 						     return new Float32Array(v);
 						 }));
-            materials.push(surface.shaders[0].name); // material from md3
-            for (k = 0; k < skins.length; ++k) {
-                materials.push(skins[k].skin[surface.name]);
-            }
+            materials = files.md3.getMaterials_(surface.shaders[0].name, surface.name,
+                                                skins);
             // probably bug: indicesOffset shouldn't be 0?
 	    mesh = new base.Mesh(geometryData, indicesOffset, count,
 			    materials, base.LightningType.LIGHT_DYNAMIC);
 	    meshes.push(mesh);
 	}
         
-        skinNames = [base.Model.DEFAULT_SKIN].concat(skins.map(function (s) {
-            return s.name;
-        }));
-        
-	model = new base.Model(-1, meshes, header.framesCount,
-			       frames, base.Model.Type.MD3, tagNames, skinNames);
+	model = files.md3.createModel_(meshes, header.framesCount, frames, tagNames,
+                                       skins);
     }
 
     for( key in skinFiles ) {
@@ -251,6 +259,17 @@ files.md3.load = function(arrayBuffer, skinFiles) {
         }
     }
 
+    if (compiled) {
+        model = files.md3.readCompiled_(compiled, skins);
+        if (model) {
+            return model;
+        }
+    }
+    if (!arrayBuffer) {
+        throw "Invalid compiled md3 file";
+    }
+
+    binaryFile = new files.BinaryFile(arrayBuffer);
     header = parseHeader_();
 
     binaryFile.seek(header.surfacesOffset);
@@ -277,6 +296,265 @@ files.md3.load = function(arrayBuffer, skinFiles) {
     return model;
 };
 
+/**
+ * @private
+ * @param {string} shaderName Material from md3
+ * @param {string} surfaceName
+ * @param {Array.<{name: string, skin: Object.<string,string>}>} skins
+ * @return {Array.<string>} materials for default and every other skin
+ */
+files.md3.getMaterials_ = function (shaderName, surfaceName, skins) {
+    var k;
+    var materials = [shaderName];
+    for (k = 0; k < skins.length; ++k) {
+        materials.push(skins[k].skin[surfaceName]);
+    }
+    return materials;
+};
+
+/**
+ * @private
+ * @return {base.Model}
+ */
+files.md3.createModel_ = function (meshes, framesCount, frames, tagNames, skins) {
+    var skinNames = [base.Model.DEFAULT_SKIN].concat(skins.map(function (s) {
+        return s.name;
+    }));
+    return new base.Model(-1, meshes, framesCount, frames, base.Model.Type.MD3,
+                          tagNames, skinNames);
+};
+
+/**
+ * @private
+ * @param {ArrayBuffer} buffer
+ * @param {number} offset
+ * @return {string}
+ */
+files.md3.readName_ = function (buffer, offset) {
+    return String.fromCharCode.apply(null, new Uint8Array(buffer, offset, 64))
+        .replace(/\0*$/, '');
+};
+
+/**
+ * @private
+ * Reads model compiled by tools/md3compiler.py. Vertices, indices and tags
+ * of version 1 are views of the buffer; animation of version 2 is decoded.
+ * @param {ArrayBuffer} buffer
+ * @param {Array.<{name: string, skin: Object.<string,string>}>} skins
+ * @return {?base.Model} null if buffer isn't compiled model of known version
+ */
+files.md3.readCompiled_ = function (buffer, skins) {
+    var view, version, framesCount, tagsCount, surfacesCount;
+    var frames = [], tagNames = [], meshes = [];
+    var offset = 20, i, j, f, surface;
+
+    if (buffer.byteLength < offset ||
+        String.fromCharCode.apply(null, new Uint8Array(buffer, 0, 4)) !== 'CMD3') {
+        return null;
+    }
+    view = new DataView(buffer);
+    version = view.getUint32(4, true);
+    if (version !== files.md3.COMPILED_VERSION && version !== files.md3.ANIMATED_VERSION) {
+        return null;
+    }
+    framesCount = view.getUint32(8, true);
+    tagsCount = view.getUint32(12, true);
+    surfacesCount = view.getUint32(16, true);
+    if (offset + framesCount * (40 + tagsCount * 64) + tagsCount * 64 > buffer.byteLength) {
+        return null;
+    }
+
+    for (i = 0; i < framesCount; ++i) {
+        f = new Float32Array(buffer, offset, 10);
+        frames.push({
+            aabbMin: base.Vec3.createVal(f[0], f[1], f[2]),
+            aabbMax: base.Vec3.createVal(f[3], f[4], f[5]),
+            origin: base.Vec3.createVal(f[6], f[7], f[8]),
+            radius: f[9],
+            tags: []
+        });
+        offset += 40;
+    }
+    for (i = 0; i < tagsCount; ++i) {
+        tagNames.push(files.md3.readName_(buffer, offset));
+        offset += 64;
+    }
+    for (i = 0; i < framesCount; ++i) {
+        for (j = 0; j < tagsCount; ++j) {
+            frames[i].tags.push(new Float32Array(buffer, offset, 16));
+            offset += 64;
+        }
+    }
+
+    for (i = 0; i < surfacesCount; ++i) {
+        if (version === files.md3.COMPILED_VERSION) {
+            surface = files.md3.readCompiledSurface_(buffer, view, offset, framesCount);
+        } else {
+            surface = files.md3.readAnimatedSurface_(buffer, view, offset, framesCount);
+        }
+        if (!surface) {
+            return null;
+        }
+        meshes.push(new base.Mesh(new base.GeometryData(surface.indices, surface.vertices), 0,
+                                  surface.indices.length,
+                                  files.md3.getMaterials_(surface.shader, surface.name, skins),
+                                  base.LightningType.LIGHT_DYNAMIC));
+        offset = surface.end;
+    }
+
+    if (offset !== buffer.byteLength) {
+        return null;
+    }
+    return files.md3.createModel_(meshes, framesCount, frames, tagNames, skins);
+};
+
+/**
+ * @typedef {{name: string, shader: string, indices: Uint16Array,
+ *            vertices: Array.<Float32Array>, end: number}}
+ */
+files.md3.CompiledSurface;
+
+/**
+ * @private
+ * @param {ArrayBuffer} buffer
+ * @param {DataView} view
+ * @param {number} offset
+ * @param {number} framesCount
+ * @return {?files.md3.CompiledSurface} null if buffer is too short
+ */
+files.md3.readCompiledSurface_ = function (buffer, view, offset, framesCount) {
+    var name, shader, verticesCount, indicesCount, indices, j;
+    var vertices = [];
+
+    if (offset + 136 > buffer.byteLength) {
+        return null;
+    }
+    name = files.md3.readName_(buffer, offset);
+    shader = files.md3.readName_(buffer, offset + 64);
+    verticesCount = view.getUint32(offset + 128, true);
+    indicesCount = view.getUint32(offset + 132, true);
+    offset += 136;
+    if (offset + ((indicesCount * 2 + 3) & ~3) + framesCount * verticesCount * 32 >
+        buffer.byteLength) {
+        return null;
+    }
+    indices = new Uint16Array(buffer, offset, indicesCount);
+    offset += (indicesCount * 2 + 3) & ~3;
+    for (j = 0; j < framesCount; ++j) {
+        vertices.push(new Float32Array(buffer, offset, verticesCount * 8));
+        offset += verticesCount * 32;
+    }
+    return {name: name, shader: shader, indices: indices, vertices: vertices, end: offset};
+};
+
+/**
+ * @private
+ * Decodes key frames of surface with compressed animation and builds every
+ * frame from them. Frames equal to a key frame share its vertex array.
+ * @param {ArrayBuffer} buffer
+ * @param {DataView} view
+ * @param {number} offset
+ * @param {number} framesCount
+ * @return {?files.md3.CompiledSurface} null if buffer is too short or broken
+ */
+files.md3.readAnimatedSurface_ = function (buffer, view, offset, framesCount) {
+    var name, shader, verticesCount, indicesCount, keysCount, bounds, refsOffset,
+        indices, texCoords, quantized, normalBytes, position, normal, keys = [],
+        vertices = [], frame, a, b, t, i, j, k, v, q, lat, lng;
+    var table = files.md3.getNormalTable_();
+
+    if (offset + 140 > buffer.byteLength) {
+        return null;
+    }
+    name = files.md3.readName_(buffer, offset);
+    shader = files.md3.readName_(buffer, offset + 64);
+    verticesCount = view.getUint32(offset + 128, true);
+    indicesCount = view.getUint32(offset + 132, true);
+    keysCount = view.getUint32(offset + 136, true);
+    offset += 140;
+    if (offset + 24 + framesCount * 8 + ((indicesCount * 2 + 3) & ~3) +
+        verticesCount * 8 * (keysCount + 1) > buffer.byteLength) {
+        return null;
+    }
+    bounds = new Float32Array(buffer, offset, 6);
+    offset += 24;
+    refsOffset = offset;
+    offset += framesCount * 8;
+    indices = new Uint16Array(buffer, offset, indicesCount);
+    offset += (indicesCount * 2 + 3) & ~3;
+    texCoords = new Float32Array(buffer, offset, verticesCount * 2);
+    offset += verticesCount * 8;
+    quantized = new Uint16Array(buffer, offset, keysCount * verticesCount * 4);
+    normalBytes = new Int8Array(buffer, offset, keysCount * verticesCount * 8);
+    offset += keysCount * verticesCount * 8;
+
+    // key frames are stored as differences, typed arrays wrap them around
+    position = new Uint16Array(verticesCount * 3);
+    normal = new Int8Array(verticesCount * 2);
+    for (k = 0, q = 0; k < keysCount; ++k) {
+        frame = new Float32Array(verticesCount * 8);
+        for (v = 0; v < verticesCount; ++v, q += 4) {
+            for (i = 0; i < 3; ++i) {
+                position[3 * v + i] += quantized[q + i];
+                frame[8 * v + i] = bounds[i] + bounds[3 + i] * position[3 * v + i];
+            }
+            normal[2 * v] += normalBytes[2 * q + 6];
+            normal[2 * v + 1] += normalBytes[2 * q + 7];
+            lat = normal[2 * v] & 0xff;
+            lng = normal[2 * v + 1] & 0xff;
+            frame[8 * v + 3] = texCoords[2 * v];
+            frame[8 * v + 4] = texCoords[2 * v + 1];
+            frame[8 * v + 5] = table.cos[lng] * table.sin[lat];
+            frame[8 * v + 6] = table.sin[lng] * table.cos[lat];
+            frame[8 * v + 7] = table.cos[lat];
+        }
+        keys.push(frame);
+    }
+
+    for (j = 0; j < framesCount; ++j) {
+        a = view.getUint16(refsOffset + 8 * j, true);
+        b = view.getUint16(refsOffset + 8 * j + 2, true);
+        t = view.getFloat32(refsOffset + 8 * j + 4, true);
+        if (a >= keysCount || b >= keysCount) {
+            return null;
+        }
+        if (a === b || t === 0) {
+            vertices.push(keys[a]);
+        } else {
+            frame = new Float32Array(verticesCount * 8);
+            for (i = 0; i < frame.length; ++i) {
+                frame[i] = keys[a][i] + (keys[b][i] - keys[a][i]) * t;
+            }
+            vertices.push(frame);
+        }
+    }
+    return {name: name, shader: shader, indices: indices, vertices: vertices, end: offset};
+};
+
+/**
+ * @private
+ * @type {?{cos: Float64Array, sin: Float64Array}}
+ */
+files.md3.normalTable_ = null;
+
+/**
+ * @private
+ * Sines and cosines of angles of md3 normals, indexed by angle's byte
+ * @return {{cos: Float64Array, sin: Float64Array}}
+ */
+files.md3.getNormalTable_ = function () {
+    var i, angle;
+    if (!files.md3.normalTable_) {
+        files.md3.normalTable_ = {cos: new Float64Array(256), sin: new Float64Array(256)};
+        for (i = -128; i < 128; ++i) {
+            angle = i * 2 * Math.PI / 255;
+            files.md3.normalTable_.cos[i & 0xff] = Math.cos(angle);
+            files.md3.normalTable_.sin[i & 0xff] = Math.sin(angle);
+        }
+    }
+    return files.md3.normalTable_;
+};
+
 /**
  * @private
  * @return {Object.<string,string>}
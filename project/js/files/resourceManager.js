@@ -21,6 +21,7 @@ goog.require('goog.debug.Logger');
 goog.require('goog.async.DeferredList');
 goog.require('goog.async.Deferred');
 goog.require('goog.array');
+goog.require('goog.object');
 goog.require('base');
 goog.require('files.zipjs');
 // goog.require('files.md3');
@@ -95,6 +96,11 @@ files.ResourceManager.Archive = function (name, deferred) {
     this.models = {};
     this.textures = {};
     this.configs = {};
+    /**
+     * Textures this archive takes from other (shared) archives, by archive name
+     * @type {Object.<string, Array.<string>>}
+     */
+    this.shared = {};
     this.state = files.ResourceManager.Archive.State.LOADING;
     this.loadingDeferred = deferred;
 };
@@ -108,6 +114,39 @@ files.ResourceManager.Archive.State = {
     ERROR: -1
 };
 
+/**
+ * @const
+ * @type {string}
+ * Generated by the packer; lists textures packed to shared archives.
+ */
+files.ResourceManager.SHARED_LIST = 'shared.json';
+
+/**
+ * @const
+ * @type {string}
+ * Generated by the packer next to the archive; offsets and sizes of entries.
+ */
+files.ResourceManager.INDEX_SUFFIX = '.index.json';
+
+/**
+ * @const
+ * @type {number}
+ */
+files.ResourceManager.INDEX_VERSION = 1;
+
+/**
+ * @const
+ * @type {string}
+ * Generated by the packer next to an archive with lower resolution tiers.
+ */
+files.ResourceManager.TIERS_SUFFIX = '.tiers.json';
+
+/**
+ * @const
+ * @type {number}
+ */
+files.ResourceManager.TIERS_VERSION = 1;
+
 /**
  * @private
  */
@@ -222,12 +261,16 @@ files.ResourceManager.prototype.release = function (archiveName) {
 
 
 /**
+ * With opt_onTier, if the archive has lower resolution tiers (packer.py
+ * --tiers), the smallest one is loaded as the archive and textures of next
+ * tiers are loaded after it; opt_onTier is called with textures of every one.
+ * Shared archives used by the archive are loaded through their tiers too.
  * @public
  * @param {string} archiveName
+ * @param {function(Object.<string, (string|ArrayBuffer)>)} [opt_onTier]
  * @returns {goog.async.Deferred}
- * @suppress {checkTypes|undefinedNames}
  */
-files.ResourceManager.prototype.load = function (archiveName) {
+files.ResourceManager.prototype.load = function (archiveName, opt_onTier) {
     var that = this;
     var deferred = null;
     var archive = goog.array.find(this.archives, function (elem) {
@@ -240,30 +283,162 @@ files.ResourceManager.prototype.load = function (archiveName) {
         deferred = new goog.async.Deferred();
         archive = new files.ResourceManager.Archive(archiveName, deferred);
         this.archives.push(archive);
-        files.zipjs.createReader(new files.zipjs.HttpReader(this.basedir + archiveName + '.zip'),
-		                 function (reader) {
-			             reader.getEntries(
-			                 function (entries) {
-                                             var entriesDeferred = that.loadEntries(archive,
-                                                                                    entries);
-                                             entriesDeferred.addCallback(function () {
-                                                 archive.state = files.ResourceManager.
-                                                     Archive.State.LOADED;
-                                                 deferred.callback(archive);
-                                                 return archive;
-                                             });
-			                 });
-		                 },
-                                 function () {
-                                     that.logger.log(goog.debug.Logger.Level.SEVERE,
-			                             'Unable to load archive ' + archiveName);
-                                     archive.state = files.ResourceManager.Archive.State.ERROR;
-                                     deferred.errback(archive);
-                                 });
+        if (!opt_onTier) {
+            this.loadArchive_(archive, archiveName, deferred);
+            return deferred;
+        }
+        this.loadJson_(this.basedir + archiveName + files.ResourceManager.TIERS_SUFFIX,
+                       files.ResourceManager.TIERS_VERSION, function (tiers) {
+            if (!tiers) {
+                that.loadArchive_(archive, archiveName, deferred, undefined,
+                                  opt_onTier);
+                return;
+            }
+            // added after callbacks of the caller, so next tiers come later
+            deferred.addCallback(function (result) {
+                that.loadTiers_(archiveName, tiers['tiers'].slice(1), opt_onTier);
+                return result;
+            });
+            that.loadArchive_(archive, archiveName + tiers['tiers'][0]['suffix'], deferred,
+                              undefined, opt_onTier);
+        });
         return deferred;
     }
 };
 
+/**
+ * Loads textures of tiers one by one
+ * @private
+ * @param {string} archiveName
+ * @param {Array.<Object>} tiers
+ * @param {function(Object.<string, (string|ArrayBuffer)>)} onTier
+ */
+files.ResourceManager.prototype.loadTiers_ = function (archiveName, tiers, onTier) {
+    var that = this;
+    var deferred, archive;
+    if (tiers.length === 0) {
+        return;
+    }
+    deferred = new goog.async.Deferred();
+    archive = new files.ResourceManager.Archive(archiveName, deferred);
+    deferred.addCallback(function (archive) {
+        onTier(archive.textures);
+        that.loadTiers_(archiveName, tiers.slice(1), onTier);
+    });
+    this.loadArchive_(archive, archiveName + tiers[0]['suffix'], deferred,
+                      files.ResourceManager.isTexture_);
+};
+
+/**
+ * @private
+ * @param {string} filename
+ * @return {boolean}
+ */
+files.ResourceManager.isTexture_ = function (filename) {
+    return /\.(png|jpg|ktx)$/.test(filename);
+};
+
+/**
+ * Loads entries of the archive file (basedir + name + '.zip'), only those
+ * accepted by opt_filter if it's given, to archive. Shared archives are
+ * loaded with opt_onTier, as in load.
+ * @private
+ * @param {files.ResourceManager.Archive} archive
+ * @param {string} name
+ * @param {goog.async.Deferred} deferred
+ * @param {function(string): boolean} [opt_filter]
+ * @param {function(Object.<string, (string|ArrayBuffer)>)} [opt_onTier]
+ * @suppress {checkTypes|undefinedNames}
+ */
+files.ResourceManager.prototype.loadArchive_ = function (archive, name, deferred,
+                                                         opt_filter, opt_onTier) {
+    var that = this;
+    var url = this.basedir + name + '.zip';
+    var onEntries = function (entries) {
+        if (opt_filter) {
+            entries = entries.filter(function (entry) {
+                return opt_filter(entry.filename);
+            });
+        }
+        var entriesDeferred = that.loadEntries(archive, entries);
+        entriesDeferred.addCallback(function () {
+            return that.loadShared_(archive, opt_onTier);
+        });
+        entriesDeferred.addCallback(function () {
+            archive.state = files.ResourceManager.Archive.State.LOADED;
+            deferred.callback(archive);
+            return archive;
+        });
+    };
+    var onError = function () {
+        that.logger.log(goog.debug.Logger.Level.SEVERE,
+			    'Unable to load archive ' + name);
+        archive.state = files.ResourceManager.Archive.State.ERROR;
+        deferred.errback(archive);
+    };
+    // whole archive is downloaded before its central directory is read
+    var loadWhole = function () {
+        files.zipjs.createReader(new files.zipjs.HttpReader(url), function (reader) {
+            reader.getEntries(onEntries);
+        }, onError);
+    };
+
+    // With the index every entry is fetched with its own range request,
+    // in order of the archive, so the map is parsed while textures are
+    // still downloading
+    this.loadJson_(this.basedir + name + files.ResourceManager.INDEX_SUFFIX,
+                   files.ResourceManager.INDEX_VERSION, function (index) {
+        if (!index) {
+            loadWhole();
+            return;
+        }
+        var rangeReader = new files.zipjs.HttpRangeReader(url);
+        files.zipjs.createReader(rangeReader, function (reader) {
+            // a different size means the server sends the archive
+            // compressed (e.g. a .gz sidecar), so ranges don't match
+            if (rangeReader.size !== index['size']) {
+                loadWhole();
+                return;
+            }
+            // a server may announce ranges, but send the whole archive
+            // anyway; one range is read to check it before entries are
+            rangeReader.readUint8Array(0, 4, function () {
+                onEntries(reader.getIndexedEntries(index['entries']));
+            }, loadWhole);
+        }, loadWhole);
+    });
+};
+
+/**
+ * Calls callback with a file generated by the packer along with the archive
+ * (index, tiers), or null if there's none of that version
+ * @private
+ * @param {string} url
+ * @param {number} version
+ * @param {function(Object)} callback
+ */
+files.ResourceManager.prototype.loadJson_ = function (url, version, callback) {
+    var request = new XMLHttpRequest();
+    request.addEventListener('load', function () {
+        var data = null;
+        if (request.status === 200) {
+            try {
+                data = JSON.parse(request.responseText);
+            } catch (e) {
+            }
+        }
+        if (data && data['version'] !== version) {
+            data = null;
+        }
+        callback(data);
+    }, false);
+    request.addEventListener('error', function () {
+        callback(null);
+    }, false);
+    request.open('GET', url);
+    request.send();
+};
+
 /**
  * @private
  * @suppress {checkTypes|undefinedNames}
@@ -280,20 +455,36 @@ files.ResourceManager.prototype.loadEntries = function (archive, entries) {
         
         filename = entry.filename;
         ext = filename.slice(filename.lastIndexOf('.') + 1);
+        if (filename === files.ResourceManager.SHARED_LIST) {
+            deferred.awaitDeferred(this.loadSharedList_(archive, entry));
+            continue;
+        }
         switch (ext) {
         case 'png': case 'jpg':
             localDeferred = this.loadTexture_(archive, entry, ext);
 	    break;
-        case 'shader':
+        case 'ktx':
+            localDeferred = this.loadCompressedTexture_(archive, entry);
+            break;
+        case 'shader': case 'cshader':
             localDeferred = this.loadShaders_(archive, entry);
 	    break;
         case 'md3':
             localDeferred = this.loadMd3WithSkins_(archive, entry, entries);
 	    break;
+        case 'cmd3':
+            // compiled model is loaded with md3, unless it replaces md3
+            if (!goog.array.find(entries, function (e) {
+                return e.filename === filename.replace(/\.cmd3$/, '.md3');
+            })) {
+                localDeferred = this.loadMd3WithSkins_(archive, entry, entries);
+            }
+            break;
         case 'bsp':
-            localDeferred = this.loadBsp_(archive, entry);
-        case 'skin':
-            // skip; will be loaded with appropriate model
+            localDeferred = this.loadBsp_(archive, entry, entries);
+            break;
+        case 'skin': case 'cbsp': case 'lightmap': case 'pvs': case 'ccol':
+            // skip; will be loaded with appropriate model or map
             break;
         default:
             localDeferred = this.loadConfigFile_(archive, entry);
@@ -311,12 +502,17 @@ files.ResourceManager.prototype.loadEntries = function (archive, entries) {
  */
 files.ResourceManager.prototype.loadMd3WithSkins_ = function (archive, modelEntry, allEntries) {
     var that = this;
-    var modelPath = modelEntry.filename;
-    var modelData, path, regexp, skins = {}, skinEntries = {};
+    var modelPath = modelEntry.filename.replace(/\.cmd3$/, '.md3');
+    var modelData = null, compiledData = null, path, regexp, skins = {}, skinEntries = {};
+    var compiledEntry;
     var i = 0;
     var deferred = new goog.async.Deferred();
     
     path = modelPath.replace('.md3', '');
+    // optional model compiled by the packer
+    compiledEntry = goog.array.find(allEntries, function (entry) {
+        return entry.filename === path + '.cmd3';
+    });
     regexp = new RegExp(path + '_(.*)\\.skin');
     
     skinEntries = allEntries.filter(function (entry) {
@@ -337,19 +533,38 @@ files.ResourceManager.prototype.loadMd3WithSkins_ = function (archive, modelEntr
         })();
     }
 
-    modelEntry.getData(new files.zipjs.ArrayBufferWriter(), function(arrayBuffer) {
-        modelData = arrayBuffer;
+    if (compiledEntry) {
+        (function () {
+            var localDeferred = new goog.async.Deferred();
+            compiledEntry.getData(new files.zipjs.ArrayBufferWriter(), function(arrayBuffer) {
+                compiledData = arrayBuffer;
+                localDeferred.callback();
+            });
+            deferred.awaitDeferred(localDeferred);
+        })();
+    }
+
+    if (modelEntry === compiledEntry) {
         deferred.callback();
-    });
+    } else {
+        modelEntry.getData(new files.zipjs.ArrayBufferWriter(), function(arrayBuffer) {
+            modelData = arrayBuffer;
+            deferred.callback();
+        });
+    }
 
     // wait for all skins and ArrayBuffer with md3 file to be available
     deferred.addCallback(function () {
         var localDeffered = new goog.async.Deferred();
-        function loadModel(modelData, skins) {
-            var model = files.md3.load(modelData, skins);
+        function loadModel(modelData, skins, compiledData) {
+            var model = files.md3.load(modelData, skins, compiledData);
             return model;
         }
-        that.jobsPool.execute(loadModel, [modelData, skins], [modelData], function (model) {
+        var transferables = [modelData, compiledData].filter(function (data) {
+            return data !== null;
+        });
+        that.jobsPool.execute(loadModel, [modelData, skins, compiledData], transferables,
+                              function (model) {
             model.id = files.ResourceManager.getNextModelId_();
             archive.models[modelPath] = model;
             localDeffered.callback();
@@ -393,13 +608,33 @@ files.ResourceManager.prototype.loadTexture_ = function (archive, entry, ext) {
     return deferred;
 };
 
+/**
+ * @private
+ * Compressed texture is passed to the renderer as it is (KTX file).
+ * @return {goog.async.Deferred}
+ */
+files.ResourceManager.prototype.loadCompressedTexture_ = function (archive, entry) {
+    var deferred = new goog.async.Deferred();
+    var name = entry.filename.replace(/\.ktx$/, '');
+
+    entry.getData(new files.zipjs.ArrayBufferWriter(), function(buffer) {
+        archive.textures[name] = buffer;
+        deferred.callback();
+    });
+
+    return deferred;
+};
+
 files.ResourceManager.prototype.loadShaders_ = function (archive, entry) {
     var deferred = new goog.async.Deferred();
     var filename = entry.filename;
     
     entry.getData(new files.zipjs.TextWriter(), function(text) {
         var i = 0;
-        var shaders = files.ShaderScriptLoader.load(text);
+        // shaders compiled by the packer are already parsed
+        var shaders = filename.slice(-8) === '.cshader' ?
+                files.ShaderScriptLoader.loadCompiled(text) :
+                files.ShaderScriptLoader.load(text);
         for (i = 0; i < shaders.length; ++i) {
             archive.scripts[shaders[i].name] = shaders[i];
         }
@@ -409,25 +644,54 @@ files.ResourceManager.prototype.loadShaders_ = function (archive, entry) {
     return deferred;
 };
 
-files.ResourceManager.prototype.loadBsp_ = function (archive, entry) {
+files.ResourceManager.prototype.loadBsp_ = function (archive, entry, allEntries) {
     var that = this;
     var deferred = new goog.async.Deferred();
+    // optional files made by the packer: precompiled geometry, lightmap atlas,
+    // visibility table and collision tree
+    var optionalEntries = ['.cbsp', '.lightmap', '.pvs', '.ccol'].map(function (ext) {
+        var name = entry.filename.replace(/\.bsp$/, ext);
+        return goog.array.find(allEntries, function (elem) {
+            return elem.filename === name;
+        });
+    });
+    var buffers = [];
 
     goog.asserts.assert(archive.map === null);
-    
-    entry.getData(new files.zipjs.ArrayBufferWriter(), function(arrayBuffer) {
-//        var worker = that.bspWorker;
+
+    var loadMap = function () {
         var pool = that.jobsPool;
-        pool.execute(function (buffer) {
-            var map = files.bsp.load(buffer);
+        pool.execute(function (buffer, compiled, lightmaps, visibility, collision) {
+            var map = files.bsp.load(buffer, compiled, lightmaps, visibility, collision);
             return map;
-        }, [arrayBuffer], [arrayBuffer], function (map) {
+        }, buffers, buffers.filter(function (b) { return b !== null; }), function (map) {
             map.models.forEach(function (model) {
                 model.id = files.ResourceManager.getNextModelId_();
             });
             archive.map = map;
             deferred.callback();
         });
+    };
+
+    var readOptional = function () {
+        var next = optionalEntries[buffers.length - 1];
+        if (buffers.length > optionalEntries.length) {
+            loadMap();
+        } else if (!next) {
+            buffers.push(null);
+            readOptional();
+        } else {
+            next.getData(new files.zipjs.ArrayBufferWriter(), function (buffer) {
+                buffers.push(buffer);
+                readOptional();
+            });
+        }
+    };
+    
+    entry.getData(new files.zipjs.ArrayBufferWriter(), function(arrayBuffer) {
+//        var worker = that.bspWorker;
+        buffers.push(arrayBuffer);
+        readOptional();
         // worker.onmessage = function(evt) {
         //     var map = evt.data;//files.bsp.load(arrayBuffer);
         //     map.models.forEach(function (model) {
@@ -451,6 +715,51 @@ files.ResourceManager.prototype.loadBsp_ = function (archive, entry) {
     return deferred;
 };
 
+files.ResourceManager.prototype.loadSharedList_ = function (archive, entry) {
+    var deferred = new goog.async.Deferred();
+
+    entry.getData(new files.zipjs.TextWriter(), function(text) {
+        archive.shared = JSON.parse(text);
+        deferred.callback();
+    });
+
+    return deferred;
+};
+
+/**
+ * @private
+ * Loads archives listed in archive.shared and makes their textures available
+ * in archive. Shared archives stay loaded, so other archives reuse them.
+ * With opt_onTier they're loaded through their tiers, as in load, so the
+ * archive waits only for their smallest tier.
+ * @param {files.ResourceManager.Archive} archive
+ * @param {function(Object.<string, (string|ArrayBuffer)>)} [opt_onTier]
+ * @return {goog.async.Deferred}
+ */
+files.ResourceManager.prototype.loadShared_ = function (archive, opt_onTier) {
+    var that = this;
+    var deferred = goog.async.Deferred.succeed();
+
+    goog.object.forEach(archive.shared, function (textures, archiveName) {
+        var localDeferred = new goog.async.Deferred();
+        that.load(archiveName, opt_onTier).addCallbacks(function (sharedArchive) {
+            textures.forEach(function (filename) {
+                var name = filename.replace(/\.(jpg|png|ktx)$/, '');
+                archive.textures[name] = sharedArchive.textures[name];
+            });
+            localDeferred.callback();
+            return sharedArchive;
+        }, function (sharedArchive) {
+            // already logged by load; textures stay missing
+            localDeferred.callback();
+            return sharedArchive;
+        });
+        deferred.awaitDeferred(localDeferred);
+    });
+
+    return deferred;
+};
+
 files.ResourceManager.prototype.loadConfigFile_ = function (archive, entry) {
     var deferred = new goog.async.Deferred();
     var filename = entry.filename;
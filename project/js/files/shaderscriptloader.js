@@ -48,6 +48,7 @@
 
 "use strict";
 
+goog.require('goog.asserts');
 goog.require('base.ShaderScript');
 goog.provide('files.ShaderScriptLoader');
 
@@ -79,17 +80,191 @@ files.ShaderScriptLoader.load = function(src) {
     return shaderScripts;
 };
 
+/**
+ * Version of shaders compiled by tools/shadercompiler.py
+ * @const
+ * @type {number}
+ */
+files.ShaderScriptLoader.COMPILED_VERSION = 2;
+
+/**
+ * Loads shaders compiled by tools/shadercompiler.py (.cshader). They're
+ * already parsed; only fields which differ from defaults are stored. GLSL
+ * sources are generated by the compiler too; stages with identical programs
+ * share the same shaderSrc.
+ * @public
+ * @param {string} src
+ * @return {Array.<base.ShaderScript>}
+ */
+files.ShaderScriptLoader.loadCompiled = function(src) {
+    var compiled = JSON.parse(src),
+	programs = [],
+	shaderScripts = [],
+	program,
+	i;
+
+    goog.asserts.assert(compiled['version'] === files.ShaderScriptLoader.COMPILED_VERSION,
+                        'Unsupported compiled shaders version');
+    for (i = 0; i < compiled['programs'].length; ++i) {
+        program = compiled['programs'][i];
+        programs.push({
+            vertex: program['vertex'],
+            fragment: program['fragment']
+        });
+    }
+    for (i = 0; i < compiled['shaders'].length; ++i) {
+        shaderScripts.push(/**@type {base.ShaderScript}*/(
+            files.ShaderScriptLoader.readCompiledShader_(compiled['shaders'][i], programs)));
+    }
+    return shaderScripts;
+};
+
+// Objects parsed from JSON have quoted keys, which the compiler doesn't
+// rename, so their fields are copied one by one to objects with the same
+// fields as those built by the parser.
+
 /**
  * @private
+ * @param {Object} object Parsed JSON object
+ * @param {string} key
+ * @param {*} defaultValue Value if the key was left out
+ * @return {*}
  */
-files.ShaderScriptLoader.parseShader = function(name, tokens) {
-    var brace = tokens.next(),
-	shader;
-    if(brace !== '{') {
+files.ShaderScriptLoader.get_ = function(object, key, defaultValue) {
+    return object.hasOwnProperty(key) ? object[key] : defaultValue;
+};
+
+/**
+ * @private
+ * @param {Object} s Shader from .cshader
+ * @param {Array.<{vertex: string, fragment: string}>} programs
+ * @return {Object}
+ */
+files.ShaderScriptLoader.readCompiledShader_ = function(s, programs) {
+    var get = files.ShaderScriptLoader.get_,
+	shader = files.ShaderScriptLoader.createShader_(s['name']),
+	deforms = get(s, 'vertexDeforms', []),
+	stages = get(s, 'stages', []),
+	i;
+
+    shader.isDefault = get(s, 'isDefault', shader.isDefault);
+    shader.cull = get(s, 'cull', shader.cull);
+    shader.sky = get(s, 'sky', shader.sky);
+    shader.blend = get(s, 'blend', shader.blend);
+    shader.opaque = get(s, 'opaque', shader.opaque);
+    shader.sort = get(s, 'sort', shader.sort);
+    for (i = 0; i < deforms.length; ++i) {
+        shader.vertexDeforms.push({
+            type: deforms[i]['type'],
+            spread: deforms[i]['spread'],
+            waveform: files.ShaderScriptLoader.readCompiledWaveform_(deforms[i]['waveform'])
+        });
+    }
+    for (i = 0; i < stages.length; ++i) {
+        shader.stages.push(files.ShaderScriptLoader.readCompiledStage_(stages[i], programs));
+    }
+    return shader;
+};
+
+/**
+ * @private
+ * @param {Object} s Stage from .cshader
+ * @param {Array.<{vertex: string, fragment: string}>} programs
+ * @return {Object}
+ */
+files.ShaderScriptLoader.readCompiledStage_ = function(s, programs) {
+    var get = files.ShaderScriptLoader.get_,
+	stage = files.ShaderScriptLoader.createStage_(),
+	tcMods = get(s, 'tcMods', []),
+	i;
+
+    stage.map = get(s, 'map', stage.map);
+    stage.clamp = get(s, 'clamp', stage.clamp);
+    stage.tcGen = get(s, 'tcGen', stage.tcGen);
+    stage.rgbGen = get(s, 'rgbGen', stage.rgbGen);
+    stage.rgbWaveform = files.ShaderScriptLoader.readCompiledWaveform_(
+        get(s, 'rgbWaveform', null));
+    stage.alphaGen = get(s, 'alphaGen', stage.alphaGen);
+    stage.alphaFunc = get(s, 'alphaFunc', stage.alphaFunc);
+    stage.alphaWaveform = files.ShaderScriptLoader.readCompiledWaveform_(
+        get(s, 'alphaWaveform', null));
+    stage.blendSrc = get(s, 'blendSrc', stage.blendSrc);
+    stage.blendDest = get(s, 'blendDest', stage.blendDest);
+    stage.hasBlendFunc = get(s, 'hasBlendFunc', stage.hasBlendFunc);
+    stage.animMaps = get(s, 'animMaps', stage.animMaps);
+    stage.animFreq = get(s, 'animFreq', stage.animFreq);
+    stage.depthFunc = get(s, 'depthFunc', stage.depthFunc);
+    stage.depthWrite = get(s, 'depthWrite', stage.depthWrite);
+    stage.isLightmap = get(s, 'isLightmap', stage.isLightmap);
+    stage.shaderSrc = programs[s['shaderSrc']];
+    for (i = 0; i < tcMods.length; ++i) {
+        stage.tcMods.push(files.ShaderScriptLoader.readCompiledTcMod_(tcMods[i]));
+    }
+    return stage;
+};
+
+/**
+ * @private
+ * @param {Object} w Waveform from .cshader or null
+ * @return {Object}
+ */
+files.ShaderScriptLoader.readCompiledWaveform_ = function(w) {
+    if (!w) {
         return null;
     }
+    return {
+        funcName: w['funcName'],
+        base: w['base'],
+        amp: w['amp'],
+        phase: w['phase'],
+        freq: w['freq']
+    };
+};
 
-    shader = {
+/**
+ * @private
+ * @param {Object} m tcMod from .cshader
+ * @return {Object}
+ */
+files.ShaderScriptLoader.readCompiledTcMod_ = function(m) {
+    var tcMod = {
+        type: m['type']
+    };
+    switch(tcMod.type) {
+        case 'rotate':
+            tcMod.angle = m['angle'];
+            break;
+        case 'scale':
+            tcMod.scaleX = m['scaleX'];
+            tcMod.scaleY = m['scaleY'];
+            break;
+        case 'scroll':
+            tcMod.sSpeed = m['sSpeed'];
+            tcMod.tSpeed = m['tSpeed'];
+            break;
+        case 'stretch':
+            tcMod.waveform = files.ShaderScriptLoader.readCompiledWaveform_(m['waveform']);
+            break;
+        case 'turb':
+            tcMod.turbulance = {
+                base: m['turbulance']['base'],
+                amp: m['turbulance']['amp'],
+                phase: m['turbulance']['phase'],
+                freq: m['turbulance']['freq']
+            };
+            break;
+        default: break;
+    }
+    return tcMod;
+};
+
+/**
+ * @private
+ * @param {string} name
+ * @return {Object}
+ */
+files.ShaderScriptLoader.createShader_ = function(name) {
+    return {
 	name: name,
 	isDefault: false,
         cull: 'back',
@@ -100,6 +275,46 @@ files.ShaderScriptLoader.parseShader = function(name, tokens) {
         vertexDeforms: [],
         stages: []
     };
+};
+
+/**
+ * @private
+ * @return {Object}
+ */
+files.ShaderScriptLoader.createStage_ = function() {
+    return {
+        map: null,
+        clamp: false,
+        tcGen: 'base',
+        rgbGen: 'identity',
+        rgbWaveform: null,
+        alphaGen: '1.0',
+        alphaFunc: null,
+        alphaWaveform: null,
+        blendSrc: 'GL_ONE',
+        blendDest: 'GL_ZERO',
+        hasBlendFunc: false,
+        tcMods: [],
+        animMaps: [],
+        animFreq: 0,
+        depthFunc: 'lequal',
+        depthWrite: true,
+	isLightmap: false,
+	shaderSrc: null
+    };
+};
+
+/**
+ * @private
+ */
+files.ShaderScriptLoader.parseShader = function(name, tokens) {
+    var brace = tokens.next(),
+	shader;
+    if(brace !== '{') {
+        return null;
+    }
+
+    shader = files.ShaderScriptLoader.createShader_(name);
 
     // Parse a shader
     while(!tokens.EOF()) {
@@ -193,26 +408,7 @@ files.ShaderScriptLoader.parseShader = function(name, tokens) {
  * @private
  */
 files.ShaderScriptLoader.parseStage = function(shader, tokens) {
-    var stage = {
-        map: null,
-        clamp: false,
-        tcGen: 'base',
-        rgbGen: 'identity',
-        rgbWaveform: null,
-        alphaGen: '1.0',
-        alphaFunc: null,
-        alphaWaveform: null,
-        blendSrc: 'GL_ONE',
-        blendDest: 'GL_ZERO',
-        hasBlendFunc: false,
-        tcMods: [],
-        animMaps: [],
-        animFreq: 0,
-        depthFunc: 'lequal',
-        depthWrite: true,
-	isLightmap: false,
-	shaderSrc: null
-    };
+    var stage = files.ShaderScriptLoader.createStage_();
 
     // Parse a shader
     while(!tokens.EOF()) {
@@ -261,7 +261,11 @@ files.zipjs = (function(obj) {
 	     request.responseType = "arraybuffer";
 	     request.setRequestHeader("Range", "bytes=" + index + "-" + (index + length - 1));
 	     request.addEventListener("load", function() {
-				          callback(request.response);
+				          // a server ignoring Range sends the whole file
+				          if (request.status === 206)
+					      callback(request.response);
+				          else
+					      onerror(ERR_HTTP_RANGE);
 			              }, false);
 	     request.addEventListener("error", onerror, false);
 	     request.send();
@@ -743,20 +747,28 @@ files.zipjs = (function(obj) {
 		 terminate(onerror, ERR_WRITE_DATA);
 	     }
 
+	     function readData(dataOffset) {
+		 writer.init(function() {
+				 if (that.compressionMethod === 0)
+				     copy(reader, writer, dataOffset, that.compressedSize, checkCrc32, getWriterData, onprogress, onreaderror, onwriteerror);
+				 else
+				     worker = inflate(reader, writer, dataOffset, that.compressedSize, checkCrc32, getWriterData, onprogress, onreaderror, onwriteerror);
+			     }, onwriteerror);
+	     }
+
+	     // entries from an index know where their data starts
+	     if (that.dataOffset !== undefined) {
+		 readData(that.dataOffset);
+		 return;
+	     }
 	     reader.readUint8Array(that.offset, 30, function(bytes) {
-				       var data = getDataHelper(bytes.length, bytes), dataOffset;
+				       var data = getDataHelper(bytes.length, bytes);
 				       if (data.view.getUint32(0) != 0x504b0304) {
 					   onerror(ERR_BAD_FORMAT);
 					   return;
 				       }
 				       readCommonHeader(that, data, 4);
-				       dataOffset = that.offset + 30 + that.filenameLength + that.extraFieldLength;
-				       writer.init(function() {
-					               if (that.compressionMethod === 0)
-						           copy(reader, writer, dataOffset, that.compressedSize, checkCrc32, getWriterData, onprogress, onreaderror, onwriteerror);
-					               else
-						           worker = inflate(reader, writer, dataOffset, that.compressedSize, checkCrc32, getWriterData, onprogress, onreaderror, onwriteerror);
-				                   }, onwriteerror);
+				       readData(that.offset + 30 + that.filenameLength + that.extraFieldLength);
 			           }, onreaderror);
 	 };
 
@@ -804,6 +816,24 @@ files.zipjs = (function(obj) {
 					   onerror(ERR_READ);
 				       });
 	     },
+	     // entries described by the index written along with the archive
+	     // (tools/packer.py), so the central directory doesn't have to be read
+	     getIndexedEntries : function(index) {
+		 // keys of the parsed index are quoted, so the compiler doesn't
+		 // rename them along with fields of entries
+		 return index.map(function(item) {
+				      var entry = new Entry();
+				      entry.filename = item["filename"];
+				      entry.directory = false;
+				      entry.offset = item["offset"];
+				      entry.dataOffset = item["dataOffset"];
+				      entry.compressionMethod = item["compressionMethod"];
+				      entry.compressedSize = item["compressedSize"];
+				      entry.uncompressedSize = item["uncompressedSize"];
+				      entry.crc32 = item["crc32"];
+				      return entry;
+				  });
+	     },
 	     close : function(callback) {
 		 if (callback)
 		     callback();
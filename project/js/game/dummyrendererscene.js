@@ -49,8 +49,9 @@ game.DummyRendererScene.prototype.buildShaders = function (shaderScripts, textur
  * @public
  * @param {Array.<base.Model>} models
  * @param {base.Map.LightmapData} lightmapData
+ * @param {base.Map.Visibility} [visibility]
  */
-game.DummyRendererScene.prototype.registerMap = function (models, lightmapData) {};
+game.DummyRendererScene.prototype.registerMap = function (models, lightmapData, visibility) {};
 /**
  * @public
  * @param {base.Model} model
@@ -97,8 +98,9 @@ game.DummyRendererScene.prototype.setModelsVisibility = function (modelsInstance
 /**
  * @public
  * @param {base.Mat4} cameraMatrix inversed view matrix
+ * @param {number} [cluster]
  */
-game.DummyRendererScene.prototype.updateCamera = function (cameraMatrix) {};
+game.DummyRendererScene.prototype.updateCamera = function (cameraMatrix, cluster) {};
 
 /**
  * @param {base.Vec3} from
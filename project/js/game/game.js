@@ -24,6 +24,7 @@ goog.require('base.events');
 goog.require('base.IRendererScene');
 goog.require('base.Broker');
 goog.require('base.Mat3');
+goog.require('base.Bsp');
 goog.require('base.Map');
 //goog.require('files.ResourceManager');
 //goog.require('files.bsp');
@@ -158,7 +159,7 @@ game.init = function (broker, isServer, clientId) {
 
         function update () {
             var i=0;
-            var spawnPoint;
+            var spawnPoint, cameraMatrix;
             // var dt = Date.now() - lastTime;
             // lastTime = Date.now();
             var dt = game.globals.TIME_STEP_MS;
@@ -201,7 +202,10 @@ game.init = function (broker, isServer, clientId) {
             // }
             if (!isServer && gameScene.characters_[clientId]) {
                 gameScene.characters_[clientId].getPlayer().setFppMode();
-                scene.updateCamera(gameScene.characters_[clientId].getCameraMatrix());
+                cameraMatrix = gameScene.characters_[clientId].getCameraMatrix();
+                scene.updateCamera(cameraMatrix, base.Bsp.findCluster(
+                    map.bsp, base.Vec3.createVal(cameraMatrix[12], cameraMatrix[13],
+                                                 cameraMatrix[14])));
             }
 
             if (isServer) {
@@ -53,6 +53,7 @@ goog.require('goog.debug.Logger.Level');
 
 goog.require('base.Mat4');
 goog.require('base.Material');
+goog.require('files.ktx');
 goog.require('renderer.Material');
 goog.require('renderer.Shader');
 goog.require('renderer.Stage');
@@ -105,6 +106,18 @@ renderer.MaterialManager = function(gl) {
      * @type {WebGLTexture}
      */
     this.defaultTexture = this.createSolidTexture(gl, [255, 0, 0, 255]);
+    /**
+     * @private
+     * @type {Object.<number, boolean>}
+     * Compressed texture formats supported by the browser
+     */
+    this.compressedFormats = this.getCompressedFormats(gl);
+    /**
+     * @private
+     * @type {Object.<string, renderer.ShaderProgram>}
+     * Programs compiled for stages, by their sources
+     */
+    this.programs = {};
 
     /**
      * @private
@@ -144,16 +157,29 @@ renderer.MaterialManager.prototype.logger =
 /**
  * @public
  * @param {Object.<string, base.ShaderScript>} shaderScripts
- * @param {Object.<string, string>} images Map of image paths and blob URLs to images
+ * @param {Object.<string, (string|ArrayBuffer)>} images Map of image paths and blob
+ * URLs to images or KTX files with compressed textures. Images of already loaded
+ * textures are uploaded to them, so stages using them get new ones.
  */
 renderer.MaterialManager.prototype.buildShaders = function (shaderScripts, images) {
     var name;
     var shaderScript;
     var i;
+    var texture;
 
     for( name in images ) {
 	if (images.hasOwnProperty(name)) {
-            this.textures[name] = this.loadTextureUrl(this.gl, images[name]);
+            texture = this.textures[name];
+            if (texture === this.defaultTexture) {
+                texture = undefined;
+            }
+            if (typeof images[name] === 'string') {
+                this.textures[name] = this.loadTextureUrl(this.gl, images[name],
+                                                          undefined, texture);
+            } else {
+                this.textures[name] = this.loadTextureKtx(this.gl, name, images[name],
+                                                          texture);
+            }
 	}
     }
 
@@ -305,10 +331,7 @@ renderer.MaterialManager.prototype.build = function(gl, shader) {
         glStage.blendDest = this.translateBlend(gl, stage.blendDest);
         glStage.depthFunc = this.translateDepthFunc(gl, stage.depthFunc);
 
-//	if(glStage.shaderSrc && !glStage.program) {
-            glStage.program = this.compileShaderProgram(glStage.shaderSrc.vertex,
-							      glStage.shaderSrc.fragment);
-	//      }
+        glStage.program = this.getStageProgram(glStage.shaderSrc);
 
 	this.setStageTexture(gl, stage);
 
@@ -469,10 +492,12 @@ renderer.MaterialManager.prototype.setStageTexture = function(
  * @param {WebGLRenderingContext} gl
  * @param {string} url
  * @param {function(WebGLTexture)} [onload]
+ * @param {WebGLTexture} [opt_texture] Texture to upload the image to
  */
-renderer.MaterialManager.prototype.loadTextureUrl = function(gl, url, onload) {
+renderer.MaterialManager.prototype.loadTextureUrl = function(gl, url, onload,
+                                                             opt_texture) {
     var image = new Image(),
-        texture = gl.createTexture();
+        texture = opt_texture || gl.createTexture();
 
     image.onload = function() {
         gl.bindTexture(gl.TEXTURE_2D, texture);
@@ -505,6 +530,59 @@ renderer.MaterialManager.prototype.loadTextureUrl = function(gl, url, onload) {
     return texture;
 };
 
+/**
+ * @private
+ * @param {WebGLRenderingContext} gl
+ * @return {Object.<number, boolean>}
+ */
+renderer.MaterialManager.prototype.getCompressedFormats = function(gl) {
+    var formats = {};
+    var s3tc = gl.getExtension('WEBGL_compressed_texture_s3tc') ||
+            gl.getExtension('WEBKIT_WEBGL_compressed_texture_s3tc') ||
+            gl.getExtension('MOZ_WEBGL_compressed_texture_s3tc');
+    if (s3tc) {
+        formats[files.ktx.Format.COMPRESSED_RGB_S3TC_DXT1_EXT] = true;
+        formats[files.ktx.Format.COMPRESSED_RGBA_S3TC_DXT5_EXT] = true;
+    }
+    if (gl.getExtension('WEBGL_compressed_texture_etc1')) {
+        formats[files.ktx.Format.ETC1_RGB8_OES] = true;
+    }
+    return formats;
+};
+
+/**
+ * @private
+ * Uploads compressed texture with its mipmaps as they are in the file.
+ * @param {WebGLRenderingContext} gl
+ * @param {string} name
+ * @param {ArrayBuffer} buffer KTX file
+ * @param {WebGLTexture} [opt_texture] Texture to upload the file to
+ * @return {WebGLTexture}
+ */
+renderer.MaterialManager.prototype.loadTextureKtx = function(gl, name, buffer,
+                                                             opt_texture) {
+    var ktx = files.ktx.parse(buffer);
+    var texture, i;
+
+    if (!ktx || !this.compressedFormats[ktx.internalFormat]) {
+        this.logger.log(goog.debug.Logger.Level.WARNING, 'Texture ' + name +
+                        ' has unsupported format');
+        return opt_texture || this.defaultTexture;
+    }
+
+    texture = opt_texture || gl.createTexture();
+    gl.bindTexture(gl.TEXTURE_2D, texture);
+    for (i = 0; i < ktx.levels.length; ++i) {
+        gl.compressedTexImage2D(gl.TEXTURE_2D, i, ktx.internalFormat,
+                                Math.max(1, ktx.width >> i), Math.max(1, ktx.height >> i),
+                                0, ktx.levels[i]);
+    }
+    gl.texParameteri(gl.TEXTURE_2D, gl.TEXTURE_MAG_FILTER, gl.LINEAR);
+    gl.texParameteri(gl.TEXTURE_2D, gl.TEXTURE_MIN_FILTER,
+                     ktx.levels.length > 1 ? gl.LINEAR_MIPMAP_NEAREST : gl.LINEAR);
+    return texture;
+};
+
 /**
  * @private
  */
@@ -616,6 +694,21 @@ renderer.MaterialManager.prototype.bindTexture = function (texture, program) {
 // Shader program compilation
 //
 
+/**
+ * Stages with the same sources share one program, so it's compiled once
+ * @private
+ * @param {{vertex: string, fragment: string}} shaderSrc
+ * @return {renderer.ShaderProgram}
+ */
+renderer.MaterialManager.prototype.getStageProgram = function(shaderSrc) {
+    var key = shaderSrc.vertex + '\0' + shaderSrc.fragment;
+    if (!this.programs.hasOwnProperty(key)) {
+        this.programs[key] = this.compileShaderProgram(shaderSrc.vertex,
+                                                       shaderSrc.fragment);
+    }
+    return this.programs[key];
+};
+
 /**
  * @private
  */
@@ -123,6 +123,21 @@ renderer.Renderer = function(gl) {
      * @type {boolean}
      */
     this.sortNeeded_ = true;
+    /**
+     * @private
+     * @type {base.Model}
+     */
+    this.mapModel_ = null;
+    /**
+     * @private
+     * @type {base.Map.Visibility}
+     */
+    this.mapVisibility_ = null;
+    /**
+     * @private
+     * @type {number}
+     */
+    this.cluster_ = -1;
 
     gl.clearColor(0, 0, 0, 1);
     gl.clearDepth(1);
@@ -319,6 +334,55 @@ renderer.Renderer.prototype.removeModelInstance = function (modelInstance) {
     this.sortNeeded_ = true;
 };
 
+/**
+ * @public
+ * @param {base.Model} model map model, whose meshes visibility refers to
+ * @param {base.Map.Visibility} visibility null if the whole map is drawn
+ */
+renderer.Renderer.prototype.setMapVisibility = function (model, visibility) {
+    this.mapModel_ = model;
+    this.mapVisibility_ = visibility;
+    this.cluster_ = -1;
+    this.updateVisibleRanges_();
+};
+
+/**
+ * @public
+ * @param {number} cluster bsp cluster of the camera; -1 if it's outside the map
+ */
+renderer.Renderer.prototype.setCluster = function (cluster) {
+    if (cluster !== this.cluster_) {
+        this.cluster_ = cluster;
+        this.updateVisibleRanges_();
+    }
+};
+
+/**
+ * Sets ranges of map meshes visible from the current cluster. It's a lookup
+ * in the visibility table, done only when the cluster changes.
+ * @private
+ */
+renderer.Renderer.prototype.updateVisibleRanges_ = function () {
+    var i, end, mesh;
+    var meshes = this.mapModel_ ? this.mapModel_.meshes : [];
+    var visibility = this.mapVisibility_;
+    var cluster = this.cluster_;
+    var all = !visibility || cluster < 0 || 2 * cluster >= visibility.clusters.length;
+
+    for (i = 0; i < meshes.length; ++i) {
+        meshes[i].visibleRanges = all ? null : [];
+    }
+    if (all) {
+        return;
+    }
+    i = 3 * visibility.clusters[2 * cluster];
+    end = i + 3 * visibility.clusters[2 * cluster + 1];
+    for (; i < end; i += 3) {
+        mesh = meshes[visibility.runs[i]];
+        mesh.visibleRanges.push(visibility.runs[i + 1], visibility.runs[i + 2]);
+    }
+};
+
 /**
  * @public
  * @param {base.Mat4} cameraMatrix inversed view matrix
@@ -357,7 +421,7 @@ renderer.Renderer.prototype.logger_ = goog.debug.Logger.getLogger('renderer.Rend
  * @param {base.GeometryData} geometryData
  */
 renderer.Renderer.prototype.createBuffers_ = function (geometryData) {
-    var gl = this.gl_, i;
+    var gl = this.gl_, i, j;
     var vertexBuffersSize, vertexBuffer, indexBuffer;
 
     goog.asserts.assert(geometryData.indexBufferId === -1
@@ -374,6 +438,12 @@ renderer.Renderer.prototype.createBuffers_ = function (geometryData) {
     geometryData.indexBufferId = this.indexBuffers_.length - 1;
 
     for (i = 0; i < geometryData.vertices.length; ++i) {
+        // frames may share vertex array (e.g. models with compressed animation)
+        j = geometryData.vertices.indexOf(geometryData.vertices[i]);
+        if (j < i) {
+            geometryData.vertexBufferIds.push(geometryData.vertexBufferIds[j]);
+            continue;
+        }
         vertexBuffer = gl.createBuffer();
 	gl.bindBuffer(gl.ARRAY_BUFFER, vertexBuffer);
 	gl.bufferData(gl.ARRAY_BUFFER, geometryData.vertices[i], gl.STATIC_DRAW);
@@ -471,7 +541,14 @@ renderer.Renderer.renderBspMeshInstance = function (gl, state, indexBuffers, ver
     }
     
     var mesh = state.meshInstance.baseMesh;
-    gl.drawElements(gl.TRIANGLES, mesh.indicesCount, gl.UNSIGNED_SHORT, mesh.indicesOffset);
+    var ranges = mesh.visibleRanges, i;
+    if (!ranges) {
+        gl.drawElements(gl.TRIANGLES, mesh.indicesCount, gl.UNSIGNED_SHORT, mesh.indicesOffset);
+        return;
+    }
+    for (i = 0; i < ranges.length; i += 2) {
+        gl.drawElements(gl.TRIANGLES, ranges[i + 1], gl.UNSIGNED_SHORT, ranges[i]);
+    }
 };
 
 /**
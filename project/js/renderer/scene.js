@@ -87,8 +87,9 @@ base.makeUnremovable(renderer.Scene.prototype.registerMd3);
  * @public
  * @param {Array.<base.Model>} models
  * @param {base.Map.LightmapData} lightmapData
+ * @param {base.Map.Visibility} [visibility]
  */
-renderer.Scene.prototype.registerMap = function (models, lightmapData) {
+renderer.Scene.prototype.registerMap = function (models, lightmapData, visibility) {
     var i, j, material;
 
     this.renderer_.buildLightmap(lightmapData);
@@ -105,6 +106,7 @@ renderer.Scene.prototype.registerMap = function (models, lightmapData) {
 	    }
 	}
     }
+    this.renderer_.setMapVisibility(models[0], visibility || null);
 };
 
 base.makeUnremovable(renderer.Scene.prototype.registerMap);
@@ -257,9 +259,11 @@ base.makeUnremovable(renderer.Scene.prototype.setModelsVisibility);
 /**
  * @public
  * @param {base.Mat4} cameraMatrix inversed view matrix
+ * @param {number} [cluster] bsp cluster of the camera; -1 or none draws the whole map
  */
-renderer.Scene.prototype.updateCamera = function (cameraMatrix) {
+renderer.Scene.prototype.updateCamera = function (cameraMatrix, cluster) {
     this.renderer_.updateCameraMatrix(cameraMatrix);
+    this.renderer_.setCluster(cluster === undefined ? -1 : cluster);
     this.sky_.updateMatrix(cameraMatrix);
 };
 
@@ -326,7 +326,8 @@ system.Client.prototype.loadResources_ = function (archives, scene) {
             }
         }
         if (archive.map) {
-            scene.registerMap(archive.map.models, archive.map.lightmapData);
+            scene.registerMap(archive.map.models, archive.map.lightmapData,
+                              archive.map.visibility);
             broker.fireEvent(base.EventType.MAP_LOADED, {
                 models: archive.map.models,
                 lightmapData: null,  // game worker doesn't need lightmap
@@ -337,8 +338,13 @@ system.Client.prototype.loadResources_ = function (archives, scene) {
         }
     };
 
+    // higher resolution textures of tiered archives replace loaded ones
+    function onTier (textures) {
+        scene.buildShaders({}, textures);
+    }
+
     for (i = 0; i < archives.length; ++i) {
-        deferred = rm.load(archives[i]);
+        deferred = rm.load(archives[i], onTier);
         deferred.addCallback(onload);
         deferreds.push(deferred);
     }
@@ -8,7 +8,8 @@ if (port <= 0 || port > 0xFFFF) {
 }
 
 var FileServer = require('node-static').Server;
-var fileServer = new FileServer('.');
+// serves precompressed archives (packer.py --sidecar gz) when client accepts gzip
+var fileServer = new FileServer('.', { gzip: true });
 var fs = require('fs');
 var log = fs.createWriteStream('../server/log.txt');
 
@@ -2,7 +2,8 @@
 # TODO: sounds
 
 import struct
-import re
+
+import vfs
 
 LUMPS_NUMBERS = {
     'Entities' : 0,
@@ -24,21 +25,23 @@ LUMPS_NUMBERS = {
     'Visdata' : 16
 }
 
+# Returns (files, code of used shaders) for bsp. Shaders code is packed as
+# one generated script (scripts/__all__.shader).
 def get_files_for_bsp(bsp, baseoa):
+    vfs.mount(baseoa)
     deps = get_bsp_deps(baseoa + '/' + bsp)
     deps[1].extend(deps[2])
     shaders_deps = get_files_for_shaders(deps[1], baseoa)
 
     files = [bsp]
-    files.extend(shaders_deps[0])
     files.extend(shaders_deps[1])
     files.extend(map(lambda t: t + '.tga', shaders_deps[2]))
-    return files
+    return files, shaders_deps[0]
     
 
 def get_bsp_deps(bsp_path):
     try:
-        with open(bsp_path, 'rb') as bsp:
+        with vfs.open_file(bsp_path) as bsp:
             check_bsp_header(bsp)
             lumps = parse_dir(bsp)
             return (parse_entities(bsp, lumps[LUMPS_NUMBERS['Entities']]),
@@ -84,80 +87,50 @@ def parse_textures(bsp, lump):
 
 
 import os
+import shaderindex
+
+_shader_indexes = {}
+
+# Returns shader index for scripts in baseoa, built once per process
+def get_shader_index(baseoa):
+    scripts_dir = os.path.normpath(baseoa + '/scripts')
+    if scripts_dir not in _shader_indexes:
+        index_path = os.path.normpath(baseoa + '/../cache/shaders.json')
+        _shader_indexes[scripts_dir] = shaderindex.ShaderIndex(scripts_dir,
+                                                               index_path)
+    return _shader_indexes[scripts_dir]
 
-# Returns list of files (script file, textures) needed by shaders with given names
+# Returns (code, textures, shaders not found) for shaders with given names.
+# Code of all found shaders is concatenated.
 def get_files_for_shaders(shaders, baseoa):
-    scripts = os.listdir(baseoa + '/scripts')
+    index = get_shader_index(baseoa)
     textures_dep = []
-    scripts_dep = []
     shaders_found = set()
     code = []
-    
-    for script_path in scripts:
-        shaders_dep = parse_shader_file(baseoa + '/scripts/' + script_path)
-        for shader in shaders:
-            if shader in shaders_dep:
-#                print 'Shader', shader, 'found in script', script_path
-                shaders_found.add(shader)
-                code.append(shaders_dep[shader][1])
-                if shaders_dep[shader][0] != []:
-                    #scripts_dep.append('scripts/' + script_path)
-                    textures_dep.extend(shaders_dep[shader][0])
 
-    temp_file_name = '/scripts/__all__.shader'
-    with open(baseoa + temp_file_name, 'w') as f:
-        f.write('\n'.join(code));
+    # keep order of scripts, like when they were scanned one by one
+    found = []
+    for i, shader in enumerate(shaders):
+        for script, start, end, textures in index.find(shader):
+            found.append((script, i, start, end, textures))
+            shaders_found.add(shader)
+    found.sort()
+
+    for script, i, start, end, textures in found:
+        code.append(index.read_code(script, start, end))
+        textures_dep.extend(textures)
 
-    scripts_dep.append(temp_file_name)
-    
     not_found = set(shaders).difference(shaders_found)    
     for s in not_found:
         print 'Warning: Shader', s, 'not found in any script.'
         
-    return (list(set(scripts_dep)), list(set(textures_dep)), list(set(not_found))) #unique
+    return ('\n'.join(code), list(set(textures_dep)), list(set(not_found))) #unique
 
 def parse_shader_file(script_path):
     shaders = {}
-
-    with open(script_path, 'r') as script:
-        line = script.readline()
-        shader_name = ''
-        textures = []
-        code = []
-        state = 'global'
-        while line != '':
-            # there are various line endings in shader files;
-            # converting them to unix format
-            code.append(line.strip('\n\r'));
-            line = line.strip().lower()
-            if line[:2] == '//' or line == '\n':
-                pass
-            elif state == 'global':
-                if line == '{':
-                    state = 'shader'
-                else:
-                    shader_name = line
-            elif state == 'shader':
-                if line == '{':
-                    state = 'stage'
-                elif line == '}':
-                    shaders[shader_name] = (textures, '\n'.join(code))
-                    code = []
-                    textures = []
-                    state = 'global'
-            elif state == 'stage':
-                if line.find('.tga') != -1 or line.find('.jpg') != -1:
-                    pattern = re.compile(r"([a-zA-Z0-9/_\.-]+\.(?:tga|jpg))")
-                    textures.append(pattern.search(line).group(1))
-                # if line[:3] == 'map' and line.find('$lightmap') == -1:
-                #     textures.append(line[4:])
-                # elif line[:8] == 'clampmap' and line.find('$lightmap') == -1:
-                #     textures.append(line[9:])
-                if line == '}':
-                    state = 'shader'
-
-            line = script.readline()
-            
+    for name, start, end, textures in shaderindex.scan_shader_file(script_path):
+        shaders[name] = (textures,
+                         shaderindex.read_shader_code(script_path, start, end))
     return shaders
 
 
@@ -165,10 +138,8 @@ def parse_shader_file(script_path):
 def get_md3_deps(md3_path):
     print 'checking', md3_path
     try:
-        with open(md3_path, 'rb') as md3:
-            check_md3_header(md3)
-            md3.seek(76) # seek to numbers and offsets
-            header = struct.unpack('iiiiiii', md3.read(28))
+        with vfs.open_file(md3_path) as md3:
+            header = read_md3_header(md3)
             surface_num = header[2]
             surface_offset = header[6]
             print 'In header', surface_num, surface_offset
@@ -187,6 +158,28 @@ def check_md3_header(md3):
     if md3.read(4) != 'IDP3':
         raise Exception('Not md3 file')
 
+# Returns numbers and offsets from md3 header: (frames, tags, surfaces, skins,
+# frames offset, tags offset, surfaces offset, end offset)
+def read_md3_header(md3):
+    check_md3_header(md3)
+    md3.seek(76) # seek to numbers and offsets
+    return struct.unpack('iiiiiiii', md3.read(32))
+
+# Returns (offset, name, numbers and offsets) for every surface. Numbers and
+# offsets are (frames, shaders, vertices, triangles, triangles offset, shaders
+# offset, texcoords offset, vertices offset, end offset), relative to surface.
+def read_md3_surfaces(md3, header):
+    surfaces = []
+    offset = header[6]
+    for i in range(0, header[2]):
+        md3.seek(offset + 4) # skip ident
+        name = md3.read(64)
+        md3.seek(4, os.SEEK_CUR) # skip flags
+        surface_header = struct.unpack('iiiiiiiii', md3.read(36))
+        surfaces.append((offset, name, surface_header))
+        offset += surface_header[8]
+    return surfaces
+
 def check_md3_surface(md3):
     start_offset = md3.tell()
 #    print 'In surface', s_offset
@@ -209,7 +202,7 @@ def check_md3_surface(md3):
     
 def check_model_skins(md3_dir):
     try:
-        skin_files = filter(lambda n: n[-5:] == '.skin', os.listdir(md3_dir))
+        skin_files = filter(lambda n: n[-5:] == '.skin', vfs.listdir(md3_dir))
         # skins = []
         # for skin_path in skin_files:
         #     shaders = []
@@ -226,7 +219,7 @@ def check_model_skins(md3_dir):
 def get_shaders_for_skin(skin_path):
     try:
         shaders = []
-        with open(skin_path, 'r') as f:
+        with vfs.open_file(skin_path) as f:
             line = f.readline().strip()
             while (line.find(',') != -1):
                 shaders.append(line[line.find(',') + 1:])
@@ -237,7 +230,9 @@ def get_shaders_for_skin(skin_path):
         
     
     
+# Returns (files, code of used shaders) for player model
 def get_files_for_player(player_dir, baseoa):
+    vfs.mount(baseoa)
     baseoa = baseoa + '/'
     player_dir = player_dir + '/'
     models = ['lower', 'upper', 'head']
@@ -248,21 +243,22 @@ def get_files_for_player(player_dir, baseoa):
     skins = [player_dir + m + '_default.skin' for m in models]
 #    skins = [player_dir + s for s in check_model_skins(baseoa + player_dir)]
     files.extend(skins)
+    code = []
     for skin in skins:
         shaders_deps = get_files_for_shaders(get_shaders_for_skin(baseoa + skin),
                                              baseoa)
-        files.extend(shaders_deps[0])
+        code.append(shaders_deps[0])
         files.extend(shaders_deps[1])
         files.extend(t if t[-4:] == '.tga' or t[-4:] == '.jpg' else t +'.tga'
                      for t in shaders_deps[2])
-    return files
+    return files, '\n'.join(code)
     
+# Returns (files, code of used shaders) for md3 model
 def get_files_for_md3(md3, baseoa):
+    vfs.mount(baseoa)
     files = [md3]
     shaders_deps = get_files_for_shaders([s[0] for s in get_md3_deps(baseoa + '/' + md3)], baseoa)
-    files.extend(shaders_deps[0])
     files.extend(shaders_deps[1])
     files.extend(t if t[-4:] == '.tga' or t[-4:] == '.jpg' else t +'.tga'
                  for t in shaders_deps[2])
-    return files
-    
+    return files, shaders_deps[0]
@@ -0,0 +1,470 @@
+# Compiles bsp geometry offline into a GPU-ready binary (.cbsp).
+# Does what files.bsp.compileMapModels_ does in the browser: tesselates
+# patches, interleaves vertices, remaps lightmap coordinates into the
+# lightmap atlas and groups indices by shader. Also bakes the lightmap atlas
+# (.lightmap) which readLightmaps_ builds texel by texel.
+#
+# Format (little endian, all sections 4 byte aligned):
+#   header: 'CBSP', version, vertex count, index count, index size (2 or 4),
+#           range count, lightmap atlas size        (7 x uint32)
+#   ranges: shader, geometry type, index offset in bytes, element count
+#                                                   (range count x 4 x int32)
+#   vertices: pos(3) texCoord(2) lmCoord(2) normal(3) color(4)
+#                                                   (vertex count x 14 x float32)
+#   indices: uint16 or uint32, padded to 4 bytes
+# Layouts of vertices and ranges match what compileMapModels_ builds, so the
+# loader only creates typed array views over the file.
+#
+# Visibility table (.pvs) lists, for every cluster, index runs of the faces
+# visible from it (according to Visdata), merged where they are contiguous.
+# Runs refer to meshes (ranges above) of the same index layout.
+#   header: 'CPVS', version, cluster count, mesh count, run count (5 x uint32)
+#   clusters: first run, run count                (cluster count x 2 x uint32)
+#   runs: mesh, index offset in bytes, element count  (run count x 3 x uint32)
+# Faces not in any leaf (e.g. of doors and platforms) are in every cluster.
+#
+# Collision tree (.ccol) is what base.Bsp.trace walks, flattened into arrays
+# the loader only views. Planes are stored inline; leaves list only solid
+# brushes with sides, the only ones trace tests.
+#   header: 'CCOL', version, node count, leaf count, leaf brush count,
+#           brush count, brush side count             (7 x uint32)
+#   nodes: plane normal(3), distance    (node count x 4 x float32)
+#          front, back child; leaf l as -(l + 1)    (node count x 2 x int32)
+#   leaves: cluster                                 (leaf count x int32)
+#           first leaf brush, leaf brush count      (leaf count x 2 x int32)
+#   leaf brushes: brush                             (leaf brush count x int32)
+#   brushes: first side, side count                 (brush count x 2 x int32)
+#            distances of axial sides +x, +y, +z, -x, -y, -z; infinity where
+#            there is no such side                  (brush count x 6 x float32)
+#   brush sides: plane normal(3), distance    (brush side count x 4 x float32)
+
+import struct
+import numpy as np
+
+import bspfile
+
+MAGIC = 'CBSP'
+VERSION = 1
+
+VISIBILITY_MAGIC = 'CPVS'
+VISIBILITY_VERSION = 1
+
+COLLISION_MAGIC = 'CCOL'
+COLLISION_VERSION = 1
+
+# base.Bsp.BrushFlags.SOLID
+CONTENTS_SOLID = 1
+
+DRAWN_FACES = (bspfile.POLYGON, bspfile.PATCH, bspfile.MESH)
+
+# files.bsp.TESSELATION_LEVEL
+TESSELATION_LEVEL = 10
+
+LIGHTMAP_SIZE = 128
+
+VERTEX_SIZE = 14
+POS = slice(0, 3)
+TEXCOORD = slice(3, 5)
+LMCOORD = slice(5, 7)
+NORMAL = slice(7, 10)
+COLOR = slice(10, 14)
+
+# Returns (lightmaps in a row, atlas size in texels); same as readLightmaps_
+def lightmap_atlas_layout(count):
+    grid = 2
+    while grid * grid < count:
+        grid *= 2
+    return grid, grid * LIGHTMAP_SIZE
+
+# Scales lightmap texels up, keeping them in [0, 255]. Same operations as
+# brightnessAdjust_, so results are the same as when it's done in the browser.
+def brightness_adjust_lightmaps(texels, factor):
+    texels = texels.astype(np.float64) * factor
+    top = texels.max(axis=-1)[..., np.newaxis]
+    scale = np.where(top > 255.0, 255.0 / np.maximum(top, 255.0), 1.0)
+    return (texels * scale).astype(np.uint8)
+
+# Returns lightmaps in the atlas as (size, size, 4) RGBA array. Atlas layout is
+# the same as in readLightmaps_; free space is transparent black.
+def bake_lightmaps(lightmaps, factor=4.0):
+    grid, size = lightmap_atlas_layout(len(lightmaps))
+    tiles = np.zeros((grid * grid, LIGHTMAP_SIZE, LIGHTMAP_SIZE, 4), np.uint8)
+    tiles[:len(lightmaps), :, :, :3] = brightness_adjust_lightmaps(lightmaps, factor)
+    tiles[:len(lightmaps), :, :, 3] = 255
+    # (tile row, tile column, y, x) -> (tile row, y, tile column, x)
+    atlas = tiles.reshape(grid, grid, LIGHTMAP_SIZE, LIGHTMAP_SIZE, 4)
+    return atlas.transpose(0, 2, 1, 3, 4).reshape(size, size, 4)
+
+# Scales colors up, keeping them in [0, 1]; brightnessAdjustVertex_ for arrays
+def brightness_adjust(colors, factor):
+    colors = colors * factor
+    top = colors.max(axis=-1)[..., np.newaxis]
+    return np.where(top > 1.0, colors / np.maximum(top, 1.0), colors)
+
+# Converts Vertexes lump to (n, VERTEX_SIZE) float array
+def decode_vertexes(vertexes):
+    verts = np.empty((len(vertexes), VERTEX_SIZE), np.float32)
+    verts[:, POS] = vertexes['position']
+    verts[:, TEXCOORD] = vertexes['texcoord']
+    verts[:, LMCOORD] = vertexes['lmcoord']
+    verts[:, NORMAL] = vertexes['normal']
+    verts[:, COLOR.start:COLOR.start + 3] = brightness_adjust(
+        vertexes['color'][:, :3] / 255.0, 4.0)
+    verts[:, COLOR.stop - 1] = 1.0
+    return verts
+
+def _bezier_weights(level):
+    t = np.arange(level + 1, dtype=np.float64) / level
+    return np.column_stack(((1 - t) * (1 - t), 2 * t * (1 - t), t * t))
+
+# Triangles of one tesselated 3x3 patch; same order as in tesselate_
+def _patch_indices(level):
+    l1 = level + 1
+    row, col = np.mgrid[0:level, 0:level]
+    row = row.ravel()
+    col = col.ravel()
+    quads = np.column_stack(((row + 1) * l1 + col, row * l1 + col,
+                             row * l1 + col + 1, (row + 1) * l1 + col,
+                             row * l1 + col + 1, (row + 1) * l1 + col + 1))
+    return quads.ravel()
+
+# Tesselates patch face. Returns (vertices, indices relative to first vertex).
+# Vertex of 3x3 control patch at (i, j) is i * (level + 1) + j, where i goes
+# along face width and j along its height, as in tesselate_.
+def tesselate(control, size, level=TESSELATION_LEVEL):
+    weights = _bezier_weights(level)
+    control = control.reshape(size[1], size[0], VERTEX_SIZE).astype(np.float64)
+    patch_indices = _patch_indices(level)
+    verts = []
+    indices = []
+    count = 0
+    for py in range(0, size[1] - 2, 2):
+        for px in range(0, size[0] - 2, 2):
+            c = control[py:py + 3, px:px + 3] # [row (j), column (i)]
+            patch = np.einsum('jr,ic,rcv->ijv', weights, weights, c)
+            patch = patch.reshape(-1, VERTEX_SIZE)
+            verts.append(patch)
+            indices.append(patch_indices + count)
+            count += len(patch)
+
+    if not verts:
+        return np.zeros((0, VERTEX_SIZE), np.float32), np.zeros(0, np.int64)
+    verts = np.concatenate(verts)
+    normals = verts[:, NORMAL]
+    length = np.sqrt((normals * normals).sum(axis=1))[:, np.newaxis]
+    verts[:, NORMAL] = np.where(length > 0, normals / np.maximum(length, 1e-8),
+                                [0.0, 0.0, 1.0])
+    verts[:, COLOR.stop - 1] = 1.0
+    return verts.astype(np.float32), np.concatenate(indices)
+
+# Returns faces drawn by compile_map as list of (shader, [face]), one item for
+# every range (mesh), faces in file order
+def group_faces(faces):
+    by_shader = {}
+    for i, face in enumerate(faces):
+        if face['type'] in DRAWN_FACES:
+            by_shader.setdefault(int(face['texture']), []).append(i)
+    return [(shader, by_shader[shader]) for shader in sorted(by_shader)]
+
+# Number of indices of face, as compile_map makes them
+def face_index_count(face, level=TESSELATION_LEVEL):
+    if face['type'] != bspfile.PATCH:
+        return int(face['n_meshverts'])
+    width, height = face['size']
+    return (len(range(0, width - 2, 2)) * len(range(0, height - 2, 2)) *
+            level * level * 6)
+
+# Returns dict with vertices, indices, ranges and lightmap atlas size
+def compile_map(bsp_file, level=TESSELATION_LEVEL):
+    faces = bsp_file.faces
+    meshverts = bsp_file.meshverts.astype(np.int64)
+    base_verts = decode_vertexes(bsp_file.vertexes)
+    lightmap_count = len(bsp_file.lightmaps)
+    grid, atlas_size = lightmap_atlas_layout(lightmap_count)
+
+    verts = [base_verts]
+    vert_count = len(base_verts)
+    face_indices = {}
+    lm_ranges = []
+
+    for i, face in enumerate(faces):
+        face_type = face['type']
+        if face_type not in DRAWN_FACES:
+            continue
+
+        if face_type == bspfile.PATCH:
+            first = face['vertex']
+            control = base_verts[first:first + face['n_vertexes']]
+            patch, indices = tesselate(control, face['size'], level)
+            verts.append(patch)
+            face_indices[i] = indices + vert_count
+            lm_ranges.append((vert_count, vert_count + len(patch),
+                              face['lm_index']))
+            vert_count += len(patch)
+        else:
+            first = face['meshvert']
+            indices = meshverts[first:first + face['n_meshverts']] + face['vertex']
+            face_indices[i] = indices
+            lm_ranges.append((face['vertex'],
+                              face['vertex'] + face['n_vertexes'],
+                              face['lm_index']))
+
+    verts = np.concatenate(verts)
+
+    # lightmap coords in the atlas; missing lightmap means the first one
+    lmcoords = verts[:, LMCOORD].copy()
+    verts[:, LMCOORD] = 0.0
+    for start, end, lightmap in lm_ranges:
+        if lightmap_count == 0:
+            continue
+        if lightmap < 0 or lightmap >= lightmap_count:
+            lightmap = 0
+        offset = np.array([lightmap % grid, lightmap // grid]) * LIGHTMAP_SIZE
+        verts[start:end, LMCOORD] = ((lmcoords[start:end] * LIGHTMAP_SIZE + offset)
+                                     / float(atlas_size))
+
+    # indices grouped by shader, faces in file order
+    index_size = 2 if len(verts) <= 0x10000 else 4
+    ranges = []
+    indices = []
+    offset = 0
+    for shader, shader_faces in group_faces(faces):
+        geom_type = 0
+        for i in shader_faces:
+            if faces[i]['type'] != bspfile.PATCH:
+                geom_type = int(faces[i]['type'])
+        count = sum(len(face_indices[i]) for i in shader_faces)
+        ranges.append((shader, geom_type, offset * index_size, count))
+        indices.extend(face_indices[i] for i in shader_faces)
+        offset += count
+
+    if indices:
+        indices = np.concatenate(indices)
+    else:
+        indices = np.zeros(0, np.int64)
+
+    return {
+        'vertices': verts.astype(np.float32),
+        'indices': indices.astype(np.uint16 if index_size == 2 else np.uint32),
+        'ranges': np.array(ranges, np.int32).reshape(-1, 4),
+        'lightmap_size': atlas_size
+    }
+
+def serialize(compiled):
+    verts = compiled['vertices']
+    indices = compiled['indices']
+    ranges = compiled['ranges']
+    header = struct.pack('<4s6I', MAGIC, VERSION, len(verts), len(indices),
+                         indices.dtype.itemsize, len(ranges),
+                         compiled['lightmap_size'])
+    data = indices.astype(indices.dtype.newbyteorder('<')).tostring()
+    return ''.join([header,
+                    ranges.astype('<i4').tostring(),
+                    verts.astype('<f4').tostring(),
+                    data, '\x00' * (-len(data) % 4)])
+
+# Returns visibility bitsets as (clusters, clusters) bool array
+def unpack_visdata(visdata):
+    clusters = len(visdata)
+    bits = (visdata[:, :, np.newaxis] >> np.arange(8, dtype=np.uint8)) & 1
+    return bits.reshape(clusters, -1)[:, :clusters].astype(bool)
+
+# Returns dict with clusters and runs of visibility table, or None if the map
+# has no Visdata
+def compile_visibility(bsp_file, level=TESSELATION_LEVEL):
+    visdata = bsp_file.visdata()
+    clusters_count = len(visdata)
+    if clusters_count == 0:
+        return None
+    visible = unpack_visdata(visdata)
+
+    # faces in the order of index buffer: mesh, first element, element count
+    groups = group_faces(bsp_file.faces)
+    order = [(mesh, i) for mesh, (shader, shader_faces) in enumerate(groups)
+             for i in shader_faces]
+    counts = np.array([face_index_count(bsp_file.faces[i], level)
+                       for mesh, i in order], np.int64)
+    meshes = np.array([mesh for mesh, i in order], np.int64)
+    starts = np.cumsum(counts) - counts
+    ends = starts + counts
+    position = np.full(len(bsp_file.faces), -1, np.int64)
+    position[[i for mesh, i in order]] = np.arange(len(order))
+
+    # faces of clusters as bitsets: rows are clusters, columns faces in order
+    leafs = bsp_file.leafs
+    leaf_faces = np.concatenate(
+        [bsp_file.leaffaces[first:first + count] for first, count in
+         zip(leafs['leafface'], leafs['n_leaffaces'])] or [np.zeros(0, np.int32)])
+    leaf_clusters = np.repeat(leafs['cluster'], leafs['n_leaffaces'])
+    leaf_positions = position[leaf_faces]
+    in_leaf = np.zeros(len(order), bool)
+    in_leaf[leaf_positions[leaf_positions >= 0]] = True
+    drawn = (leaf_positions >= 0) & (leaf_clusters >= 0)
+    cluster_faces = np.zeros((clusters_count, len(order)), bool)
+    cluster_faces[leaf_clusters[drawn], leaf_positions[drawn]] = True
+    # bitsets are ORed as 64 bit words
+    words = (len(order) + 63) // 64
+    always = np.zeros(words * 8, np.uint8)
+    always[:(len(order) + 7) // 8] = np.packbits(~in_leaf)
+    always = always.view(np.uint64)
+    packed = np.zeros((clusters_count, words * 8), np.uint8)
+    packed[:, :(len(order) + 7) // 8] = np.packbits(cluster_faces, axis=1)
+    cluster_faces = packed.view(np.uint64)
+
+    runs = []
+    runs_count = 0
+    clusters = []
+    known = {}
+    for cluster in range(clusters_count):
+        bits = np.bitwise_or.reduce(cluster_faces[visible[cluster]], axis=0) | always
+        faces = np.flatnonzero(np.unpackbits(bits.view(np.uint8))[:len(order)])
+        if len(faces) == 0: # e.g. sky-only or empty leaves
+            clusters.append((0, 0))
+            continue
+        # run starts where a face doesn't continue the previous one
+        breaks = np.ones(len(faces), bool)
+        breaks[1:] = ((starts[faces[1:]] != ends[faces[:-1]]) |
+                      (meshes[faces[1:]] != meshes[faces[:-1]]))
+        first = faces[breaks]
+        last = faces[np.append(np.flatnonzero(breaks)[1:] - 1, len(faces) - 1)]
+        cluster_runs = np.column_stack((meshes[first], starts[first],
+                                        ends[last] - starts[first]))
+        key = cluster_runs.tostring()
+        if key not in known: # clusters seeing the same faces share runs
+            known[key] = runs_count
+            runs.append(cluster_runs)
+            runs_count += len(cluster_runs)
+        clusters.append((known[key], len(cluster_runs)))
+
+    return {
+        'clusters': np.array(clusters, np.uint32).reshape(-1, 2),
+        'runs': np.concatenate(runs or [np.zeros((0, 3), np.int64)]).astype(
+            np.uint32).reshape(-1, 3),
+        'meshes': len(groups)
+    }
+
+# Runs are stored with offsets in bytes, as ranges are, of 16 bit indices,
+# the only ones the renderer draws
+def serialize_visibility(visibility):
+    runs = visibility['runs'].copy()
+    runs[:, 1] *= 2
+    return ''.join([struct.pack('<4s4I', VISIBILITY_MAGIC, VISIBILITY_VERSION,
+                                len(visibility['clusters']), visibility['meshes'],
+                                len(runs)),
+                    visibility['clusters'].astype('<u4').tostring(),
+                    runs.astype('<u4').tostring()])
+
+# Returns concatenated items[first:first + count] for every (first, count)
+def gather_ranges(items, firsts, counts):
+    starts = np.cumsum(counts) - counts
+    return items[np.arange(counts.sum()) - np.repeat(starts - firsts, counts)]
+
+# Returns planes as (n, 4) array of normal and distance
+def plane_rows(planes):
+    return np.column_stack((planes['normal'], planes['dist']))
+
+# Returns dict with arrays of the flattened collision tree
+def compile_collision(bsp_file):
+    planes = bsp_file.planes
+    nodes = bsp_file.nodes
+    leafs = bsp_file.leafs
+    brushes = bsp_file.brushes
+    brushsides = bsp_file.brushsides
+
+    # brushes trace can hit, renumbered
+    contents = bsp_file.textures['contents'][brushes['texture']]
+    solid = ((contents & CONTENTS_SOLID) != 0) & (brushes['n_brushsides'] > 0)
+    brush_index = np.full(len(brushes), -1, np.int64)
+    brush_index[solid] = np.arange(solid.sum())
+
+    leaf_brushes = gather_ranges(bsp_file.leafbrushes, leafs['leafbrush'],
+                                 leafs['n_leafbrushes'])
+    leaf_ids = np.repeat(np.arange(len(leafs)), leafs['n_leafbrushes'])
+    keep = solid[leaf_brushes]
+    leaf_counts = np.bincount(leaf_ids[keep], minlength=len(leafs))
+
+    side_counts = brushes['n_brushsides'][solid]
+    sides = gather_ranges(brushsides, brushes['brushside'][solid], side_counts)
+    side_planes = plane_rows(planes[sides['plane']])
+
+    # sides with axial normals bound the brush; trace rejects brushes that
+    # are behind any of them first
+    bounds = np.full((len(side_counts), 6), np.inf)
+    side_brushes = np.repeat(np.arange(len(side_counts)), side_counts)
+    for axis in range(3):
+        for sign in (1, -1):
+            unit = np.zeros(3, np.float32)
+            unit[axis] = sign
+            axial = (side_planes[:, 0:3] == unit).all(axis=1)
+            np.minimum.at(bounds[:, axis if sign > 0 else axis + 3],
+                          side_brushes[axial], side_planes[axial, 3])
+
+    return {
+        'node_planes': plane_rows(planes[nodes['plane']]),
+        'node_children': nodes['children'],
+        'leaf_clusters': leafs['cluster'],
+        'leaf_brush_ranges': np.column_stack((np.cumsum(leaf_counts) - leaf_counts,
+                                              leaf_counts)),
+        'leaf_brushes': brush_index[leaf_brushes[keep]],
+        'brush_side_ranges': np.column_stack((np.cumsum(side_counts) - side_counts,
+                                              side_counts)),
+        'brush_bounds': bounds,
+        'side_planes': side_planes
+    }
+
+def serialize_collision(collision):
+    return ''.join([struct.pack('<4s6I', COLLISION_MAGIC, COLLISION_VERSION,
+                                len(collision['node_planes']),
+                                len(collision['leaf_clusters']),
+                                len(collision['leaf_brushes']),
+                                len(collision['brush_bounds']),
+                                len(collision['side_planes'])),
+                    collision['node_planes'].astype('<f4').tostring(),
+                    collision['node_children'].astype('<i4').tostring(),
+                    collision['leaf_clusters'].astype('<i4').tostring(),
+                    collision['leaf_brush_ranges'].astype('<i4').tostring(),
+                    collision['leaf_brushes'].astype('<i4').tostring(),
+                    collision['brush_side_ranges'].astype('<i4').tostring(),
+                    collision['brush_bounds'].astype('<f4').tostring(),
+                    collision['side_planes'].astype('<f4').tostring()])
+
+# Returns compiled map as string
+def compile_bsp(bsp_path, level=TESSELATION_LEVEL):
+    with bspfile.BspFile(bsp_path) as bsp_file:
+        return serialize(compile_map(bsp_file, level))
+
+# Returns visibility table as string (.pvs file), or None if the map has no
+# Visdata
+def compile_bsp_visibility(bsp_path, level=TESSELATION_LEVEL):
+    with bspfile.BspFile(bsp_path) as bsp_file:
+        visibility = compile_visibility(bsp_file, level)
+    if visibility is None:
+        return None
+    return serialize_visibility(visibility)
+
+# Returns collision tree as string (.ccol file)
+def compile_bsp_collision(bsp_path):
+    with bspfile.BspFile(bsp_path) as bsp_file:
+        return serialize_collision(compile_collision(bsp_file))
+
+# Returns baked lightmap atlas as raw RGBA string (.lightmap file). It's
+# stored raw, because map loading runs in a worker, where images can't be
+# decoded; it's also what the renderer uploads.
+def bake_bsp_lightmaps(bsp_path):
+    with bspfile.BspFile(bsp_path) as bsp_file:
+        return bake_lightmaps(bsp_file.lightmaps).tostring()
+
+# Usage: bspcompiler.py map.bsp out.cbsp [out.lightmap [out.pvs [out.ccol]]]
+if __name__ == '__main__':
+    import sys
+    with open(sys.argv[2], 'wb') as out:
+        out.write(compile_bsp(sys.argv[1]))
+    if len(sys.argv) > 3:
+        with open(sys.argv[3], 'wb') as out:
+            out.write(bake_bsp_lightmaps(sys.argv[1]))
+    if len(sys.argv) > 4:
+        with open(sys.argv[4], 'wb') as out:
+            out.write(compile_bsp_visibility(sys.argv[1]) or '')
+    if len(sys.argv) > 5:
+        with open(sys.argv[5], 'wb') as out:
+            out.write(compile_bsp_collision(sys.argv[1]))
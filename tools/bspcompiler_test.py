@@ -0,0 +1,60 @@
+import unittest
+import numpy as np
+
+import bspcompiler
+import bspfile
+
+# Stands in for bspfile.BspFile with the lumps compile_visibility reads
+class FakeBsp(object):
+    def __init__(self, faces, leafs, leaffaces, visdata):
+        self.faces = faces
+        self.leafs = leafs
+        self.leaffaces = np.array(leaffaces, '<i4')
+        self._visdata = np.array(visdata, np.uint8)
+
+    def visdata(self):
+        return self._visdata
+
+def make_faces(meshverts):
+    faces = np.zeros(len(meshverts), bspfile.LUMP_DTYPES['Faces'])
+    faces['type'] = bspfile.POLYGON
+    faces['n_meshverts'] = meshverts
+    return faces
+
+def make_leafs(clusters_and_faces):
+    leafs = np.zeros(len(clusters_and_faces), bspfile.LUMP_DTYPES['Leafs'])
+    first = 0
+    for leaf, (cluster, count) in zip(leafs, clusters_and_faces):
+        leaf['cluster'] = cluster
+        leaf['leafface'] = first
+        leaf['n_leaffaces'] = count
+        first += count
+    return leafs
+
+class CompileVisibilityTest(unittest.TestCase):
+    def test_contiguous_faces_make_one_run(self):
+        bsp = FakeBsp(make_faces([3, 6]), make_leafs([(0, 2)]), [0, 1],
+                      [[0b1]])
+        visibility = bspcompiler.compile_visibility(bsp)
+        self.assertEqual([[0, 1]], visibility['clusters'].tolist())
+        self.assertEqual([[0, 0, 9]], visibility['runs'].tolist())
+
+    def test_cluster_seeing_no_faces(self):
+        # cluster 1 sees only itself and holds no faces, like sky-only leaves
+        bsp = FakeBsp(make_faces([3, 6]), make_leafs([(0, 2), (1, 0)]), [0, 1],
+                      [[0b11], [0b10]])
+        visibility = bspcompiler.compile_visibility(bsp)
+        self.assertEqual([[0, 1], [0, 0]], visibility['clusters'].tolist())
+        self.assertEqual([[0, 0, 9]], visibility['runs'].tolist())
+
+    def test_no_cluster_seeing_faces(self):
+        bsp = FakeBsp(make_faces([3]), make_leafs([(0, 1), (1, 0)]), [0],
+                      [[0b10], [0b10]])
+        visibility = bspcompiler.compile_visibility(bsp)
+        self.assertEqual([[0, 0], [0, 0]], visibility['clusters'].tolist())
+        self.assertEqual((0, 3), visibility['runs'].shape)
+        serialized = bspcompiler.serialize_visibility(visibility)
+        self.assertEqual(20 + 2 * 8, len(serialized))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+# Memory-mapped reader of Quake 3 bsp files.
+# Every lump is exposed as NumPy structured array viewing the mapped file
+# directly, so whole lumps can be processed without copying and without
+# per-record python loops. Arrays are read-only. Maps in pk3s (see vfs) are
+# read into memory instead.
+
+import mmap
+import numpy as np
+
+import bsp
+import vfs
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S4'),
+    ('version', '<i4'),
+    ('lumps', '<i4', (17, 2)) # (offset, length)
+])
+
+LUMP_DTYPES = {
+    'Textures': np.dtype([
+        ('name', 'S64'),
+        ('flags', '<i4'),
+        ('contents', '<i4')
+    ]),
+    'Planes': np.dtype([
+        ('normal', '<f4', 3),
+        ('dist', '<f4')
+    ]),
+    'Nodes': np.dtype([
+        ('plane', '<i4'),
+        ('children', '<i4', 2),
+        ('mins', '<i4', 3),
+        ('maxs', '<i4', 3)
+    ]),
+    'Leafs': np.dtype([
+        ('cluster', '<i4'),
+        ('area', '<i4'),
+        ('mins', '<i4', 3),
+        ('maxs', '<i4', 3),
+        ('leafface', '<i4'),
+        ('n_leaffaces', '<i4'),
+        ('leafbrush', '<i4'),
+        ('n_leafbrushes', '<i4')
+    ]),
+    'Leaffaces': np.dtype('<i4'),
+    'Leafbrushes': np.dtype('<i4'),
+    'Models': np.dtype([
+        ('mins', '<f4', 3),
+        ('maxs', '<f4', 3),
+        ('face', '<i4'),
+        ('n_faces', '<i4'),
+        ('brush', '<i4'),
+        ('n_brushes', '<i4')
+    ]),
+    'Brushes': np.dtype([
+        ('brushside', '<i4'),
+        ('n_brushsides', '<i4'),
+        ('texture', '<i4')
+    ]),
+    'Brushsides': np.dtype([
+        ('plane', '<i4'),
+        ('texture', '<i4')
+    ]),
+    'Vertexes': np.dtype([
+        ('position', '<f4', 3),
+        ('texcoord', '<f4', 2),
+        ('lmcoord', '<f4', 2),
+        ('normal', '<f4', 3),
+        ('color', 'u1', 4)
+    ]),
+    'Meshverts': np.dtype('<i4'),
+    'Effects': np.dtype([
+        ('name', 'S64'),
+        ('brush', '<i4'),
+        ('unknown', '<i4')
+    ]),
+    'Faces': np.dtype([
+        ('texture', '<i4'),
+        ('effect', '<i4'),
+        ('type', '<i4'),
+        ('vertex', '<i4'),
+        ('n_vertexes', '<i4'),
+        ('meshvert', '<i4'),
+        ('n_meshverts', '<i4'),
+        ('lm_index', '<i4'),
+        ('lm_start', '<i4', 2),
+        ('lm_size', '<i4', 2),
+        ('lm_origin', '<f4', 3),
+        ('lm_vecs', '<f4', (2, 3)),
+        ('normal', '<f4', 3),
+        ('size', '<i4', 2)
+    ]),
+    'Lightmaps': np.dtype(('u1', (128, 128, 3))),
+    'Lightvols': np.dtype([
+        ('ambient', 'u1', 3),
+        ('directional', 'u1', 3),
+        ('dir', 'u1', 2)
+    ])
+}
+
+# face types
+POLYGON = 1
+PATCH = 2
+MESH = 3
+BILLBOARD = 4
+
+class BspFile(object):
+    def __init__(self, path):
+        real_path = vfs.real_path(path)
+        if real_path is not None:
+            with open(real_path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else: # member of a pk3
+            self._mmap = vfs.read(path)
+        self._lumps = {}
+
+        if len(self._mmap) < HEADER_DTYPE.itemsize:
+            raise Exception('Not bsp file')
+        self.header = np.frombuffer(self._mmap, HEADER_DTYPE, 1)[0]
+        if self.header['magic'] != 'IBSP' or self.header['version'] != 46:
+            raise Exception('Not bsp file')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Arrays returned earlier stay valid; mapping is released with the last one
+    def close(self):
+        self._lumps = {}
+        self._mmap = None
+
+    def lump_range(self, name):
+        offset, length = self.header['lumps'][bsp.LUMPS_NUMBERS[name]]
+        if offset < 0 or length < 0 or offset + length > len(self._mmap):
+            raise Exception('Lump %s out of file' % name)
+        return int(offset), int(length)
+
+    def raw_lump(self, name):
+        offset, length = self.lump_range(name)
+        return np.frombuffer(self._mmap, np.uint8, length, offset)
+
+    # Returns lump as structured array, e.g. lump('Vertexes')['position']
+    def lump(self, name):
+        if name not in self._lumps:
+            dtype = LUMP_DTYPES[name]
+            offset, length = self.lump_range(name)
+            count = length // dtype.itemsize
+            if count == 0:
+                array = np.zeros(0, dtype)
+            else:
+                array = np.frombuffer(self._mmap, dtype, count, offset)
+            self._lumps[name] = array
+        return self._lumps[name]
+
+    def entities(self):
+        return self.raw_lump('Entities').tostring().rstrip('\x00')
+
+    # Returns visibility bitsets as (clusters, bytes per cluster) array.
+    # Bit j of row i is set if cluster j is visible from cluster i.
+    def visdata(self):
+        offset, length = self.lump_range('Visdata')
+        if length < 8:
+            return np.zeros((0, 0), np.uint8)
+        n_vecs, sz_vecs = np.frombuffer(self._mmap, '<i4', 2, offset)
+        if n_vecs * sz_vecs == 0:
+            return np.zeros((n_vecs, sz_vecs), np.uint8)
+        vecs = np.frombuffer(self._mmap, np.uint8, n_vecs * sz_vecs, offset + 8)
+        return vecs.reshape(n_vecs, sz_vecs)
+
+    def __getattr__(self, attr):
+        # lowercase lump names as attributes: bsp_file.faces, bsp_file.nodes...
+        name = attr.capitalize()
+        if name in LUMP_DTYPES:
+            return self.lump(name)
+        raise AttributeError(attr)
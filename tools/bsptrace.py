@@ -0,0 +1,374 @@
+#!/usr/bin/python
+# Reference implementation of base.Bsp.trace (project/js/base/bsp.js) in
+# NumPy. Traces batches of rays through the collision tree as laid out for the
+# client (bspcompiler.compile_collision) and gives the same results as the
+# client does, bit for bit: the tree is walked in the same order, with the
+# same arithmetic, and points where rays are split are rounded to float32, as
+# they are in base.Vec3.
+#
+# All rays of a batch walk the tree in lockstep, each with its own stack, so
+# every step is one NumPy operation over all rays. Brushes in the reached
+# leaves are then tested at once; only the few hits are resolved one by one,
+# in the order trace finds them, because that decides ties.
+#
+# As a tool it traces random moves in a map, reports the rays which are most
+# expensive to trace and optionally checks and times the client's trace on
+# them with node.
+#
+# Usage: bsptrace.py [options] map.bsp
+
+import os
+import json
+import time
+import tempfile
+import subprocess
+import optparse
+import numpy as np
+
+import bspfile
+import bspcompiler
+
+# base.Bsp.TRACE_OFFSET
+TRACE_OFFSET = 0.03125
+
+# game.CharacterController.PLAYER_RADIUS
+PLAYER_RADIUS = 14.0
+
+JS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'project', 'js')
+
+# Traces rays from file given as float32 start(3), end(3) with base.Bsp.trace
+# over collision tree from .ccol file. Prints results and best time (ms).
+NODE_TRACE = '''
+var fs = require('fs'), vm = require('vm');
+var sandbox = {goog: {
+    provide: function (name) {
+        name.split('.').reduce(function (o, part) { return o[part] = o[part] || {}; }, sandbox);
+    },
+    require: function () {},
+    asserts: {assert: function () {}}
+}};
+['base/pool.js', 'base/vec3.js', 'base/bsp.js', 'files/bsp.js'].forEach(function (file) {
+    vm.runInNewContext(fs.readFileSync(process.argv[1] + '/' + file, 'utf8'), sandbox);
+});
+function read(path) {
+    var data = fs.readFileSync(path);
+    return data.buffer.slice(data.byteOffset, data.byteOffset + data.length);
+}
+var bsp = sandbox.files.bsp.readCollision_(read(process.argv[2]));
+var rays = new Float32Array(read(process.argv[3]));
+var radius = parseFloat(process.argv[4]), repeat = parseInt(process.argv[5], 10);
+var best = Infinity, i, j, start, outputs;
+for (i = 0; i < repeat; ++i) {
+    outputs = [];
+    start = process.hrtime();
+    for (j = 0; j < rays.length; j += 6) {
+        outputs.push(sandbox.base.Bsp.trace(bsp, rays.subarray(j, j + 3),
+                                            rays.slice(j + 3, j + 6), radius));
+    }
+    start = process.hrtime(start);
+    best = Math.min(best, start[0] * 1e3 + start[1] / 1e6);
+}
+console.log(JSON.stringify({ms: best, outputs: outputs.map(function (o) {
+    return [o.fraction, o.startSolid, o.allSolid, Array.prototype.slice.call(o.endPos),
+            o.plane && Array.prototype.slice.call(o.plane.normal), o.plane && o.plane.distance];
+})}));
+'''
+
+def tree_depth(children):
+    depth = 0
+    level = np.zeros(1, np.int64)
+    while len(level):
+        depth += 1
+        level = children[level].ravel()
+        level = level[level >= 0]
+    return depth
+
+def to_float32(array):
+    return array.astype(np.float32).astype(np.float64)
+
+# Walks the tree as traceNode does. Returns (rays, leaves) of reached leaves,
+# ordered by ray and, for every ray, as traceNode reaches them; and count of
+# nodes visited by every ray.
+def find_leaves(collision, starts, ends, radius):
+    planes = collision['node_planes'].astype(np.float64)
+    children = collision['node_children'].astype(np.int64)
+    count = len(starts)
+    depth = tree_depth(children) + 1
+    stack_node = np.zeros((count, depth), np.int64)
+    stack_start = np.zeros((count, depth, 3))
+    stack_end = np.zeros((count, depth, 3))
+    stack_start[:, 0] = starts
+    stack_end[:, 0] = ends
+    size = np.ones(count, np.int64)
+    nodes = np.zeros(count, np.int64)
+    visits = []
+
+    def push(rays, node, start, end):
+        stack_node[rays, size[rays]] = node
+        stack_start[rays, size[rays]] = start
+        stack_end[rays, size[rays]] = end
+        size[rays] += 1
+
+    while True:
+        rays = np.flatnonzero(size)
+        if len(rays) == 0:
+            break
+        size[rays] -= 1
+        node = stack_node[rays, size[rays]]
+        start = stack_start[rays, size[rays]]
+        end = stack_end[rays, size[rays]]
+
+        leaf = node < 0
+        visits.append((rays[leaf], -(node[leaf] + 1)))
+        rays, node, start, end = rays[~leaf], node[~leaf], start[~leaf], end[~leaf]
+        nodes[rays] += 1
+
+        r = radius[rays]
+        p = planes[node]
+        start_dist = (p[:, 0] * start[:, 0] + p[:, 1] * start[:, 1] +
+                      p[:, 2] * start[:, 2] - p[:, 3])
+        end_dist = (p[:, 0] * end[:, 0] + p[:, 1] * end[:, 1] +
+                    p[:, 2] * end[:, 2] - p[:, 3])
+        front = (start_dist >= r) & (end_dist >= r)
+        back = ~front & (start_dist < -r) & (end_dist < -r)
+        split = ~front & ~back
+
+        one = ~split
+        push(rays[one], children[node[one], np.where(back[one], 1, 0)],
+             start[one], end[one])
+
+        rays, node, start, end = rays[split], node[split], start[split], end[split]
+        sd, ed, r = start_dist[split], end_dist[split], r[split]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inverse = 1 / (sd - ed)
+        backwards = sd < ed
+        forwards = sd > ed
+        side = np.where(backwards, 1, 0)
+        fraction1 = np.where(backwards, (sd - r + TRACE_OFFSET) * inverse,
+                             np.where(forwards, (sd + r + TRACE_OFFSET) * inverse, 1.0))
+        fraction2 = np.where(backwards, (sd + r + TRACE_OFFSET) * inverse,
+                             np.where(forwards, (sd - r - TRACE_OFFSET) * inverse, 0.0))
+        fraction1 = np.clip(fraction1, 0, 1)[:, np.newaxis]
+        fraction2 = np.clip(fraction2, 0, 1)[:, np.newaxis]
+        # the far side is popped after the near one
+        push(rays, children[node, 1 - side],
+             to_float32(start + fraction2 * (end - start)), end)
+        push(rays, children[node, side],
+             start, to_float32(start + fraction1 * (end - start)))
+
+    rays = np.concatenate([v[0] for v in visits])
+    leaves = np.concatenate([v[1] for v in visits])
+    order = np.argsort(rays, kind='mergesort')
+    return rays[order], leaves[order], nodes
+
+# Tests brushes as traceBrush does, every ray with its brushes in the order
+# given, and stores hits into result
+def trace_brushes(collision, starts, ends, radius, rays, brushes, result):
+    start, end, r = starts[rays], ends[rays], radius[rays]
+
+    # the ray is outside of an axial side
+    distance = collision['brush_bounds'].astype(np.float64)[brushes] + r[:, np.newaxis]
+    outside = (((start - distance[:, 0:3] > 0) & (end - distance[:, 0:3] > 0)) |
+               ((-start - distance[:, 3:6] > 0) & (-end - distance[:, 3:6] > 0)))
+    inside = ~outside.any(axis=1)
+    rays, brushes, start, end, r = (rays[inside], brushes[inside], start[inside],
+                                    end[inside], r[inside])
+    if len(rays) == 0:
+        return
+
+    # one row for every side of every tested brush
+    ranges = collision['brush_side_ranges']
+    counts = ranges[brushes, 1]
+    firsts = np.cumsum(counts) - counts
+    sides = bspcompiler.gather_ranges(np.arange(len(collision['side_planes'])),
+                                      ranges[brushes, 0], counts)
+    pair = np.repeat(np.arange(len(rays)), counts)
+    p = collision['side_planes'].astype(np.float64)[sides]
+    distance = p[:, 3] + r[pair]
+    start, end = start[pair], end[pair]
+    start_dist = (start[:, 0] * p[:, 0] + start[:, 1] * p[:, 1] +
+                  start[:, 2] * p[:, 2] - distance)
+    end_dist = (end[:, 0] * p[:, 0] + end[:, 1] * p[:, 1] +
+                end[:, 2] * p[:, 2] - distance)
+
+    missed = np.logical_or.reduceat((start_dist > 0) & (end_dist > 0), firsts)
+    starts_out = np.logical_or.reduceat(start_dist > 0, firsts)
+    ends_out = np.logical_or.reduceat(end_dist > 0, firsts)
+    crossing = (start_dist > 0) != (end_dist > 0)
+    entering = crossing & (start_dist > end_dist)
+    leaving = crossing & ~entering
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction_in = np.where(entering, (start_dist - TRACE_OFFSET) /
+                               (start_dist - end_dist), -np.inf)
+        fraction_out = np.where(leaving, (start_dist + TRACE_OFFSET) /
+                                (start_dist - end_dist), np.inf)
+    start_fraction = np.maximum(np.maximum.reduceat(fraction_in, firsts), -1.0)
+    end_fraction = np.minimum(np.minimum.reduceat(fraction_out, firsts), 1.0)
+    # the first side entered last is the collision plane
+    rows = np.arange(len(sides))
+    entered_last = entering & (fraction_in == start_fraction[pair]) & \
+        (start_fraction[pair] > -1)
+    side_rows = np.minimum.reduceat(np.where(entered_last, rows, len(rows)), firsts)
+    collision_sides = sides[np.minimum(side_rows, len(rows) - 1)]
+
+    solid = ~missed & ~starts_out
+    result['start_solid'][rays[solid]] = True
+    result['all_solid'][rays[solid & ~ends_out]] = True
+
+    hits = ~missed & starts_out & (start_fraction < end_fraction) & (start_fraction > -1)
+    fractions, planes = result['fraction'], result['plane']
+    for ray, fraction, side in zip(rays[hits].tolist(), start_fraction[hits].tolist(),
+                                   collision_sides[hits].tolist()):
+        if fraction < fractions[ray]:
+            planes[ray] = side
+            fractions[ray] = max(fraction, 0.0)
+
+# Traces rays from starts to ends ((n, 3) arrays) as base.Bsp.trace does.
+# Radius is a number or an array with one for every ray.
+# Returns dict of arrays: fraction, start_solid, all_solid, end_pos, plane
+# (index of side plane hit, -1 if none) and counts of nodes, leaves and
+# brushes visited by every ray.
+def trace(collision, starts, ends, radius=0.0):
+    starts = np.asarray(starts, np.float64).reshape(-1, 3)
+    ends = np.asarray(ends, np.float64).reshape(-1, 3)
+    count = len(starts)
+    radius = np.broadcast_to(np.asarray(radius, np.float64), (count,))
+
+    leaf_rays, leaves, nodes = find_leaves(collision, starts, ends, radius)
+    ranges = collision['leaf_brush_ranges']
+    brushes = bspcompiler.gather_ranges(collision['leaf_brushes'], ranges[leaves, 0],
+                                        ranges[leaves, 1])
+    rays = np.repeat(leaf_rays, ranges[leaves, 1])
+
+    result = {
+        'fraction': np.ones(count),
+        'start_solid': np.zeros(count, bool),
+        'all_solid': np.zeros(count, bool),
+        'end_pos': ends.copy(),
+        'plane': np.full(count, -1, np.int64),
+        'nodes': nodes,
+        'leaves': np.bincount(leaf_rays, minlength=count),
+        'brushes': np.bincount(rays, minlength=count)
+    }
+    trace_brushes(collision, starts, ends, radius, rays, brushes, result)
+
+    # written into end, a float32 vector
+    hit = result['fraction'] != 1.0
+    result['end_pos'][hit] = to_float32(
+        starts[hit] + result['fraction'][hit, np.newaxis] * (ends[hit] - starts[hit]))
+    return result
+
+# Returns (starts, ends) of random moves up to length units long, starting
+# anywhere in the world's bounds
+def random_rays(bsp_file, count, length, seed=0):
+    random = np.random.RandomState(seed)
+    world = bsp_file.models[0]
+    mins = world['mins'].astype(np.float64)
+    starts = mins + random.random_sample((count, 3)) * (world['maxs'] - mins)
+    directions = random.normal(size=(count, 3))
+    directions /= np.sqrt((directions ** 2).sum(axis=1))[:, np.newaxis]
+    ends = starts + directions * random.random_sample((count, 1)) * length
+    return to_float32(starts), to_float32(ends)
+
+def find_node():
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(directory, 'node')
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+# Returns (outputs of base.Bsp.trace, best time in ms)
+def node_trace(node, collision, starts, ends, radius, repeat):
+    paths = []
+    try:
+        for data in (bspcompiler.serialize_collision(collision),
+                     np.hstack((starts, ends)).astype('<f4').tostring()):
+            fd, path = tempfile.mkstemp()
+            os.write(fd, data)
+            os.close(fd)
+            paths.append(path)
+        out = json.loads(subprocess.check_output(
+            [node, '-e', NODE_TRACE, JS_DIR] + paths + [repr(radius), str(repeat)]))
+        return out['outputs'], out['ms']
+    finally:
+        for path in paths:
+            os.remove(path)
+
+# Returns results of ray i as base.Bsp.trace gives them
+def trace_output(collision, result, i):
+    side = result['plane'][i]
+    plane = collision['side_planes'][side].tolist() if side >= 0 else [None, None]
+    return [float(result['fraction'][i]), bool(result['start_solid'][i]),
+            bool(result['all_solid'][i]), result['end_pos'][i].tolist(),
+            plane[0:3] if side >= 0 else None, plane[-1]]
+
+def report(result, starts, ends, top):
+    count = len(starts)
+    print '  hit: %d, start in solid: %d, all in solid: %d' % (
+        (result['fraction'] < 1).sum(), result['start_solid'].sum(),
+        result['all_solid'].sum())
+    print '  %-8s %8s %8s' % ('per ray', 'mean', 'max')
+    for key in ('nodes', 'leaves', 'brushes'):
+        print '  %-8s %8.1f %8d' % (key, result[key].mean(), result[key].max())
+    print '  most brushes tested:'
+    for i in np.argsort(-result['brushes'], kind='mergesort')[:top]:
+        print '    (%.1f %.1f %.1f) -> (%.1f %.1f %.1f): %d nodes, %d leaves, ' \
+            '%d brushes' % (tuple(starts[i]) + tuple(ends[i]) + (
+                result['nodes'][i], result['leaves'][i], result['brushes'][i]))
+
+def main():
+    parser = optparse.OptionParser('usage: %prog [options] map.bsp')
+    parser.add_option('--rays', type='int', default=10000,
+                      help='Number of random moves traced. Default: %default')
+    parser.add_option('--length', type='float', default=64.0,
+                      help='Maximum length of moves. Default: %default')
+    parser.add_option('--radius', type='float', default=PLAYER_RADIUS,
+                      help='Radius of traced sphere. Default: %default (player)')
+    parser.add_option('--seed', type='int', default=0,
+                      help='Seed of random moves. Default: %default')
+    parser.add_option('--top', type='int', default=5,
+                      help='Number of the most expensive moves listed. Default: %default')
+    parser.add_option('--node', action='store_true', default=False,
+                      help='Check results and time of the client\'s trace with node.')
+    parser.add_option('--repeat', type='int', default=5,
+                      help='Runs of the client\'s trace; the best is reported. '
+                      'Default: %default')
+    parser.add_option('--save', metavar='FILE',
+                      help='Write moves and their results to FILE as JSON.')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('map not given')
+
+    with bspfile.BspFile(args[0]) as bsp_file:
+        collision = bspcompiler.compile_collision(bsp_file)
+        starts, ends = random_rays(bsp_file, options.rays, options.length, options.seed)
+
+    start = time.time()
+    result = trace(collision, starts, ends, options.radius)
+    print '%s: %d moves traced in %.1f ms' % (args[0], options.rays,
+                                             (time.time() - start) * 1000)
+    report(result, starts, ends, options.top)
+
+    if options.node:
+        node = find_node()
+        if node is None:
+            parser.error('node not found')
+        outputs, ms = node_trace(node, collision, starts, ends, options.radius,
+                                 options.repeat)
+        different = [i for i, output in enumerate(outputs)
+                     if output != trace_output(collision, result, i)]
+        print '  base.Bsp.trace: %.1f ms, %d of %d results differ' % (
+            ms, len(different), len(outputs))
+        for i in different[:options.top]:
+            print '    %d: %s, expected %s' % (i, outputs[i],
+                                               trace_output(collision, result, i))
+
+    if options.save:
+        with open(options.save, 'w') as out:
+            json.dump({'radius': options.radius, 'starts': starts.tolist(),
+                       'ends': ends.tolist(),
+                       'outputs': [trace_output(collision, result, i)
+                                   for i in range(len(starts))]}, out)
+
+if __name__ == '__main__':
+    main()
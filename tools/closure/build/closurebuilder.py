@@ -33,10 +33,16 @@ __author__ = 'nnaze@google.com (Nathan Naze)'
 import logging
 import optparse
 import os
+import shlex
+import socket
 import sys
+import time
 
+import compileserver
+import depsdb
 import depstree
 import jscompiler
+import scancache
 import source
 import treescan
 
@@ -88,6 +94,24 @@ def _GetOptionsParser():
                     dest='compiler_jar',
                     action='store',
                     help='The location of the Closure compiler .jar file.')
+  parser.add_option('--compiler_command',
+                    dest='compiler_command',
+                    action='store',
+                    help=('Command run instead of "java -jar COMPILER_JAR". '
+                          'It is given compiler arguments and writes compiled '
+                          'source to standard output.'))
+  parser.add_option('--worker_command',
+                    dest='worker_command',
+                    action='store',
+                    help=('Command of a persistent worker process compiling '
+                          'the output, see jscompiler.Worker. With --watch, '
+                          'one worker (and its JVM) is kept for all builds.'))
+  parser.add_option('--compiler_server',
+                    dest='compiler_server',
+                    action='store',
+                    help=('Path of the socket of a running compileserver.py. '
+                          'If specified, compiled output is produced by the '
+                          'server instead of starting the compiler.'))
   parser.add_option('-f',
                     '--compiler_flags',
                     dest='compiler_flags',
@@ -101,6 +125,42 @@ def _GetOptionsParser():
                     action='store',
                     help=('If specified, write output to this path instead of '
                           'writing to standard output.'))
+  parser.add_option('--scan_cache',
+                    dest='scan_cache',
+                    action='store',
+                    help=('If specified, provides and requires of sources are '
+                          'kept in this file and files that did not change '
+                          'are not scanned again.'))
+  parser.add_option('--deps_file',
+                    dest='deps_files',
+                    action='append',
+                    default=[],
+                    help=('A deps.js file (e.g. written by depswriter.py) with '
+                          'provides and requires of sources, so they are not '
+                          'scanned, unless modified after the file. Paths in '
+                          'it are relative to Closure\'s base.js. This flag '
+                          'may be specified multiple times.'))
+  parser.add_option('-j',
+                    '--jobs',
+                    dest='jobs',
+                    type='int',
+                    action='store',
+                    help=('Number of processes scanning sources. Default is '
+                          'the number of cores.'))
+  parser.add_option('--watch',
+                    dest='watch',
+                    action='store_true',
+                    default=False,
+                    help=('Keep running and write the output again whenever '
+                          'a source it is built from changes. Requires '
+                          '--output_file.'))
+  parser.add_option('--watch_interval',
+                    dest='watch_interval',
+                    type='float',
+                    action='store',
+                    default=1.0,
+                    help=('Seconds between checks of sources in --watch '
+                          'mode. Default is 1.'))
 
   return parser
 
@@ -154,17 +214,71 @@ def _IsClosureBaseFile(js_source):
           js_source.provides == set(['goog']))
 
 
+def _ScanSources(js_paths, deps_files, scan_cache=None, jobs=None):
+  """Gets provides and requires of sources.
+
+  Args:
+    js_paths: A list of paths to JavaScript files.
+    deps_files: A list of paths to deps.js files. Sources listed in them are
+      not scanned, unless they were modified after the deps file.
+    scan_cache: scancache.ScanCache, optional.
+    jobs: int, Number of processes scanning sources.
+
+  Returns:
+    A list of (provides, requires), in order of js_paths.
+  """
+  if not deps_files:
+    logging.info('%s sources scanned.', len(js_paths))
+    return scancache.ScanSources(js_paths, scan_cache, jobs)
+
+  # Paths in deps files are relative to base.js, so it's found first.
+  all_deps = [None] * len(js_paths)
+  base_indices = [i for i, path in enumerate(js_paths)
+                  if os.path.basename(path) == 'base.js']
+  base_dir = None
+  for i, deps in zip(base_indices, scancache.ScanSources(
+      [js_paths[i] for i in base_indices], scan_cache, jobs)):
+    all_deps[i] = deps
+    if deps[0] == ['goog']:
+      base_dir = os.path.dirname(js_paths[i])
+  if base_dir is None:
+    logging.error('No Closure base.js file found.')
+    sys.exit(1)
+
+  deps_db = depsdb.DepsDatabase(deps_files, base_dir)
+  to_scan = []
+  for i, path in enumerate(js_paths):
+    if all_deps[i] is None:
+      all_deps[i] = deps_db.Get(path)
+      if all_deps[i] is None:
+        to_scan.append(i)
+  logging.info('%s sources taken from deps files.',
+               len(js_paths) - len(base_indices) - len(to_scan))
+  logging.info('%s sources scanned.', len(base_indices) + len(to_scan))
+
+  for i, deps in zip(to_scan, scancache.ScanSources(
+      [js_paths[i] for i in to_scan], scan_cache, jobs)):
+    all_deps[i] = deps
+  return all_deps
+
+
 class _PathSource(source.Source):
   """Source file subclass that remembers its file path."""
 
-  def __init__(self, path):
+  def __init__(self, path, deps=None):
     """Initialize a source.
 
     Args:
       path: str, Path to a JavaScript file.  The source string will be read
         from this file.
+      deps: (provides, requires) of the file, if it was scanned already
+        (see scancache.ScanSources). The file is read only when its source
+        is needed then.
     """
-    super(_PathSource, self).__init__(source.GetFileContents(path))
+    if deps is not None:
+      super(_PathSource, self).__init__(None, deps)
+    else:
+      super(_PathSource, self).__init__(source.GetFileContents(path))
 
     self._path = path
 
@@ -172,30 +286,50 @@ class _PathSource(source.Source):
     """Returns the path."""
     return self._path
 
+  def GetSource(self):
+    """Get the source as a string, reading the file if needed."""
+    if self._source is None:
+      self._source = source.GetFileContents(self._path)
+    return self._source
 
-def main():
-  logging.basicConfig(format=(sys.argv[0] + ': %(message)s'),
-                      level=logging.INFO)
-  options, args = _GetOptionsParser().parse_args()
-
-  # Make our output pipe.
-  if options.output_file:
-    out = open(options.output_file, 'w')
-  else:
-    out = sys.stdout
-
-  sources = set()
 
-  logging.info('Scanning paths...')
+def _GetJsPaths(options, args):
+  """Returns paths of JavaScript files under roots and given as arguments."""
+  js_paths = []
   for path in options.roots:
-    for js_path in treescan.ScanTreeForJsFiles(path):
-      sources.add(_PathSource(js_path))
+    js_paths.extend(treescan.ScanTreeForJsFiles(path))
 
   # Add scripts specified on the command line.
-  for js_path in args:
-    sources.add(_PathSource(js_path))
+  js_paths.extend(args)
+  return js_paths
+
 
-  logging.info('%s sources scanned.', len(sources))
+def _GetDependencies(options, js_paths, scan_cache):
+  """Scans sources and returns those needed by inputs and namespaces.
+
+  Args:
+    options: Parsed options.
+    js_paths: A list of paths to JavaScript files.
+    scan_cache: scancache.ScanCache, optional.
+
+  Returns:
+    A list of _PathSource objects, in dependency order, base.js first.
+
+  Raises:
+    depstree.BaseDepsTreeError: Dependencies of sources are broken.
+  """
+  # Files of all roots are scanned together, in parallel.
+  sources = set(
+      _PathSource(js_path, deps) for js_path, deps in
+      zip(js_paths, _ScanSources(js_paths, options.deps_files, scan_cache,
+                                 options.jobs)))
+
+  if scan_cache:
+    logging.info('%s of scanned sources taken from the scan cache.',
+                 scan_cache.hits)
+    scan_cache.hits = 0
+    scan_cache.Save()
+  logging.info('%s sources in total.', len(sources))
 
   # Though deps output doesn't need to query the tree, we still build it
   # to validate dependencies.
@@ -220,37 +354,192 @@ def main():
 
   # The Closure Library base file must go first.
   base = _GetClosureBaseFile(sources)
-  deps = [base] + tree.GetDependencies(input_namespaces)
+  return [base] + tree.GetDependencies(input_namespaces)
+
 
+def _GetOutput(options, deps, worker=None):
+  """Returns the output for sources in deps, or None if compilation failed.
+
+  Args:
+    options: Parsed options.
+    deps: A list of sources, in order.
+    worker: jscompiler.Worker compiling the output, if given.
+  """
   output_mode = options.output_mode
   if output_mode == 'list':
-    out.writelines([js_source.GetPath() + '\n' for js_source in deps])
+    return ''.join([js_source.GetPath() + '\n' for js_source in deps])
   elif output_mode == 'script':
-    out.writelines([js_source.GetSource() for js_source in deps])
-  elif output_mode == 'compiled':
+    return ''.join([js_source.GetSource() for js_source in deps])
+
+  source_paths = [js_source.GetPath() for js_source in deps]
+  if worker:
+    compiled_source = worker.Compile(source_paths, options.compiler_flags)
+  elif options.compiler_server:
+    try:
+      compiled_source = compileserver.CompileRemote(
+          options.compiler_server, source_paths, options.compiler_flags)
+    except socket.error as error:
+      logging.error('Compile server %s is not reachable: %s',
+                    options.compiler_server, error)
+      compiled_source = None
+  else:
+    compiler_command = None
+    if options.compiler_command:
+      compiler_command = shlex.split(options.compiler_command)
+    compiled_source = jscompiler.Compile(
+        options.compiler_jar, source_paths, options.compiler_flags,
+        compiler_command)
+
+  if compiled_source is None:
+    logging.error('JavaScript compilation failed.')
+  else:
+    logging.info('JavaScript compilation succeeded.')
+  return compiled_source
+
+
+def _GetModificationTimes(paths):
+  """Returns a dict of mtimes of files; files which are gone are left out."""
+  mtimes = {}
+  for path in paths:
+    try:
+      mtimes[path] = os.stat(path).st_mtime
+    except OSError:
+      pass
+  return mtimes
+
+
+class _Watcher(object):
+  """Writes the output whenever a source it is built from changes.
+
+  Sources under roots are listed again on every check, so added and removed
+  files are noticed.  Changed files are scanned again (only those, as
+  scan_cache keeps the rest), but the output is built only if the dependency
+  closure of inputs changed.  Errors in sources are reported and the output
+  is built once they're fixed.  With --worker_command, all builds are
+  compiled by one worker, stopped by Close.
+  """
 
-    # Make sure a .jar is specified.
-    if not options.compiler_jar:
-      logging.error('--compiler_jar flag must be specified if --output is '
-                    '"compiled"')
-      sys.exit(2)
+  def __init__(self, options, args, scan_cache):
+    """Initializes the watcher; nothing is built until the first Check.
 
-    compiled_source = jscompiler.Compile(
-        options.compiler_jar,
-        [js_source.GetPath() for js_source in deps],
-        options.compiler_flags)
+    Args:
+      options: Parsed options.
+      args: A list of JavaScript files given as arguments.
+      scan_cache: scancache.ScanCache.
+    """
+    self._options = options
+    self._args = args
+    self._scan_cache = scan_cache
+    self._all_mtimes = None
+    self._built_mtimes = None
+    self._worker = None
+    if options.worker_command:
+      self._worker = jscompiler.Worker(shlex.split(options.worker_command))
+
+  def Check(self):
+    """Builds and writes the output if sources changed since the last check.
+
+    Returns:
+      True if the output was written.
+    """
+    js_paths = _GetJsPaths(self._options, self._args)
+    mtimes = _GetModificationTimes(js_paths)
+    if mtimes == self._all_mtimes:
+      return False
+    self._all_mtimes = mtimes
+
+    try:
+      deps = _GetDependencies(self._options, js_paths, self._scan_cache)
+    except (depstree.BaseDepsTreeError, IOError, OSError) as error:
+      logging.error('%s', error)
+      # Built again on the next change of any source.
+      self._built_mtimes = None
+      return False
+
+    deps_mtimes = [(js_source.GetPath(), mtimes.get(js_source.GetPath()))
+                   for js_source in deps]
+    if deps_mtimes == self._built_mtimes:
+      logging.info('Sources the output is built from did not change.')
+      return False
+    self._built_mtimes = deps_mtimes
+
+    output = _GetOutput(self._options, deps, self._worker)
+    if output is None:
+      return False
+    with open(self._options.output_file, 'w') as out:
+      out.write(output)
+    logging.info('Wrote %s.', self._options.output_file)
+    return True
+
+  def Close(self):
+    """Stops the worker, if any."""
+    if self._worker:
+      self._worker.Close()
+
+
+def _Watch(options, args, scan_cache):
+  """Checks sources every options.watch_interval seconds, see _Watcher."""
+  watcher = _Watcher(options, args, scan_cache)
+  try:
+    watcher.Check()
+    logging.info('Watching sources...')
+    while True:
+      time.sleep(options.watch_interval)
+      watcher.Check()
+  finally:
+    watcher.Close()
 
-    if compiled_source is None:
-      logging.error('JavaScript compilation failed.')
-      sys.exit(1)
-    else:
-      logging.info('JavaScript compilation succeeded.')
-      out.write(compiled_source)
 
-  else:
-    logging.error('Invalid value for --output flag.')
+def main():
+  logging.basicConfig(format=(sys.argv[0] + ': %(message)s'),
+                      level=logging.INFO)
+  options, args = _GetOptionsParser().parse_args()
+
+  # Make sure a .jar is specified.
+  if (options.output_mode == 'compiled' and not options.compiler_jar and
+      not options.compiler_command and not options.worker_command and
+      not options.compiler_server):
+    logging.error('--compiler_jar flag must be specified if --output is '
+                  '"compiled"')
     sys.exit(2)
 
+  if options.watch and not options.output_file:
+    logging.error('--output_file flag must be specified with --watch')
+    sys.exit(2)
+
+  scan_cache = None
+  if options.scan_cache or options.watch:
+    # Sources are not scanned again between builds in --watch mode.
+    scan_cache = scancache.ScanCache(options.scan_cache)
+
+  if options.watch:
+    try:
+      _Watch(options, args, scan_cache)
+    except KeyboardInterrupt:
+      pass
+    return
+
+  # Make our output pipe.
+  if options.output_file:
+    out = open(options.output_file, 'w')
+  else:
+    out = sys.stdout
+
+  logging.info('Scanning paths...')
+  deps = _GetDependencies(options, _GetJsPaths(options, args), scan_cache)
+
+  worker = None
+  if options.worker_command:
+    worker = jscompiler.Worker(shlex.split(options.worker_command))
+  try:
+    output = _GetOutput(options, deps, worker)
+  finally:
+    if worker:
+      worker.Close()
+  if output is None:
+    sys.exit(1)
+  out.write(output)
+
 
 if __name__ == '__main__':
   main()
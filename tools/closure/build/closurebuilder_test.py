@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""Unit test for the --watch mode of closurebuilder."""
+
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import closurebuilder
+import jscompiler_test
+
+
+class WatcherTestCase(unittest.TestCase):
+  """Unit test for closurebuilder._Watcher."""
+
+  def setUp(self):
+    logging.disable(logging.CRITICAL)
+    self._dir = tempfile.mkdtemp()
+    self._mtime = 1000
+    self._Write('base.js', "goog.provide('goog');\n")
+    self._Write('a.js', "goog.provide('a');\ngoog.require('b');\n")
+    self._Write('b.js', "goog.provide('b');\n")
+    self._Write('c.js', "goog.provide('c');\n")
+    self._output_path = os.path.join(self._dir, 'out', 'out.js')
+    os.mkdir(os.path.dirname(self._output_path))
+
+    self._watcher = self._CreateWatcher(
+        '--compiler_command',
+        self._WriteScript('compiler.py', jscompiler_test.STAND_IN_COMPILER))
+
+  def tearDown(self):
+    shutil.rmtree(self._dir)
+    logging.disable(logging.NOTSET)
+
+  def _WriteScript(self, name, contents):
+    path = os.path.join(self._dir, name)
+    with open(path, 'w') as script:
+      script.write(contents)
+    return path
+
+  def _CreateWatcher(self, command_flag, script_path):
+    options, args = closurebuilder._GetOptionsParser().parse_args([
+        '--root=' + os.path.join(self._dir, 'js'),
+        '--namespace=a',
+        '--output_mode=compiled',
+        '%s=%s %s' % (command_flag, sys.executable, script_path),
+        '--output_file=' + self._output_path,
+        '--jobs=1',
+        '--watch'])
+    watcher = closurebuilder._Watcher(options, args, None)
+    self.addCleanup(watcher.Close)
+    return watcher
+
+  def _Write(self, name, contents):
+    path = os.path.join(self._dir, 'js', name)
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as js_file:
+      js_file.write(contents)
+    self._mtime += 1
+    os.utime(path, (self._mtime, self._mtime))
+
+  def _ReadOutput(self):
+    with open(self._output_path) as output_file:
+      return output_file.read()
+
+  def testFirstCheckWritesOutput(self):
+    self.assertTrue(self._watcher.Check())
+    self.assertEqual(
+        "goog.provide('goog');\ngoog.provide('b');\n"
+        "goog.provide('a');\ngoog.require('b');\n",
+        self._ReadOutput())
+
+  def testUnchangedSourcesAreNotBuilt(self):
+    self._watcher.Check()
+
+    self.assertFalse(self._watcher.Check())
+
+  def testChangeOutsideClosureIsNotBuilt(self):
+    self._watcher.Check()
+    self._Write('c.js', "goog.provide('c');\nvar c;\n")
+    self._Write('d.js', "goog.provide('d');\n")
+
+    self.assertFalse(self._watcher.Check())
+
+  def testChangeInClosureIsBuilt(self):
+    self._watcher.Check()
+    self._Write('b.js', "goog.provide('b');\nvar b;\n")
+
+    self.assertTrue(self._watcher.Check())
+    self.assertTrue(self._ReadOutput().endswith(
+        "goog.provide('b');\nvar b;\n"
+        "goog.provide('a');\ngoog.require('b');\n"))
+
+  def testBrokenSourcesAreBuiltWhenFixed(self):
+    self._watcher.Check()
+    self._Write('a.js', "goog.provide('a');\ngoog.require('x');\n")
+
+    self.assertFalse(self._watcher.Check())
+    self._Write('a.js', "goog.provide('a');\n")
+    self.assertTrue(self._watcher.Check())
+    self.assertEqual("goog.provide('goog');\ngoog.provide('a');\n",
+                     self._ReadOutput())
+
+  def testWorkerIsKeptBetweenBuilds(self):
+    watcher = self._CreateWatcher(
+        '--worker_command',
+        self._WriteScript('worker.py', jscompiler_test.STAND_IN_WORKER))
+
+    self.assertTrue(watcher.Check())
+    self.assertTrue(self._ReadOutput().startswith('// job 1\n'))
+    self._Write('b.js', "goog.provide('b');\nvar b;\n")
+    self.assertTrue(watcher.Check())
+    self.assertTrue(self._ReadOutput().startswith('// job 2\n'))
+
+
+if __name__ == '__main__':
+  unittest.main()
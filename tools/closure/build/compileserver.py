@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+"""Server running Closure Compiler jobs for closurebuilder.py.
+
+Starting Java and the compiler takes a good part of a small build.  The server
+is started once and closurebuilder.py --compiler_server sends it compile jobs
+over a local (Unix domain) socket: one JSON line {"sources": [paths],
+"flags": [flags]} per job, answered with one JSON line {"output": compiled
+source or null}.  Jobs are run one at a time.  Relative paths in flags are
+resolved against the directory of the server.
+
+With --worker_command, jobs are run by one persistent worker process keeping
+its JVM alive (see jscompiler.Worker for its protocol).  Without it, the
+compiler (or --compiler_command) is run once per job.
+
+usage: %prog --socket=PATH [options]
+"""
+
+
+import json
+import logging
+import optparse
+import os
+import shlex
+import socket
+import SocketServer
+import sys
+
+import jscompiler
+
+
+def _GetOptionsParser():
+  """Get the options parser."""
+
+  parser = optparse.OptionParser(__doc__)
+  parser.add_option('--socket',
+                    dest='socket',
+                    action='store',
+                    help='Path of the socket to listen on.')
+  parser.add_option('-c',
+                    '--compiler_jar',
+                    dest='compiler_jar',
+                    action='store',
+                    help='The location of the Closure compiler .jar file.')
+  parser.add_option('--compiler_command',
+                    dest='compiler_command',
+                    action='store',
+                    help=('Command run instead of "java -jar COMPILER_JAR" '
+                          'for every job. It is given compiler arguments and '
+                          'writes compiled source to standard output.'))
+  parser.add_option('--worker_command',
+                    dest='worker_command',
+                    action='store',
+                    help=('Command of a persistent worker process running '
+                          'all jobs (see above).'))
+
+  return parser
+
+
+class _CompileHandler(SocketServer.StreamRequestHandler):
+  """Runs jobs sent over one connection."""
+
+  def handle(self):
+    for line in iter(self.rfile.readline, ''):
+      job = json.loads(line)
+      output = self.server.compile([str(path) for path in job['sources']],
+                                   [str(flag) for flag in job['flags']])
+      if output is not None:
+        output = output.decode('utf-8')
+      self.wfile.write(json.dumps({'output': output}) + '\n')
+      self.wfile.flush()
+
+
+class CompileServer(SocketServer.UnixStreamServer):
+  """Server running compile jobs sent to a Unix domain socket."""
+
+  def __init__(self, address, compile_function):
+    """Binds the socket.
+
+    Args:
+      address: str, Path of the socket. A file left there by a server which
+        didn't exit cleanly is removed.
+      compile_function: A function taking source paths and flags, and
+        returning the compiled source or None, as jscompiler.Compile.
+    """
+    if os.path.exists(address):
+      os.remove(address)
+    SocketServer.UnixStreamServer.__init__(self, address, _CompileHandler)
+    self.compile = compile_function
+
+  def server_close(self):
+    SocketServer.UnixStreamServer.server_close(self)
+    if os.path.exists(self.server_address):
+      os.remove(self.server_address)
+
+
+def CompileRemote(address, source_paths, flags=None):
+  """Compiles sources with a running compile server.
+
+  Args:
+    address: str, Path of the socket of the server.
+    source_paths: Source paths to build, in order.
+    flags: A list of additional flags to pass on to Closure Compiler.
+
+  Returns:
+    The compiled source, as a string, or None if compilation failed.
+
+  Raises:
+    socket.error: The server can't be reached.
+  """
+  job = {'sources': [os.path.abspath(path) for path in source_paths],
+         'flags': flags or []}
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    sock.connect(address)
+    server_file = sock.makefile('r+')
+    server_file.write(json.dumps(job) + '\n')
+    server_file.flush()
+    line = server_file.readline()
+    server_file.close()
+  finally:
+    sock.close()
+
+  if not line:
+    return
+  output = json.loads(line)['output']
+  if output is None:
+    return
+  return output.encode('utf-8')
+
+
+def main():
+  logging.basicConfig(format=(sys.argv[0] + ': %(message)s'),
+                      level=logging.INFO)
+  options, unused_args = _GetOptionsParser().parse_args()
+
+  if not options.socket:
+    logging.error('--socket flag must be specified.')
+    sys.exit(2)
+
+  worker = None
+  if options.worker_command:
+    worker = jscompiler.Worker(shlex.split(options.worker_command))
+    compile_function = worker.Compile
+  elif options.compiler_jar or options.compiler_command:
+    compiler_command = None
+    if options.compiler_command:
+      compiler_command = shlex.split(options.compiler_command)
+    compile_function = (
+        lambda paths, flags: jscompiler.Compile(options.compiler_jar, paths,
+                                                flags, compiler_command))
+  else:
+    logging.error('One of --compiler_jar, --compiler_command or '
+                  '--worker_command flags must be specified.')
+    sys.exit(2)
+
+  server = CompileServer(options.socket, compile_function)
+  logging.info('Listening on %s', options.socket)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    if worker:
+      worker.Close()
+
+
+if __name__ == '__main__':
+  main()
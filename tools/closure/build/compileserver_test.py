@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+"""Unit test for compileserver, with a stand-in compiler and worker."""
+
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+import compileserver
+import jscompiler
+import jscompiler_test
+
+
+class CompileServerTestCase(unittest.TestCase):
+  """Unit test for compileserver."""
+
+  def setUp(self):
+    self._dir = tempfile.mkdtemp()
+    self._js_paths = []
+    for name in ['a', 'b']:
+      path = os.path.join(self._dir, name + '.js')
+      with open(path, 'w') as js_file:
+        js_file.write('var %s;\n' % name)
+      self._js_paths.append(path)
+    self._compiler_command = [
+        sys.executable,
+        self._WriteScript('compiler.py', jscompiler_test.STAND_IN_COMPILER)]
+    self._worker_command = [
+        sys.executable,
+        self._WriteScript('worker.py', jscompiler_test.STAND_IN_WORKER)]
+
+  def tearDown(self):
+    shutil.rmtree(self._dir)
+
+  def _WriteScript(self, name, contents):
+    path = os.path.join(self._dir, name)
+    with open(path, 'w') as script:
+      script.write(contents)
+    return path
+
+  def _StartServer(self, compile_function):
+    server = compileserver.CompileServer(os.path.join(self._dir, 'socket'),
+                                         compile_function)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    def Stop():
+      server.shutdown()
+      thread.join()
+      server.server_close()
+    self.addCleanup(Stop)
+    return server.server_address
+
+  def testCompileRemote(self):
+    address = self._StartServer(
+        lambda paths, flags: jscompiler.Compile(None, paths, flags,
+                                                self._compiler_command))
+
+    self.assertEqual(
+        '// --foo\nvar a;\nvar b;\n',
+        compileserver.CompileRemote(address, self._js_paths, ['--foo']))
+    self.assertEqual(
+        None,
+        compileserver.CompileRemote(address, self._js_paths, ['--fail']))
+
+  def testWorkerRunsAllJobs(self):
+    worker = jscompiler.Worker(self._worker_command)
+    self.addCleanup(worker.Close)
+    address = self._StartServer(worker.Compile)
+
+    self.assertEqual(
+        '// job 1\nvar a;\nvar b;\n',
+        compileserver.CompileRemote(address, self._js_paths))
+    self.assertEqual(
+        None,
+        compileserver.CompileRemote(address, self._js_paths, ['--fail']))
+    self.assertEqual(
+        '// job 3\nvar b;\n',
+        compileserver.CompileRemote(address, self._js_paths[1:]))
+
+
+if __name__ == '__main__':
+  unittest.main()
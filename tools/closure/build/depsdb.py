@@ -0,0 +1,90 @@
+"""Provides and requires of sources read from generated deps.js files.
+
+A deps.js file (written by depswriter.py or calcdeps.py) lists provides and
+requires of every source, with paths relative to the directory of Closure's
+base.js.  With it, sources don't have to be read and scanned to build the
+dependency tree; only sources modified after the deps file was written are
+scanned again.
+"""
+
+import os
+import re
+
+import source
+
+
+# Matches a goog.addDependency('path', [provides], [requires]) call.
+_ADD_DEPENDENCY_REGEX = re.compile(
+    r"""
+    ^\s*goog\.addDependency\(
+    \s*['"]([^'"]+)['"]\s*,      # path
+    \s*\[([^\]]*)\]\s*,          # provides
+    \s*\[([^\]]*)\]              # requires
+    """,
+    re.MULTILINE | re.VERBOSE)
+
+# Matches a quoted namespace in a list.
+_NAMESPACE_REGEX = re.compile(r"""['"]([^'"]+)['"]""")
+
+
+def ParseDepsFile(contents):
+  """Parses goog.addDependency calls.
+
+  Args:
+    contents: str, Contents of a deps.js file.
+
+  Returns:
+    A list of (path, provides, requires) tuples, in order of the file.
+  """
+  return [(match.group(1),
+           _NAMESPACE_REGEX.findall(match.group(2)),
+           _NAMESPACE_REGEX.findall(match.group(3)))
+          for match in _ADD_DEPENDENCY_REGEX.finditer(contents)]
+
+
+class DepsDatabase(object):
+  """Provides and requires of sources listed in deps.js files."""
+
+  def __init__(self, deps_paths, base_dir):
+    """Reads the deps files.
+
+    Args:
+      deps_paths: A list of paths to deps.js files. Sources listed in later
+        files replace the same sources listed in earlier ones.
+      base_dir: str, Directory of Closure's base.js; paths in deps files are
+        relative to it.
+
+    Raises:
+      IOError: An error occurred reading a deps file.
+    """
+    self._deps = {}
+    for deps_path in deps_paths:
+      mtime = os.stat(deps_path).st_mtime
+      for path, provides, requires in ParseDepsFile(
+          source.GetFileContents(deps_path)):
+        key = os.path.normpath(os.path.abspath(os.path.join(base_dir, path)))
+        self._deps[key] = (mtime, provides, requires)
+
+  def __len__(self):
+    return len(self._deps)
+
+  def Get(self, path):
+    """Returns (provides, requires) of the source.
+
+    Args:
+      path: str, Path to the source.
+
+    Returns:
+      (provides, requires) lists as listed in a deps file, or None if the
+      source isn't listed or it was modified after the deps file.
+    """
+    entry = self._deps.get(os.path.normpath(os.path.abspath(path)))
+    if entry is None:
+      return None
+    mtime, provides, requires = entry
+    try:
+      if os.stat(path).st_mtime > mtime:
+        return None
+    except OSError:
+      return None
+    return provides, requires
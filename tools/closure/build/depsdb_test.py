@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+"""Unit test for depsdb."""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import depsdb
+
+
+class DepsDatabaseTestCase(unittest.TestCase):
+  """Unit test for depsdb."""
+
+  def setUp(self):
+    self._dir = tempfile.mkdtemp()
+    self._base_dir = os.path.join(self._dir, 'closure', 'goog')
+    os.makedirs(self._base_dir)
+    os.makedirs(os.path.join(self._dir, 'js'))
+    self._js_path = os.path.join(self._dir, 'js', 'foo.js')
+    self._deps_path = os.path.join(self._dir, 'deps.js')
+    self._Write(self._js_path, '', 1000)
+    self._Write(self._deps_path, _TEST_DEPS, 2000)
+
+  def tearDown(self):
+    shutil.rmtree(self._dir)
+
+  def _Write(self, path, contents, mtime):
+    with open(path, 'w') as f:
+      f.write(contents)
+    os.utime(path, (mtime, mtime))
+
+  def testParseDepsFile(self):
+    self.assertEqual(
+        [('../../js/foo.js', ['foo', 'foo.Bar'], ['goog.array', 'goog.dom']),
+         ('../../js/baz.js', ['baz'], [])],
+        depsdb.ParseDepsFile(_TEST_DEPS))
+
+  def testGet(self):
+    deps_db = depsdb.DepsDatabase([self._deps_path], self._base_dir)
+
+    self.assertEqual(2, len(deps_db))
+    self.assertEqual((['foo', 'foo.Bar'], ['goog.array', 'goog.dom']),
+                     deps_db.Get(self._js_path))
+
+  def testModifiedSourceIsNotTaken(self):
+    self._Write(self._js_path, '', 3000)
+    deps_db = depsdb.DepsDatabase([self._deps_path], self._base_dir)
+
+    self.assertEqual(None, deps_db.Get(self._js_path))
+
+  def testMissingSourceIsNotTaken(self):
+    deps_db = depsdb.DepsDatabase([self._deps_path], self._base_dir)
+
+    self.assertEqual(None, deps_db.Get(os.path.join(self._dir, 'js',
+                                                    'baz.js')))
+
+
+_TEST_DEPS = """// This file was autogenerated by depswriter.py.
+// Please do not edit.
+goog.addDependency('../../js/foo.js', ['foo', 'foo.Bar'], ['goog.array', 'goog.dom']);
+goog.addDependency("../../js/baz.js", ["baz"], []);
+"""
+
+
+if __name__ == '__main__':
+  unittest.main()
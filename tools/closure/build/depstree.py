@@ -74,36 +74,31 @@ class DepsTree(object):
       required_namespaces = [required_namespaces]
 
     deps_sources = []
+    resolved = set()
 
     for namespace in required_namespaces:
-      for source in DepsTree._ResolveDependencies(
-          namespace, [], self._provides_map, []):
-        if source not in deps_sources:
-          deps_sources.append(source)
+      try:
+        self._ResolveDependencies(namespace, deps_sources, resolved)
+      except CircularDependencyError as error:
+        error.cycles = self._FindCycles(required_namespaces)
+        raise
 
     return deps_sources
 
-  @staticmethod
-  def _ResolveDependencies(required_namespace, deps_list, provides_map,
-                           traversal_path):
+  def _ResolveDependencies(self, required_namespace, deps_list, resolved):
     """Resolve dependencies for Closure source files.
 
     Follows the dependency tree down and builds a list of sources in dependency
-    order.  This function will recursively call itself to fill all dependencies
-    below the requested namespaces, and then append its sources at the end of
-    the list.
+    order.  Every source is appended to the list after all of its
+    dependencies, in order of its requires.  The tree is walked with an
+    explicit stack, so deep chains of requires don't hit the recursion limit.
 
     Args:
       required_namespace: String of required namespace.
       deps_list: List of sources in dependency order.  This function will append
         the required source once all of its dependencies are satisfied.
-      provides_map: Map from namespace to source that provides it.
-      traversal_path: List of namespaces of our path from the root down the
-        dependency/recursion tree.  Used to identify cyclical dependencies.
-        This is a list used as a stack -- when the function is entered, the
-        current namespace is pushed and popped right before returning.
-        Each recursive call will check that the current namespace does not
-        appear in the list, throwing a CircularDependencyError if it does.
+      resolved: Set of sources in deps_list.  Sources in it are not visited
+        again; the function adds sources it appends.
 
     Returns:
       The given deps_list object filled with sources in dependency order.
@@ -113,31 +108,102 @@ class DepsTree(object):
       CircularDependencyError: A cycle is detected in the dependency tree.
     """
 
-    source = provides_map.get(required_namespace)
+    source = self._provides_map.get(required_namespace)
     if not source:
       raise NamespaceNotFoundError(required_namespace)
+    if source in resolved:
+      return deps_list
+
+    # Namespaces of our path from the root down the dependency tree, for the
+    # error message, and sources on it, to identify cycles.
+    traversal_path = [required_namespace]
+    path_sources = set([source])
+    stack = [(source, iter(source.requires))]
+
+    while stack:
+      source, requires = stack[-1]
+      for require in requires:
+        required_source = self._provides_map.get(require)
+        if not required_source:
+          raise NamespaceNotFoundError(require, source)
+        if required_source in path_sources:
+          traversal_path.append(require)
+          raise CircularDependencyError(traversal_path)
+        if required_source not in resolved:
+          # Append all other dependencies before we append our own.
+          traversal_path.append(require)
+          path_sources.add(required_source)
+          stack.append((required_source, iter(required_source.requires)))
+          break
+      else:
+        stack.pop()
+        traversal_path.pop()
+        path_sources.remove(source)
+        resolved.add(source)
+        deps_list.append(source)
 
-    if required_namespace in traversal_path:
-      traversal_path.append(required_namespace)  # do this *after* the test
-
-      # This must be a cycle.
-      raise CircularDependencyError(traversal_path)
+    return deps_list
 
-    # If we don't have the source yet, we'll have to visit this namespace and
-    # add the required dependencies to deps_list.
-    if source not in deps_list:
-      traversal_path.append(required_namespace)
+  def _FindCycles(self, required_namespaces):
+    """Finds all dependency cycles among sources needed for the namespaces.
 
-      for require in source.requires:
+    Cycles are strongly connected components of the graph of sources, found
+    with Tarjan's algorithm (with an explicit stack).
 
-        # Append all other dependencies before we append our own.
-        DepsTree._ResolveDependencies(require, deps_list, provides_map,
-                                      traversal_path)
-      deps_list.append(source)
+    Args:
+      required_namespaces: List of namespaces.
 
-      traversal_path.pop()
+    Returns:
+      A list of cycles, each as a sorted list of namespaces provided by its
+      sources.
+    """
+    index = {}
+    lowlink = {}
+    component_stack = []
+    on_stack = set()
+    cycles = []
+
+    def RequiredSources(source):
+      return [self._provides_map[require] for require in sorted(source.requires)
+              if require in self._provides_map]
+
+    def Visit(source):
+      index[source] = lowlink[source] = len(index)
+      component_stack.append(source)
+      on_stack.add(source)
+      return (source, iter(RequiredSources(source)))
 
-    return deps_list
+    for namespace in required_namespaces:
+      root = self._provides_map.get(namespace)
+      if not root or root in index:
+        continue
+      stack = [Visit(root)]
+      while stack:
+        source, required_sources = stack[-1]
+        for required_source in required_sources:
+          if required_source not in index:
+            stack.append(Visit(required_source))
+            break
+          if required_source in on_stack:
+            lowlink[source] = min(lowlink[source], index[required_source])
+        else:
+          stack.pop()
+          if stack:
+            parent = stack[-1][0]
+            lowlink[parent] = min(lowlink[parent], lowlink[source])
+          if lowlink[source] == index[source]:
+            component = []
+            while True:
+              member = component_stack.pop()
+              on_stack.remove(member)
+              component.append(member)
+              if member is source:
+                break
+            if len(component) > 1 or source in RequiredSources(source):
+              cycles.append(sorted(provide for member in component
+                                   for provide in member.provides))
+
+    return cycles
 
 
 class BaseDepsTreeError(Exception):
@@ -148,15 +214,26 @@ class BaseDepsTreeError(Exception):
 
 
 class CircularDependencyError(BaseDepsTreeError):
-  """Raised when a dependency cycle is encountered."""
+  """Raised when a dependency cycle is encountered.
 
-  def __init__(self, dependency_list):
+  Attributes:
+    cycles: All cycles among the sources needed, each as a list of namespaces
+      provided by its sources.
+  """
+
+  def __init__(self, dependency_list, cycles=None):
     BaseDepsTreeError.__init__(self)
     self._dependency_list = dependency_list
+    self.cycles = cycles or []
 
   def __str__(self):
-    return ('Encountered circular dependency:\n%s\n' %
-            '\n'.join(self._dependency_list))
+    msg = ('Encountered circular dependency:\n%s\n' %
+           '\n'.join(self._dependency_list))
+    if len(self.cycles) > 1:
+      msg += ('All %d dependency cycles (namespaces of their sources):\n%s\n' %
+              (len(self.cycles),
+               '\n'.join(', '.join(cycle) for cycle in self.cycles)))
+    return msg
 
 
 class MultipleProvideError(BaseDepsTreeError):
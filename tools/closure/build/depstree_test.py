@@ -122,6 +122,38 @@ class DepsTreeTestCase(unittest.TestCase):
     tree = depstree.DepsTree([a, b, c, d])
     self.AssertValidDependencies(tree.GetDependencies(['D', 'A']))
 
+  def testDependencyOrder(self):
+    a = MockSource(['A'], ['B'])
+    b = MockSource(['B'], ['C'])
+    c = MockSource(['C'], [])
+    d = MockSource(['D'], ['C'])
+
+    tree = depstree.DepsTree([a, b, c, d])
+    self.assertEqual([c, b, a, d], tree.GetDependencies(['A', 'D']))
+
+  def testDeepDependencyChain(self):
+    sources = [MockSource(['N%d' % i], ['N%d' % (i + 1)]) for i in range(5000)]
+    sources.append(MockSource(['N5000'], []))
+
+    tree = depstree.DepsTree(sources)
+    deps = tree.GetDependencies('N0')
+    self.assertEqual(list(reversed(sources)), deps)
+
+  def testAllCyclesReported(self):
+    a = MockSource(['A'], ['B', 'X'])
+    b = MockSource(['B'], ['C'])
+    c = MockSource(['C'], ['B'])
+    x = MockSource(['X'], ['Y'])
+    y = MockSource(['Y', 'Y.Z'], ['X', 'Y.Z'])
+
+    tree = depstree.DepsTree([a, b, c, x, y])
+
+    try:
+      tree.GetDependencies('A')
+      self.fail('CircularDependencyError not raised')
+    except depstree.CircularDependencyError as error:
+      self.assertEqual([['B', 'C'], ['X', 'Y', 'Y.Z']], sorted(error.cycles))
+
 
 if __name__ == '__main__':
   unittest.main()
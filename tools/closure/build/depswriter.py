@@ -30,6 +30,7 @@ import posixpath
 import shlex
 import sys
 
+import scancache
 import source
 import treescan
 
@@ -106,6 +107,19 @@ def _GetOptionsParser():
                     'the file in the generated deps file (if either contains '
                     'a space, surround with whitespace). This flag may be '
                     'specified multiple times.')
+  parser.add_option('--scan_cache',
+                    dest='scan_cache',
+                    action='store',
+                    help=('If specified, provides and requires of sources are '
+                          'kept in this file and files that did not change '
+                          'are not scanned again.'))
+  parser.add_option('-j',
+                    '--jobs',
+                    dest='jobs',
+                    type='int',
+                    action='store',
+                    help=('Number of processes scanning sources. Default is '
+                          'the number of cores.'))
   return parser
 
 
@@ -123,29 +137,43 @@ def _NormalizePathSeparators(path):
   return path.replace(os.sep, posixpath.sep)
 
 
-def _GetRelativePathToSourceDict(root, prefix=''):
-  """Scans a top root directory for .js sources.
+def _GetRelativePaths(root, prefix=''):
+  """Scans a top root directory for .js files.
 
   Args:
     root: str, Root directory.
     prefix: str, Prefix for returned paths.
 
   Returns:
-    dict, A map of relative paths (with prefix, if given), to source.Source
-      objects.
+    list, (path relative to the root, with prefix if given, path of the file)
+      pairs.
   """
-  # Remember and restore the cwd when we're done. We work from the root so
-  # that paths are relative from the root.
-  start_wd = os.getcwd()
-  os.chdir(root)
+  paths = []
+  for path in treescan.ScanTreeForJsFiles(root):
+    relative_path = os.path.relpath(path, root)
+    prefixed_path = _NormalizePathSeparators(os.path.join(prefix,
+                                                          relative_path))
+    paths.append((prefixed_path, path))
+  return paths
 
-  path_to_source = {}
-  for path in treescan.ScanTreeForJsFiles('.'):
-    prefixed_path = _NormalizePathSeparators(os.path.join(prefix, path))
-    path_to_source[prefixed_path] = source.Source(source.GetFileContents(path))
 
-  os.chdir(start_wd)
+def _GetPathToSourceDict(paths, scan_cache=None, jobs=None):
+  """Scans files, in parallel.
 
+  Args:
+    paths: list, (path in deps file, path of the file) pairs. Later pairs
+      replace earlier ones with the same path in deps file.
+    scan_cache: scancache.ScanCache, Cache of scanned sources, optional.
+    jobs: int, Number of processes, as in scancache.ScanFiles.
+
+  Returns:
+    dict, A map of paths in deps file to source.Source objects.
+  """
+  all_deps = scancache.ScanSources([path for deps_path, path in paths],
+                                   scan_cache, jobs)
+  path_to_source = {}
+  for (deps_path, path), deps in zip(paths, all_deps):
+    path_to_source[deps_path] = source.Source(None, deps)
   return path_to_source
 
 
@@ -166,25 +194,35 @@ def main():
                       level=logging.INFO)
   options, args = _GetOptionsParser().parse_args()
 
-  path_to_source = {}
+  paths = []
+
+  scan_cache = None
+  if options.scan_cache:
+    scan_cache = scancache.ScanCache(options.scan_cache)
 
   # Roots without prefixes
   for root in options.roots:
-    path_to_source.update(_GetRelativePathToSourceDict(root))
+    paths.extend(_GetRelativePaths(root))
 
   # Roots with prefixes
   for root_and_prefix in options.roots_with_prefix:
     root, prefix = _GetPair(root_and_prefix)
-    path_to_source.update(_GetRelativePathToSourceDict(root, prefix=prefix))
+    paths.extend(_GetRelativePaths(root, prefix=prefix))
 
   # Source paths
   for path in args:
-    path_to_source[path] = source.Source(source.GetFileContents(path))
+    paths.append((path, path))
 
   # Source paths with alternate deps paths
   for path_with_depspath in options.paths_with_depspath:
     srcpath, depspath = _GetPair(path_with_depspath)
-    path_to_source[depspath] = source.Source(source.GetFileContents(srcpath))
+    paths.append((depspath, srcpath))
+
+  # Files of all roots are scanned together
+  path_to_source = _GetPathToSourceDict(paths, scan_cache, options.jobs)
+
+  if scan_cache:
+    scan_cache.Save()
 
   # Make our output pipe.
   if options.output_file:
@@ -15,6 +15,7 @@
 """Utility to use the Closure Compiler CLI from Python."""
 
 import distutils.version
+import json
 import logging
 import re
 import subprocess
@@ -26,39 +27,68 @@ import subprocess
 _VERSION_REGEX = re.compile('"([0-9][.0-9]*)')
 
 
-def _GetJavaVersion():
-  """Returns the string for the current version of Java installed."""
-  proc = subprocess.Popen(['java', '-version'], stderr=subprocess.PIPE)
-  unused_stdoutdata, stderrdata = proc.communicate()
-  version_line = stderrdata.splitlines()[0]
-  return _VERSION_REGEX.search(version_line).group(1)
+# Version of Java, found once per process.
+_java_version = None
 
 
-def Compile(compiler_jar_path, source_paths, flags=None):
+def GetJavaVersion():
+  """Returns the string for the current version of Java installed.
+
+  Java is asked once per process; calcdeps.py shares the result.
+  """
+  global _java_version
+  if _java_version is None:
+    proc = subprocess.Popen(['java', '-version'], stderr=subprocess.PIPE)
+    unused_stdoutdata, stderrdata = proc.communicate()
+    version_line = stderrdata.splitlines()[0]
+    _java_version = _VERSION_REGEX.search(version_line).group(1)
+  return _java_version
+
+
+def GetCompilerArgs(source_paths, flags=None):
+  """Returns arguments of the compiler, without the command itself.
+
+  Args:
+    source_paths: Source paths to build, in order.
+    flags: A list of additional flags to pass on to Closure Compiler.
+  """
+  args = []
+  for path in source_paths:
+    args += ['--js', path]
+
+  if flags:
+    args += flags
+  return args
+
+
+def Compile(compiler_jar_path, source_paths, flags=None,
+            compiler_command=None):
   """Prepares command-line call to Closure Compiler.
 
   Args:
     compiler_jar_path: Path to the Closure compiler .jar file.
     source_paths: Source paths to build, in order.
     flags: A list of additional flags to pass on to Closure Compiler.
+    compiler_command: A list, the command to run instead of
+      'java -jar compiler_jar_path'. It's given the same arguments and has to
+      write compiled source to standard output.
 
   Returns:
     The compiled source, as a string, or None if compilation failed.
   """
 
-  # User friendly version check.
-  if not (distutils.version.LooseVersion(_GetJavaVersion()) >=
-          distutils.version.LooseVersion('1.6')):
-    logging.error('Closure Compiler requires Java 1.6 or higher. '
-                  'Please visit http://www.java.com/getjava')
-    return
+  if compiler_command:
+    args = list(compiler_command)
+  else:
+    # User friendly version check.
+    if not (distutils.version.LooseVersion(GetJavaVersion()) >=
+            distutils.version.LooseVersion('1.6')):
+      logging.error('Closure Compiler requires Java 1.6 or higher. '
+                    'Please visit http://www.java.com/getjava')
+      return
+    args = ['java', '-jar', compiler_jar_path]
 
-  args = ['java', '-jar', compiler_jar_path]
-  for path in source_paths:
-    args += ['--js', path]
-
-  if flags:
-    args += flags
+  args += GetCompilerArgs(source_paths, flags)
 
   logging.info('Compiling with the following command: %s', ' '.join(args))
 
@@ -69,3 +99,79 @@ def Compile(compiler_jar_path, source_paths, flags=None):
     return
 
   return stdoutdata
+
+
+class Worker(object):
+  """A persistent process running compile jobs.
+
+  Starting Java and the compiler takes a good part of a small build, so
+  closurebuilder.py --watch and compileserver.py keep one worker for all
+  builds, e.g. a wrapper around the compiler's CommandLineRunner keeping its
+  JVM alive.  The worker reads one JSON line {"args": [compiler arguments]}
+  per job from standard input and writes one JSON line {"returncode": int,
+  "output": str} per job to standard output.
+  """
+
+  def __init__(self, command):
+    """Initializes the worker; the process is started by the first job.
+
+    Args:
+      command: A list, the command of the worker process.
+    """
+    self._command = command
+    self._proc = None
+
+  def Compile(self, source_paths, flags=None):
+    """Compiles sources, as Compile does.
+
+    Args:
+      source_paths: Source paths to build, in order.
+      flags: A list of additional flags to pass on to Closure Compiler.
+
+    Returns:
+      The compiled source, as a string, or None if compilation failed.
+    """
+    return self.Run(GetCompilerArgs(source_paths, flags))
+
+  def Run(self, args):
+    """Runs a compile job, starting the process again if it exited.
+
+    Args:
+      args: A list of arguments for the compiler.
+
+    Returns:
+      The compiled source, as a string, or None if compilation failed.
+    """
+    if self._proc is None or self._proc.poll() is not None:
+      logging.info('Starting worker: %s', ' '.join(self._command))
+      # The process must not keep open connections of compileserver.py.
+      self._proc = subprocess.Popen(self._command, stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE, close_fds=True)
+
+    logging.info('Compiling with the worker: %s', ' '.join(args))
+    try:
+      self._proc.stdin.write(json.dumps({'args': args}) + '\n')
+      self._proc.stdin.flush()
+      line = self._proc.stdout.readline()
+    except IOError:
+      line = ''
+    if not line:
+      logging.error('Worker exited.')
+      self.Close()
+      return
+
+    result = json.loads(line)
+    if result['returncode'] != 0:
+      return
+    return result['output'].encode('utf-8')
+
+  def Close(self):
+    """Stops the process."""
+    if self._proc is None:
+      return
+    try:
+      self._proc.stdin.close()
+    except IOError:
+      pass
+    self._proc.wait()
+    self._proc = None
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""Unit test for jscompiler, with a stand-in compiler and worker."""
+
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import jscompiler
+
+
+class JsCompilerTestCase(unittest.TestCase):
+  """Unit test for jscompiler."""
+
+  def setUp(self):
+    self._dir = tempfile.mkdtemp()
+    self._js_paths = []
+    for name in ['a', 'b']:
+      path = os.path.join(self._dir, name + '.js')
+      with open(path, 'w') as js_file:
+        js_file.write('var %s;\n' % name)
+      self._js_paths.append(path)
+    compiler_path = os.path.join(self._dir, 'compiler.py')
+    with open(compiler_path, 'w') as compiler_file:
+      compiler_file.write(STAND_IN_COMPILER)
+    self._compiler_command = [sys.executable, compiler_path]
+    worker_path = os.path.join(self._dir, 'worker.py')
+    with open(worker_path, 'w') as worker_file:
+      worker_file.write(STAND_IN_WORKER)
+    self._worker_command = [sys.executable, worker_path]
+
+  def tearDown(self):
+    shutil.rmtree(self._dir)
+
+  def testCompileWithCommand(self):
+    self.assertEqual(
+        '// --foo\nvar a;\nvar b;\n',
+        jscompiler.Compile(None, self._js_paths, ['--foo'],
+                           self._compiler_command))
+
+  def testFailedCompile(self):
+    self.assertEqual(
+        None,
+        jscompiler.Compile(None, self._js_paths, ['--fail'],
+                           self._compiler_command))
+
+  def testWorkerRunsAllJobs(self):
+    worker = jscompiler.Worker(self._worker_command)
+    self.addCleanup(worker.Close)
+
+    self.assertEqual('// job 1\nvar a;\nvar b;\n',
+                     worker.Compile(self._js_paths))
+    self.assertEqual(None, worker.Compile(self._js_paths, ['--fail']))
+    self.assertEqual('// job 3\nvar b;\n',
+                     worker.Compile(self._js_paths[1:]))
+
+  def testWorkerIsStartedAgain(self):
+    worker = jscompiler.Worker(self._worker_command)
+    self.addCleanup(worker.Close)
+
+    self.assertEqual(None, worker.Run(['--exit']))
+    self.assertEqual('// job 1\nvar a;\n',
+                     worker.Compile(self._js_paths[:1]))
+
+
+# Writes flags and then contents of --js files; fails with --fail.
+STAND_IN_COMPILER = """
+import sys
+
+args = sys.argv[1:]
+if '--fail' in args:
+  sys.exit(1)
+paths = [args[i + 1] for i, arg in enumerate(args) if arg == '--js']
+flags = [arg for i, arg in enumerate(args)
+         if arg != '--js' and (i == 0 or args[i - 1] != '--js')]
+sys.stdout.write(''.join(['// %s\\n' % flag for flag in flags] +
+                         [open(path).read() for path in paths]))
+"""
+
+# Writes the number of the job and then contents of --js files; fails with
+# --fail and exits with --exit.
+STAND_IN_WORKER = """
+import json
+import sys
+
+for job_number, line in enumerate(iter(sys.stdin.readline, ''), 1):
+  args = json.loads(line)['args']
+  if '--exit' in args:
+    sys.exit(0)
+  paths = [args[i + 1] for i, arg in enumerate(args) if arg == '--js']
+  output = ''.join(['// job %d\\n' % job_number] +
+                   [open(path).read() for path in paths])
+  sys.stdout.write(json.dumps({'returncode': int('--fail' in args),
+                               'output': output}) + '\\n')
+  sys.stdout.flush()
+"""
+
+
+if __name__ == '__main__':
+  unittest.main()
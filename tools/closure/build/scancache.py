@@ -0,0 +1,216 @@
+"""Persistent cache of provides and requires scanned from JavaScript files.
+
+Results of a scan are stored in a JSON file, keyed by absolute path, along
+with mtime, size and SHA-1 of the file.  A file whose mtime and size didn't
+change is not read at all; a file which was touched but has the same contents
+is read, but not scanned again.  The same cache file may be shared by
+closurebuilder, depswriter and calcdeps: results of every scanner are stored
+under its own name.
+
+ScanFiles reads and scans files which are not in the cache in a pool of
+processes.
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+
+import source
+
+
+_CACHE_VERSION = 1
+
+# Fewer files are scanned in this process; starting the pool takes longer.
+_MIN_PARALLEL_FILES = 32
+
+
+def _ScanSource(contents):
+  """Scans with source.Source, as closurebuilder and depswriter do."""
+  js_source = source.Source(contents)
+  return sorted(js_source.provides), sorted(js_source.requires)
+
+
+def ScanFile(path, scan, known_sha1=None):
+  """Reads and scans a file.
+
+  Args:
+    path: str, Path to the file.
+    scan: A function taking contents of the file and returning its result.
+    known_sha1: str, SHA-1 of contents for which the result is known already.
+
+  Returns:
+    (mtime, size, sha1, result) of the file; result is None if contents have
+    known_sha1.
+
+  Raises:
+    IOError: An error occurred reading the file.
+  """
+  st = os.stat(path)
+  contents = source.GetFileContents(path)
+  digest = hashlib.sha1(contents).hexdigest()
+  if digest == known_sha1:
+    return st.st_mtime, st.st_size, digest, None
+  return st.st_mtime, st.st_size, digest, scan(contents)
+
+
+def _ScanFileJob(args):
+  """ScanFile for the pool, which passes one argument."""
+  return ScanFile(*args)
+
+
+def ScanFiles(paths, scanner, scan, scan_cache=None, jobs=None):
+  """Scans files, in parallel, taking unchanged ones from scan_cache.
+
+  Args:
+    paths: A list of paths to files.
+    scanner: str, Name of the scanner in the cache.
+    scan: A function as in ScanCache.Get. It's called in other processes, so
+      it has to be a module level function.
+    scan_cache: ScanCache, optional.
+    jobs: int, Number of processes, all cores by default. With 1 files are
+      scanned in this process.
+
+  Returns:
+    A list of results, in order of paths.
+  """
+  results = [None] * len(paths)
+  to_scan = []
+  for i, path in enumerate(paths):
+    known_sha1 = None
+    if scan_cache:
+      results[i], known_sha1 = scan_cache.Find(path, scanner)
+    if results[i] is None:
+      to_scan.append((i, (path, scan, known_sha1)))
+
+  processes = jobs or multiprocessing.cpu_count()
+  if processes == 1 or len(to_scan) < _MIN_PARALLEL_FILES:
+    scanned = [_ScanFileJob(args) for i, args in to_scan]
+  else:
+    pool = multiprocessing.Pool(processes)
+    try:
+      chunk_size = max(1, len(to_scan) // (4 * processes))
+      scanned = pool.map(_ScanFileJob, [args for i, args in to_scan],
+                         chunk_size)
+    finally:
+      pool.close()
+      pool.join()
+
+  for (i, args), (mtime, size, digest, result) in zip(to_scan, scanned):
+    if scan_cache:
+      result = scan_cache.Store(args[0], scanner, mtime, size, digest, result)
+    results[i] = result
+  return results
+
+
+def ScanSources(paths, scan_cache=None, jobs=None):
+  """Returns (provides, requires) of files as found by source.Source.
+
+  Files are scanned as in ScanFiles.
+  """
+  return [([str(p) for p in provides], [str(r) for r in requires])
+          for provides, requires in ScanFiles(paths, 'source', _ScanSource,
+                                              scan_cache, jobs)]
+
+
+class ScanCache(object):
+  """Scan results of files, persisted between runs."""
+
+  def __init__(self, path):
+    """Loads the cache.
+
+    Args:
+      path: str, Path to the cache file. It's created by Save if it doesn't
+        exist; a broken or old one is ignored. With None the cache is kept
+        only in memory.
+    """
+    self._path = path
+    self._files = {}
+    self._dirty = False
+    self.hits = 0
+    self.misses = 0
+
+    if path is None:
+      return
+    try:
+      with open(path) as cache_file:
+        cache = json.load(cache_file)
+      if cache.get('version') == _CACHE_VERSION:
+        self._files = cache['files']
+    except (IOError, ValueError):
+      pass
+
+  def Get(self, path, scanner, scan):
+    """Returns the result of scanning the file.
+
+    Args:
+      path: str, Path to the file.
+      scanner: str, Name of the scanner.
+      scan: A function taking contents of the file and returning its result,
+        which has to be serializable to JSON.
+
+    Returns:
+      The result of scan, as it was loaded from JSON if it comes from the
+      cache (lists instead of tuples, unicode strings).
+
+    Raises:
+      IOError: An error occurred reading the file.
+    """
+    result, known_sha1 = self.Find(path, scanner)
+    if result is not None:
+      return result
+    mtime, size, digest, result = ScanFile(path, scan, known_sha1)
+    return self.Store(path, scanner, mtime, size, digest, result)
+
+  def Find(self, path, scanner):
+    """Looks up the file without reading it.
+
+    Returns:
+      (result, None) if the file didn't change since it was scanned, else
+      (None, SHA-1 of contents scanned last time or None).
+
+    Raises:
+      OSError: The file doesn't exist.
+    """
+    key = os.path.abspath(path)
+    st = os.stat(key)
+    entry = self._files.get(key)
+    if entry is None or scanner not in entry['scans']:
+      return None, None
+    if entry['mtime'] == st.st_mtime and entry['size'] == st.st_size:
+      self.hits += 1
+      return entry['scans'][scanner], None
+    return None, entry['sha1']
+
+  def Store(self, path, scanner, mtime, size, digest, result):
+    """Stores the result of ScanFile; returns the result of the scan."""
+    key = os.path.abspath(path)
+    entry = self._files.get(key)
+    if entry is None or entry['sha1'] != digest:
+      entry = {'sha1': digest, 'scans': {}}
+    entry['mtime'] = mtime
+    entry['size'] = size
+    self._files[key] = entry
+    self._dirty = True
+
+    if result is None:
+      self.hits += 1
+    else:
+      self.misses += 1
+      entry['scans'][scanner] = result
+    return entry['scans'][scanner]
+
+  def Save(self):
+    """Writes the cache if anything changed, without files that are gone."""
+    if not self._dirty or self._path is None:
+      return
+    files = dict((key, entry) for key, entry in self._files.iteritems()
+                 if os.path.exists(key))
+    directory = os.path.dirname(self._path)
+    if directory and not os.path.isdir(directory):
+      os.makedirs(directory)
+    tmp = self._path + '.tmp'
+    with open(tmp, 'w') as cache_file:
+      json.dump({'version': _CACHE_VERSION, 'files': files}, cache_file)
+    os.rename(tmp, self._path)
+    self._dirty = False
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""Unit test for scancache."""
+
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import scancache
+
+
+class ScanCacheTestCase(unittest.TestCase):
+  """Unit test for scancache."""
+
+  def setUp(self):
+    self._dir = tempfile.mkdtemp()
+    self._cache_path = os.path.join(self._dir, 'cache', 'scan.json')
+    self._js_path = os.path.join(self._dir, 'foo.js')
+    self._WriteSource(_TEST_SOURCE)
+
+  def tearDown(self):
+    shutil.rmtree(self._dir)
+
+  def _WriteSource(self, contents, mtime=1000):
+    with open(self._js_path, 'w') as js_file:
+      js_file.write(contents)
+    os.utime(self._js_path, (mtime, mtime))
+
+  def _GetDeps(self, cache):
+    return tuple(scancache.ScanSources([self._js_path], cache, jobs=1)[0])
+
+  def testGetDeps(self):
+    cache = scancache.ScanCache(self._cache_path)
+
+    self.assertEqual((['foo'], ['goog.dom']), self._GetDeps(cache))
+    self.assertEqual(1, cache.misses)
+
+  def testUnchangedFileIsNotRead(self):
+    cache = scancache.ScanCache(self._cache_path)
+    self._GetDeps(cache)
+    cache.Save()
+    # same size and mtime, so it's taken as unchanged
+    self._WriteSource(_TEST_SOURCE.replace('goog.dom', 'goog.xyz'))
+
+    cache = scancache.ScanCache(self._cache_path)
+    self.assertEqual((['foo'], ['goog.dom']), self._GetDeps(cache))
+    self.assertEqual(1, cache.hits)
+
+  def testTouchedFileIsNotScanned(self):
+    cache = scancache.ScanCache(self._cache_path)
+    self._GetDeps(cache)
+    self._WriteSource(_TEST_SOURCE, mtime=2000)
+
+    calls = []
+    def Scan(contents):
+      calls.append(contents)
+      return 'result'
+    cache.Get(self._js_path, 'source', Scan)
+
+    self.assertEqual([], calls)
+    self.assertEqual(1, cache.hits)
+
+  def testChangedFileIsScanned(self):
+    cache = scancache.ScanCache(self._cache_path)
+    self._GetDeps(cache)
+    self._WriteSource(_TEST_SOURCE.replace('goog.dom', 'goog.array'),
+                      mtime=2000)
+
+    self.assertEqual((['foo'], ['goog.array']), self._GetDeps(cache))
+    self.assertEqual(2, cache.misses)
+
+  def testScannersAreSeparate(self):
+    cache = scancache.ScanCache(self._cache_path)
+    self._GetDeps(cache)
+
+    self.assertEqual(5, cache.Get(self._js_path, 'other', lambda source: 5))
+    self.assertEqual(2, cache.misses)
+
+  def testRemovedFilesAreNotSaved(self):
+    cache = scancache.ScanCache(self._cache_path)
+    self._GetDeps(cache)
+    os.remove(self._js_path)
+    cache.Save()
+
+    with open(self._cache_path) as cache_file:
+      self.assertEqual({}, json.load(cache_file)['files'])
+
+  def testParallelScanKeepsOrder(self):
+    paths = []
+    for i in range(100):
+      path = os.path.join(self._dir, '%d.js' % i)
+      with open(path, 'w') as js_file:
+        js_file.write("goog.provide('foo%d');\n" % i)
+      paths.append(path)
+
+    all_deps = scancache.ScanSources(paths, jobs=2)
+
+    self.assertEqual([(['foo%d' % i], []) for i in range(100)], all_deps)
+
+
+_TEST_SOURCE = """goog.provide('foo');
+
+goog.require('goog.dom');
+"""
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -47,18 +47,24 @@ class Source(object):
       \*/    # Closing "*/""",
       re.MULTILINE | re.DOTALL | re.VERBOSE)
 
-  def __init__(self, source):
+  def __init__(self, source, deps=None):
     """Initialize a source.
 
     Args:
       source: str, The JavaScript source.
+      deps: (provides, requires) of the source, if they are known already
+        (e.g. from scancache). The source is not scanned then.
     """
 
     self.provides = set()
     self.requires = set()
 
     self._source = source
-    self._ScanSource()
+    if deps is None:
+      self._ScanSource()
+    else:
+      self.provides.update(deps[0])
+      self.requires.update(deps[1])
 
   def __str__(self):
     return 'Source %s' % self._path
@@ -42,12 +42,18 @@ import re
 import subprocess
 import sys
 
+# Scan cache and deps files reading are shared with the tools in build/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'build'))
+import depsdb
+import jscompiler
+import scancache
+
 
 _BASE_REGEX_STRING = '^\s*goog\.%s\(\s*[\'"](.+)[\'"]\s*\)'
 req_regex = re.compile(_BASE_REGEX_STRING % 'require')
 prov_regex = re.compile(_BASE_REGEX_STRING % 'provide')
 ns_regex = re.compile('^ns:((\w+\.)*(\w+))$')
-version_regex = re.compile('[\.0-9]+')
 
 
 def IsValidFile(ref):
@@ -113,7 +119,7 @@ class DependencyInfo(object):
                                              repr(self.requires))
 
 
-def BuildDependenciesFromFiles(files):
+def BuildDependenciesFromFiles(files, scan_cache=None, deps_db=None):
   """Build a list of dependencies from a list of files.
 
   Description:
@@ -122,6 +128,11 @@ def BuildDependenciesFromFiles(files):
 
   Args:
     files: a list of files to be parsed for goog.provides and goog.requires.
+    scan_cache: a scancache.ScanCache; files which didn't change since they
+      were scanned last time are not parsed again.
+    deps_db: a depsdb.DepsDatabase; files listed in it are not parsed,
+      unless they were modified after its deps file.  Their provides and
+      requires are in order of the deps file.
 
   Returns:
     A list of dependency objects, one for each file in the files argument.
@@ -132,6 +143,24 @@ def BuildDependenciesFromFiles(files):
     if filename in filenames:
       continue
 
+    listed = deps_db and deps_db.Get(filename)
+    if listed:
+      dep = DependencyInfo(filename)
+      dep.provides, dep.requires = listed
+      result.append(dep)
+      filenames.add(filename)
+      continue
+
+    if scan_cache:
+      dep = DependencyInfo(filename)
+      provides, requires = scan_cache.Get(filename, 'calcdeps',
+                                          ScanDependencies)
+      dep.provides = [str(p) for p in provides]
+      dep.requires = [str(r) for r in requires]
+      result.append(dep)
+      filenames.add(filename)
+      continue
+
     # Python 3 requires the file encoding to be specified
     if (sys.version_info[0] < 3):
       file_handle = open(filename, 'r')
@@ -168,6 +197,12 @@ def CreateDependencyInfo(filename, source):
   return dep
 
 
+def ScanDependencies(source):
+  """Returns (provides, requires) of the source, as CreateDependencyInfo."""
+  dep = CreateDependencyInfo(None, source.splitlines(True))
+  return dep.provides, dep.requires
+
+
 def BuildDependencyHashFromDependencies(deps):
   """Builds a hash for searching dependencies by the namespaces they provide.
 
@@ -198,7 +233,7 @@ def BuildDependencyHashFromDependencies(deps):
   return dep_hash
 
 
-def CalculateDependencies(paths, inputs):
+def CalculateDependencies(paths, inputs, scan_cache=None, deps_db=None):
   """Calculates the dependencies for given inputs.
 
   Description:
@@ -214,6 +249,8 @@ def CalculateDependencies(paths, inputs):
       dependency hash.
     inputs: the inputs (files, directories, namespaces) that have dependencies
       that need to be calculated.
+    scan_cache: a scancache.ScanCache for BuildDependenciesFromFiles.
+    deps_db: a depsdb.DepsDatabase for BuildDependenciesFromFiles.
 
   Raises:
     Exception: if a provided input is invalid.
@@ -222,7 +259,8 @@ def CalculateDependencies(paths, inputs):
     A list of all files, including inputs, that are needed to compile the given
     inputs.
   """
-  deps = BuildDependenciesFromFiles(paths + inputs)
+  deps = BuildDependenciesFromFiles(paths + inputs, scan_cache, deps_db)
+  deps_by_filename = dict((dep.filename, dep) for dep in deps)
   search_hash = BuildDependencyHashFromDependencies(deps)
   result_list = []
   seen_list = []
@@ -235,14 +273,8 @@ def CalculateDependencies(paths, inputs):
     if not IsValidFile(input_file) or not IsJsFile(input_file):
       raise Exception('Invalid file (%s)' % input_file)
     seen_list.append(input_file)
-    file_handle = open(input_file, 'r')
-    try:
-      for line in file_handle:
-        if re.match(req_regex, line):
-          require = re.search(req_regex, line).group(1)
-          ResolveDependencies(require, search_hash, result_list, seen_list)
-    finally:
-      file_handle.close()
+    for require in deps_by_filename[input_file].requires:
+      ResolveDependencies(require, search_hash, result_list, seen_list)
     result_list.append(input_file)
 
   # All files depend on base.js, so put it first.
@@ -351,7 +383,7 @@ def PrintLine(msg, out):
   out.write('\n')
 
 
-def PrintDeps(source_paths, deps, out):
+def PrintDeps(source_paths, deps, out, scan_cache=None):
   """Print out a deps.js file from a list of source paths.
 
   Args:
@@ -359,6 +391,7 @@ def PrintDeps(source_paths, deps, out):
     deps: Paths that provide dependency info. Their dependency info should
         not appear in the deps file.
     out: The output file.
+    scan_cache: a scancache.ScanCache for BuildDependenciesFromFiles.
 
   Returns:
     True on success, false if it was unable to find the base path
@@ -371,7 +404,7 @@ def PrintDeps(source_paths, deps, out):
   PrintLine('// This file was autogenerated by calcdeps.py', out)
   excludesSet = set(deps)
 
-  for dep in BuildDependenciesFromFiles(source_paths + deps):
+  for dep in BuildDependenciesFromFiles(source_paths + deps, scan_cache):
     if not dep.filename in excludesSet:
       PrintLine(GetDepsLine(dep, base_path), out)
 
@@ -388,10 +421,7 @@ def PrintScript(source_paths, out):
 
 def GetJavaVersion():
   """Returns the string for the current version of Java installed."""
-  proc = subprocess.Popen(['java', '-version'], stderr=subprocess.PIPE)
-  proc.wait()
-  version_line = proc.stderr.read().splitlines()[0]
-  return version_regex.search(version_line).group()
+  return jscompiler.GetJavaVersion()
 
 
 def FilterByExcludes(options, files):
@@ -535,18 +565,39 @@ def main():
                     action='store',
                     help=('If specified, write output to this path instead of '
                           'writing to standard output.'))
+  parser.add_option('--scan_cache',
+                    dest='scan_cache',
+                    action='store',
+                    help=('If specified, provides and requires of files are '
+                          'kept in this file and files that did not change '
+                          'are not scanned again.'))
+  parser.add_option('--deps_file',
+                    dest='deps_files',
+                    action='append',
+                    help=('A deps.js file with provides and requires of '
+                          'files, so they are not scanned, unless modified '
+                          'after the file. Paths in it are relative to '
+                          'Closure\'s base.js. Not used in "deps" mode. May '
+                          'be specified multiple times.'))
 
   (options, args) = parser.parse_args()
 
   search_paths = GetPathsFromOptions(options)
 
+  scan_cache = None
+  if options.scan_cache:
+    scan_cache = scancache.ScanCache(options.scan_cache)
+
   if options.output_file:
     out = open(options.output_file, 'w')
   else:
     out = sys.stdout
 
   if options.output_mode == 'deps':
-    result = PrintDeps(search_paths, ExpandDirectories(options.deps or []), out)
+    result = PrintDeps(search_paths, ExpandDirectories(options.deps or []), out,
+                       scan_cache)
+    if scan_cache:
+      scan_cache.Save()
     if not result:
       logging.error('Could not find Closure Library in the specified paths')
       sys.exit(1)
@@ -555,8 +606,19 @@ def main():
 
   inputs = GetInputsFromOptions(options)
 
+  deps_db = None
+  if options.deps_files:
+    base_js_path = FindClosureBasePath(search_paths)
+    if not base_js_path:
+      logging.error('Could not find Closure Library in the specified paths')
+      sys.exit(1)
+    deps_db = depsdb.DepsDatabase(options.deps_files,
+                                  os.path.dirname(base_js_path))
+
   logging.info('Finding Closure dependencies...')
-  deps = CalculateDependencies(search_paths, inputs)
+  deps = CalculateDependencies(search_paths, inputs, scan_cache, deps_db)
+  if scan_cache:
+    scan_cache.Save()
   output_mode = options.output_mode
 
   if output_mode == 'script':
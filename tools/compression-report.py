@@ -0,0 +1,167 @@
+#!/usr/bin/python
+# Reports size and inflate time of archives compressed with packer's policy.
+# For every extension: stored size, deflated size and inflate time; for every
+# archive: size stored, with the policy and of .gz/.br sidecars.
+# Inflate time is measured with the client's zip.js inflater run by node, if
+# it's available, otherwise with zlib (which is several times faster).
+#
+# Usage: compression-report.py [options] [archive.zip...]
+
+import os
+import glob
+import time
+import zlib
+import json
+import zipfile
+import tempfile
+import subprocess
+import optparse
+from cStringIO import StringIO
+
+import packer
+
+INFLATE_JS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                          'project', 'js', 'files', 'zipjs', 'inflate.js')
+
+# Prints best time (ms) of inflating every file given in arguments
+NODE_BENCHMARK = '''
+var fs = require('fs'), vm = require('vm');
+var sandbox = {zip: {}};
+vm.runInNewContext(fs.readFileSync(process.argv[1], 'utf8'), sandbox);
+var repeat = parseInt(process.argv[2], 10);
+console.log(JSON.stringify(process.argv.slice(3).map(function (path) {
+    var data = new Uint8Array(fs.readFileSync(path));
+    var best = Infinity, i, start, inflater;
+    for (i = 0; i < repeat; ++i) {
+        start = process.hrtime();
+        inflater = new sandbox.zip.Inflater();
+        inflater.append(data);
+        inflater.flush();
+        start = process.hrtime(start);
+        best = Math.min(best, start[0] * 1e3 + start[1] / 1e6);
+    }
+    return best;
+})));
+'''
+
+def deflate(data, level):
+    co = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return co.compress(data) + co.flush()
+
+def zlib_inflate_times(streams, repeat):
+    times = []
+    for data in streams:
+        best = None
+        for i in range(repeat):
+            start = time.time()
+            zlib.decompress(data, -15)
+            elapsed = (time.time() - start) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        times.append(best)
+    return times
+
+def node_inflate_times(node, streams, repeat):
+    paths = []
+    try:
+        for data in streams:
+            fd, path = tempfile.mkstemp('.deflate')
+            os.write(fd, data)
+            os.close(fd)
+            paths.append(path)
+        out = subprocess.check_output([node, '-e', NODE_BENCHMARK, INFLATE_JS,
+                                       str(repeat)] + paths)
+        return json.loads(out)
+    finally:
+        for path in paths:
+            os.remove(path)
+
+def inflate_times(streams, repeat, node):
+    if node is not None:
+        return node_inflate_times(node, streams, repeat)
+    return zlib_inflate_times(streams, repeat)
+
+def find_node():
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(directory, 'node')
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+# Returns the archive repacked with the policy, as string
+def repack(archive, level):
+    out = StringIO()
+    names = set()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_STORED) as repacked:
+        for info in archive.infolist():
+            if info.filename in names: # written twice by older packers
+                continue
+            names.add(info.filename)
+            packer.write_entry(repacked, info.filename, archive.read(info.filename),
+                               packer.get_compression(info.filename, level))
+    return out.getvalue()
+
+def sidecar_sizes(data):
+    sizes = {'gz': len(deflate(data, 9)) + 18} # gzip header and trailer
+    try:
+        import brotli
+        sizes['br'] = len(brotli.compress(data))
+    except ImportError:
+        sizes['br'] = None
+    return sizes
+
+def kb(size):
+    return '-' if size is None else '%.1f' % (size / 1024.0)
+
+def report(path, level, repeat, node):
+    print path
+    with zipfile.ZipFile(path) as archive:
+        by_ext = {}
+        for info in archive.infolist():
+            ext = os.path.splitext(info.filename)[1].lower()
+            by_ext.setdefault(ext, []).append(archive.read(info.filename))
+
+        print '  %-10s %5s %10s %10s %6s %10s %10s' % (
+            'extension', 'files', 'stored kB', 'deflate kB', 'ratio',
+            'inflate ms', 'policy')
+        for ext in sorted(by_ext):
+            datas = by_ext[ext]
+            streams = [deflate(d, level or 9) for d in datas]
+            stored = sum(len(d) for d in datas)
+            deflated = sum(len(s) for s in streams)
+            ms = sum(inflate_times(streams, repeat, node))
+            policy = 'deflate' if packer.get_compression('x' + ext, level) else 'store'
+            print '  %-10s %5d %10s %10s %5.0f%% %10.1f %10s' % (
+                ext, len(datas), kb(stored), kb(deflated),
+                100.0 * deflated / max(stored, 1), ms, policy)
+
+        stored_zip = os.path.getsize(path)
+        policy_zip = repack(archive, level)
+    sidecars = sidecar_sizes(policy_zip)
+    print '  archive kB: stored %s, policy %s, .gz %s, .br %s' % (
+        kb(stored_zip), kb(len(policy_zip)), kb(sidecars['gz']), kb(sidecars['br']))
+    print '  inflate ms of .gz (whole archive): %.1f' % inflate_times(
+        [deflate(policy_zip, 9)], repeat, node)[0]
+    print
+
+def main():
+    parser = optparse.OptionParser('usage: %prog [options] [archive.zip...]')
+    parser.add_option('--level', type='int', default=packer.DEFLATE_LEVEL,
+                      help='Deflate level. Default: %default')
+    parser.add_option('--repeat', type='int', default=5,
+                      help='Inflate runs; the best is reported. Default: %default')
+    parser.add_option('--zlib', action='store_true', default=False,
+                      help='Measure inflate time with zlib, even if node is found.')
+    options, archives = parser.parse_args()
+    if not archives:
+        resources = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 '..', 'project', 'resources')
+        archives = sorted(glob.glob(os.path.join(resources, '*.zip')))
+
+    node = None if options.zlib else find_node()
+    print 'Inflate time measured with', 'zip.js (node)' if node else 'zlib'
+    print
+    for path in archives:
+        report(path, options.level, options.repeat, node)
+
+if __name__ == '__main__':
+    main()
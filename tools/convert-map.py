@@ -4,5 +4,9 @@ import sys
 import packer
 
 # Takes map name (without extension and full path) as argument. Output goes to ../resources/converted.
+# With --compile, precompiled geometry is added to the archive, with --lightmaps
+# baked lightmap atlas.
 
-packer.pack_bsp('maps/' + sys.argv[1] + '.bsp', '../resources/baseoa/', '../resources/converted/maps/' + sys.argv[1] + '.zip')
+packer.pack_bsp('maps/' + sys.argv[1] + '.bsp', '../resources/baseoa/', '../resources/converted/maps/' + sys.argv[1] + '.zip',
+                compile_map='--compile' in sys.argv[2:],
+                bake_lightmaps='--lightmaps' in sys.argv[2:])
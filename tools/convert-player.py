@@ -4,5 +4,13 @@ import sys
 import packer
 
 # Takes player name (without extension and full path) as argument. Output goes to ../resources/converted/players/.
+# With --compile, precompiled models are added to the archive. With --anim-error=E
+# they replace md3 files and their animation is compressed to E units of error.
 
-packer.pack_player('models/players/' + sys.argv[1] + '/', '../resources/baseoa/', '../resources/converted/players/' + sys.argv[1] + '.zip')
+anim_error = None
+for arg in sys.argv[2:]:
+    if arg.startswith('--anim-error='):
+        anim_error = float(arg[len('--anim-error='):])
+
+packer.pack_player('models/players/' + sys.argv[1] + '/', '../resources/baseoa/', '../resources/converted/players/' + sys.argv[1] + '.zip',
+                   compile_models='--compile' in sys.argv[2:], anim_error=anim_error)
@@ -1,5 +1,9 @@
 #!/usr/bin/python
 
+import sys
 import packer
 
-packer.pack_weapons('models/weapons2', '../resources/baseoa/', '../resources/converted/weapons.zip')
+# With --compile, precompiled models are added to the archive.
+
+packer.pack_weapons('models/weapons2', '../resources/baseoa/', '../resources/converted/weapons.zip',
+                    compile_models='--compile' in sys.argv[1:])
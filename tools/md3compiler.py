@@ -0,0 +1,260 @@
+# Compiles md3 models offline into a GPU-ready binary (.cmd3).
+# Does what files.md3.load does in the browser: decodes vertex positions and
+# lat/long normals of every frame, interleaves them with texcoords and builds
+# matrices of tags. The loader only creates typed array views over the file.
+#
+# Format (little endian, all sections 4 byte aligned):
+#   header: 'CMD3', version, frame count, tag count, surface count (5 x uint32)
+#   frames: min(3) max(3) origin(3) radius          (frame count x 10 x float32)
+#   tag names: 64 byte strings                      (tag count x 64 bytes)
+#   tags: 4x4 matrices, column major, for every frame and tag
+#                                   (frame count x tag count x 16 x float32)
+#   surfaces, each:
+#     name, shader (64 byte strings), vertex count, index count (2 x uint32)
+#     indices: uint16, padded to 4 bytes
+#     vertices: pos(3) texCoord(2) normal(3) for every frame
+#                                   (frame count x vertex count x 8 x float32)
+# Vertex layout matches the one built by files.md3.load.
+#
+# Version 2 (compile_md3 with max_error) compresses animation. Frames and tags
+# are stored as above; surfaces, each:
+#     name, shader (64 byte strings), vertex count, index count,
+#     key frame count (3 x uint32)
+#     bounds: min(3) step(3) (6 x float32); position = min + step * quantized
+#     frames: key frame a, key frame b (2 x uint16), lerp (float32)
+#                                                    (frame count x 8 bytes)
+#     indices: uint16, padded to 4 bytes
+#     texcoords: (vertex count x 2 x float32)
+#     key frames: quantized pos(3) (uint16), normal lat, lng (2 x int8)
+#                                   (key frame count x vertex count x 8 bytes)
+# Positions and normals of the first key frame are stored as they are, of
+# every next one as differences to the previous (modulo 2^16 and 2^8), which
+# deflates much better.
+# A frame equal to a key frame has a == b and lerp 0 (or 1); other frames are
+# interpolated between two key frames. Every frame is reproduced within
+# max_error units (positions) and NORMAL_ERROR (normal components).
+
+import struct
+import numpy as np
+
+import bsp
+import vfs
+
+MAGIC = 'CMD3'
+VERSION = 1
+ANIMATED_VERSION = 2
+
+NORMAL_ERROR = 0.05
+
+VERTEX_SIZE = 8
+
+FRAME_DTYPE = np.dtype([
+    ('mins', '<f4', 3),
+    ('maxs', '<f4', 3),
+    ('origin', '<f4', 3),
+    ('radius', '<f4'),
+    ('name', 'S16')
+])
+
+TAG_DTYPE = np.dtype([
+    ('name', 'S64'),
+    ('origin', '<f4', 3),
+    ('axis', '<f4', 9)
+])
+
+# Normal bytes are signed, as files.md3 reads them
+VERTEX_DTYPE = np.dtype([
+    ('position', '<i2', 3),
+    ('normal', 'i1', 2)
+])
+
+KEY_DTYPE = np.dtype([
+    ('position', '<u2', 3),
+    ('normal', 'i1', 2)
+])
+
+# Names as files.md3 reads them: trailing nulls and whitespace removed
+def strip_name(name):
+    return name.rstrip('\x00\t\n\r ')
+
+def strip_shader_name(name):
+    name = strip_name(name)
+    if name[-4:] in ('.jpg', '.tga'):
+        name = name[:-4]
+    return name
+
+# Returns (frames, verts, VERTEX_SIZE) array; same decoding as parseVertex_
+def decode_vertices(vertices, texcoords):
+    normal = vertices['normal'].astype(np.float64)
+    lat = normal[..., 0] * 2 * np.pi / 255
+    lng = normal[..., 1] * 2 * np.pi / 255
+    out = np.empty(vertices.shape + (VERTEX_SIZE,), np.float32)
+    out[..., 0:3] = vertices['position'] / 64.0
+    out[..., 3:5] = texcoords
+    out[..., 5] = np.cos(lng) * np.sin(lat)
+    out[..., 6] = np.sin(lng) * np.cos(lat)
+    out[..., 7] = np.cos(lat)
+    return out
+
+# Returns (frames, tags, 16) array of matrices built as in parseTag_
+def tag_matrices(tags):
+    matrices = np.zeros(tags.shape + (16,), np.float32)
+    for row in range(3):
+        matrices[..., 4 * row:4 * row + 3] = tags['axis'][..., 3 * row:3 * row + 3]
+    matrices[..., 12:15] = tags['origin']
+    matrices[..., 15] = 1.0
+    return matrices
+
+def read_surface(data, offset, surface, frames_count):
+    (s_frames, shaders_count, verts_count, triangles_count, triangles_offset,
+     shaders_offset, st_offset, verts_offset, end_offset) = surface
+    if s_frames != frames_count:
+        raise Exception('Surface frames count differs from the model')
+    shader = ''
+    if shaders_count:
+        shader = data[offset + shaders_offset:offset + shaders_offset + 64]
+    indices = np.frombuffer(data, '<i4', triangles_count * 3,
+                            offset + triangles_offset)
+    texcoords = np.frombuffer(data, '<f4', verts_count * 2,
+                              offset + st_offset).reshape(verts_count, 2)
+    vertices = np.frombuffer(data, VERTEX_DTYPE, frames_count * verts_count,
+                             offset + verts_offset)
+    return (shader, indices.astype('<u2').tostring(), texcoords,
+            vertices.reshape(frames_count, verts_count))
+
+# Returns errors of frames a + 1..b - 1 interpolated between frames a and b
+def lerp_errors(positions, normals, a, b):
+    t = (np.arange(a + 1, b, dtype=np.float32) - a) / (b - a)
+    t = t[:, np.newaxis, np.newaxis]
+    p = positions[a] + (positions[b] - positions[a]) * t
+    n = normals[a] + (normals[b] - normals[a]) * t
+    return (np.abs(p - positions[a + 1:b]).max(axis=(1, 2)),
+            np.abs(n - normals[a + 1:b]).max(axis=(1, 2)))
+
+def is_close(positions, normals, i, key, max_error):
+    return (np.abs(positions[i] - positions[key]).max() <= max_error and
+            np.abs(normals[i] - normals[key]).max() <= NORMAL_ERROR)
+
+# Greedily makes segments between key frames as long as every frame inside
+# can be interpolated. Returns (key frames, [(key a, key b, lerp)] per frame)
+def select_keyframes(positions, normals, max_error):
+    frames_count = len(positions)
+    keys = [0]
+    while keys[-1] < frames_count - 1:
+        a = keys[-1]
+        b = a + 1
+        while b + 1 < frames_count:
+            p_errors, n_errors = lerp_errors(positions, normals, a, b + 1)
+            if p_errors.max() > max_error or n_errors.max() > NORMAL_ERROR:
+                break
+            b += 1
+        keys.append(b)
+
+    refs = []
+    for k in range(len(keys) - 1):
+        a, b = keys[k], keys[k + 1]
+        refs.append((k, k, 0.0))
+        for i in range(a + 1, b):
+            if is_close(positions, normals, i, a, max_error):
+                refs.append((k, k, 0.0))
+            elif is_close(positions, normals, i, b, max_error):
+                refs.append((k + 1, k + 1, 0.0))
+            else:
+                refs.append((k, k + 1, float(i - a) / (b - a)))
+    refs.append((len(keys) - 1, len(keys) - 1, 0.0))
+    return keys, refs
+
+# Quantizes positions to uint16 on a grid of surface's bounding box. The grid
+# is a multiple of md3's 1/64 unit, as coarse as max_error allows for half of
+# the error; the other half is left for interpolation.
+# Returns (quantized, mins, steps, quantization error)
+def quantize_positions(vertices, max_error):
+    grid = max(1, int(max_error * 64))
+    positions = vertices['position'].astype(np.int32)
+    mins = positions.min(axis=(0, 1))
+    quantized = np.round((positions - mins) / float(grid)).astype('<u2')
+    error = 0.0 if grid == 1 else grid / 128.0
+    return quantized, mins / 64.0, np.full(3, grid / 64.0), error
+
+def compile_animated_surface(name, shader, indices, texcoords, vertices,
+                             max_error):
+    quantized, mins, steps, error = quantize_positions(vertices, max_error)
+    positions = (quantized * steps + mins).astype(np.float32)
+    normals = decode_vertices(vertices, texcoords)[..., 5:8]
+    keys, refs = select_keyframes(positions, normals, max_error - error)
+
+    # differences wrap modulo 2^16 and 2^8
+    key_frames = np.empty((len(keys), vertices.shape[1]), KEY_DTYPE)
+    key_frames['position'] = quantized[keys]
+    key_frames['position'][1:] -= quantized[keys[:-1]]
+    key_frames['normal'] = vertices['normal'][keys]
+    key_frames['normal'][1:] -= vertices['normal'][keys[:-1]]
+
+    out = [struct.pack('<64s64s3I', strip_name(name), strip_shader_name(shader),
+                       vertices.shape[1], len(indices) / 2, len(keys)),
+           np.concatenate((mins, steps)).astype('<f4').tostring()]
+    out.extend(struct.pack('<2Hf', a, b, t) for a, b, t in refs)
+    out.append(indices)
+    out.append('\x00' * (-len(indices) % 4))
+    out.append(texcoords.astype('<f4').tostring())
+    out.append(key_frames.tostring())
+    return out, len(keys)
+
+def compile_surface(name, shader, indices, texcoords, vertices):
+    return [struct.pack('<64s64s2I', strip_name(name), strip_shader_name(shader),
+                        vertices.shape[1], len(indices) / 2),
+            indices,
+            '\x00' * (-len(indices) % 4),
+            decode_vertices(vertices, texcoords).astype('<f4').tostring()]
+
+# Returns compiled model as string. With max_error animation is compressed
+# (version 2); the stats dict gets counts of frames and key frames then.
+def compile_md3(md3_path, max_error=None, stats=None):
+    with vfs.open_file(md3_path) as md3:
+        header = bsp.read_md3_header(md3)
+        surfaces = bsp.read_md3_surfaces(md3, header)
+        md3.seek(0)
+        data = md3.read()
+
+    frames_count, tags_count, surfaces_count = header[0:3]
+    frames = np.frombuffer(data, FRAME_DTYPE, frames_count, header[4])
+    tags = np.frombuffer(data, TAG_DTYPE, frames_count * tags_count, header[5])
+    tags = tags.reshape(frames_count, tags_count)
+
+    version = VERSION if max_error is None else ANIMATED_VERSION
+    out = [struct.pack('<4s4I', MAGIC, version, frames_count, tags_count,
+                       surfaces_count)]
+    frames_data = np.empty((frames_count, 10), '<f4')
+    frames_data[:, 0:3] = frames['mins']
+    frames_data[:, 3:6] = frames['maxs']
+    frames_data[:, 6:9] = frames['origin']
+    frames_data[:, 9] = frames['radius']
+    out.append(frames_data.tostring())
+    if tags_count:
+        out.extend(struct.pack('64s', strip_name(n)) for n in tags[0]['name'])
+    out.append(tag_matrices(tags).astype('<f4').tostring())
+
+    frames_total = keys_total = 0
+    for offset, name, surface in surfaces:
+        shader, indices, texcoords, vertices = read_surface(data, offset, surface,
+                                                            frames_count)
+        if max_error is None:
+            out.extend(compile_surface(name, shader, indices, texcoords, vertices))
+        else:
+            surface_out, keys_count = compile_animated_surface(
+                name, shader, indices, texcoords, vertices, max_error)
+            out.extend(surface_out)
+            frames_total += frames_count
+            keys_total += keys_count
+
+    if stats is not None:
+        stats['frames'] = frames_total
+        stats['keys'] = keys_total
+    return ''.join(out)
+
+# Usage: md3compiler.py model.md3 out.cmd3 [max error]
+if __name__ == '__main__':
+    import sys
+    max_error = float(sys.argv[3]) if len(sys.argv) > 3 else None
+    with open(sys.argv[2], 'wb') as out:
+        out.write(compile_md3(sys.argv[1], max_error))
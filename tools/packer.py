@@ -1,17 +1,65 @@
 import zipfile
+import zlib
+import gzip
+import struct
 import os
+import time
 import Image
 import bsp
 import math
 import itertools
+import multiprocessing
+import functools
+import texcache
+import shaderindex
+import vfs
+import json
+import optparse
 
+# Everything that changes result of transform_image; part of the cache key
+CONVERSION_PARAMS = 'po2-antialias'
+
+# Entries with these extensions are deflated, others (images, which are
+# compressed already) are stored
+COMPRESSED_EXTENSIONS = ('.bsp', '.cbsp', '.pvs', '.ccol', '.lightmap', '.md3',
+                         '.cmd3', '.shader', '.cshader', '.skin', '.cfg', '.json',
+                         '.ktx')
+DEFLATE_LEVEL = 9
+
+# Whole archive compressed for the http server; zip is served with
+# Content-Encoding when client accepts it
+SIDECARS = ('gz', 'br')
+
+# Entries are written in the order the client needs them: the map first, then
+# shaders, models and configs, then textures (in order of first use, as
+# collected). Other files go before textures.
+ENTRY_PRIORITIES = {
+    '.bsp': 0, '.cbsp': 0, '.pvs': 0, '.ccol': 0, '.lightmap': 0,
+    '.json': 1, '.shader': 1, '.cshader': 1,
+    '.png': 3, '.jpg': 3, '.ktx': 3
+}
+DEFAULT_ENTRY_PRIORITY = 2
+
+# Index of entries written next to the archive (name.index.json): offsets and
+# sizes of entries' data, so the client fetches them with range requests
+# without reading the central directory
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.index.json'
+
+TEXTURE_EXTENSIONS = ('.png', '.jpg', '.ktx')
+
+# With tiers, archives with textures downscaled by these factors are written
+# next to the full one (name.lod4.zip, name.lod2.zip). The first tier has
+# everything the client needs to start, the others have textures only.
+# name.tiers.json lists tiers from the smallest: suffix of the archive name
+# and texture scale; the full archive is the last one.
+TIER_SCALES = (4, 2)
+TIERS_VERSION = 1
+TIERS_SUFFIX = '.tiers.json'
+
+# Source tree is indexed by vfs when it's mounted, so it's a lookup
 def check_file_exists(path):
-     print 'checking file', path
-     try:
-         open(path, 'r')
-         return True
-     except IOError:
-         return False
+     return vfs.isfile(path)
 
 #is power of 2
 def is_po2(x):
@@ -20,9 +68,8 @@ def is_po2(x):
 def find_nearest_po2(x):
     return math.trunc(math.pow(2, math.modf(math.log(x, 2))[1] + 1))
          
-def transform_image(path, out):
-    print 'Converting texture', path
-    im = Image.open(path)
+# Returns image resized to power of 2 dimensions, if needed
+def resize_po2(im):
     x,y = im.size
 
     resize = False
@@ -36,67 +83,798 @@ def transform_image(path, out):
     if resize:
         print 'Found NPOT texture. Resizing to', x, y
         im = im.resize((x, y), Image.ANTIALIAS)
+    return im
 
-    if path != out or resize:
-        im.save(out)
+# Returns image with dimensions divided by scale, at least 1 pixel
+def downscale(im, scale):
+    if scale == 1:
+        return im
+    if im.mode == 'P':
+        im = im.convert('RGBA')
+    x, y = im.size
+    return im.resize((max(1, x / scale), max(1, y / scale)), Image.ANTIALIAS)
 
-def pack_files(files, baseoa, zipname):
-    baseoa = baseoa + '/' #just in case
-    with zipfile.ZipFile(zipname, 'w', zipfile.ZIP_STORED) as archive:
-        for f in files:
-            base, ext = os.path.splitext(f)
-            if ext == '.tga':
+def transform_image(path, out, scale=1):
+    print 'Converting texture', path
+    im = Image.open(vfs.open_file(path))
+    resized = downscale(resize_po2(im), scale)
+
+    # returns False if out would be the same as source
+    if resized is not im or os.path.splitext(path)[1] != os.path.splitext(out)[1]:
+        resized.save(out)
+        return True
+    return False
+
+# Textures may be converted to GPU compressed formats (KTX files with
+# mipmaps): 'dxt' (DXT1, DXT5 for textures with alpha) or 'etc1' (textures
+# with alpha are left as they are, ETC1 has no alpha). Needs NumPy.
+TEXTURE_FORMATS = ('dxt', 'etc1')
+
+def has_alpha(path):
+    im = Image.open(vfs.open_file(path))
+    return im.mode in ('RGBA', 'LA') or 'transparency' in im.info
+
+def encode_texture(path, out, texture_format, scale=1):
+    import numpy as np
+    import texcompress
+    print 'Encoding texture', path
+    rgba = np.asarray(downscale(resize_po2(Image.open(vfs.open_file(path))),
+                                scale).convert('RGBA'))
+    if texture_format == 'dxt':
+        texture_format = 'dxt5' if (rgba[..., 3] < 255).any() else 'dxt1'
+    with open(out, 'wb') as f:
+        f.write(texcompress.encode_ktx(rgba, texture_format))
+
+# Returns entry of the texture converted to KTX, if it can be converted
+def compressed_entry(entry, texture_format):
+    name, path, ext = entry
+    base, name_ext = os.path.splitext(name)
+    if name_ext not in ('.png', '.jpg'):
+        return entry
+    if texture_format == 'etc1' and has_alpha(path):
+        return entry
+    return (base + '.ktx', path, '.ktx')
+
+def collect_files(files, baseoa, texture_format=None):
+    """Resolves names of needed files to the entries that will be packed.
+
+    Returns list of (name in archive, source path, converted format) tuples.
+    Format is an extension of converted texture or None for files that are
+    copied as they are. Missing files are reported and skipped, duplicates
+    are dropped, order is kept. With texture_format (see TEXTURE_FORMATS)
+    textures are converted to KTX.
+    """
+    entries = []
+    names = set()
+    for f in files:
+        base, ext = os.path.splitext(f)
+        if ext == '.tga':
+            if check_file_exists(baseoa + f):
+                entry = (base + '.png', baseoa + f, '.png')
+            else:
+                f = base +'.jpg'
                 if check_file_exists(baseoa + f):
-                    transform_image(baseoa + f, baseoa + base + '.png')
-                    f = base + '.png'
+                    entry = (f, baseoa + f, '.jpg')
                 else:
-                    f = base +'.jpg'
-                    if check_file_exists(baseoa + f):
-                        transform_image(baseoa +f, baseoa + f)
-                    else:
-                        print 'Warning: texture not found:', base
-                        continue
-            else:
-                if not check_file_exists(baseoa + f):
-                    print 'Warning: file not found:', f
+                    print 'Warning: texture not found:', base
                     continue
+        else:
+            if not check_file_exists(baseoa + f):
+                print 'Warning: file not found:', f
+                continue
+            entry = (f, baseoa + f, None)
+
+        if texture_format is not None:
+            entry = compressed_entry(entry, texture_format)
+        if entry[0] not in names:
+            names.add(entry[0])
+            entries.append(entry)
+    return entries
+
+# Converts texture, downscaled by scale, or takes it from the cache. Returns
+# path to converted file.
+def convert_texture(path, ext, cache, texture_format=None, scale=1):
+    data = vfs.read(path)
+    params = [ext, CONVERSION_PARAMS]
+    if ext == '.ktx':
+        import texcompress
+        params.extend([texture_format, texcompress.VERSION])
+    if scale != 1:
+        params.append('scale%d' % scale)
+    key = cache.key(data, *params)
+    cached = cache.get(key, ext)
+    if cached is not None:
+        return cached
+
+    def write(out):
+        if ext == '.ktx':
+            encode_texture(path, out, texture_format, scale)
+        elif not transform_image(path, out, scale):
+            with open(out, 'wb') as f:
+                f.write(data)
+
+    return cache.put(key, ext, write)
+
+def is_texture(name):
+    return os.path.splitext(name)[1] in TEXTURE_EXTENSIONS
+
+# Runs in the worker processes, so it has to be a module level function
+def convert_entry(entry, cache, texture_format=None, scale=1):
+    name, path, ext = entry
+    if scale != 1 and ext is None and is_texture(name):
+        ext = os.path.splitext(name)[1]
+    if ext is None:
+        return (name, path)
+    return (name, convert_texture(path, ext, cache, texture_format, scale))
+
+# Returns deflate level for the entry or None if it should be stored
+def get_compression(name, level=DEFLATE_LEVEL):
+    if level and os.path.splitext(name)[1].lower() in COMPRESSED_EXTENSIONS:
+        return level
+    return None
+
+# Writes data to the archive (opened with 'w'), deflated at level or stored if
+# level is None. Entries which don't get smaller are stored.
+def write_entry(archive, name, data, level=None):
+    if level is not None:
+        co = zlib.compressobj(level, zlib.DEFLATED, -15)
+        compressed = co.compress(data) + co.flush()
+        if len(compressed) >= len(data):
+            level = None
+    if level is None:
+        archive.writestr(name, data, zipfile.ZIP_STORED)
+        return
+
+    # zipfile can't deflate at a given level, so the deflated data is written
+    # as writestr would write it
+    zinfo = zipfile.ZipInfo(name, time.localtime(time.time())[:6])
+    zinfo.external_attr = 0600 << 16
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.file_size = len(data)
+    zinfo.compress_size = len(compressed)
+    zinfo.CRC = zlib.crc32(data) & 0xffffffff
+    zinfo.header_offset = archive.fp.tell()
+    archive.fp.write(zinfo.FileHeader())
+    archive.fp.write(compressed)
+    archive.filelist.append(zinfo)
+    archive.NameToInfo[name] = zinfo
+
+# Writes zipname.gz and/or zipname.br next to the archive
+def write_sidecars(zipname, sidecars):
+    if not sidecars:
+        return
+    with open(zipname, 'rb') as f:
+        data = f.read()
+    if 'gz' in sidecars:
+        with open(zipname + '.gz', 'wb') as f:
+            # mtime 0 keeps output the same for the same archive
+            gz = gzip.GzipFile(os.path.basename(zipname), 'wb', 9, f, 0)
+            gz.write(data)
+            gz.close()
+    if 'br' in sidecars:
+        import brotli
+        with open(zipname + '.br', 'wb') as f:
+            f.write(brotli.compress(data))
+
+def get_priority(name):
+    ext = os.path.splitext(name)[1].lower()
+    return ENTRY_PRIORITIES.get(ext, DEFAULT_ENTRY_PRIORITY)
+
+def get_index_name(zipname):
+    return os.path.splitext(zipname)[0] + INDEX_SUFFIX
+
+# Writes index of the archive's entries (see INDEX_SUFFIX). Every entry has
+# fields of zip.js entries; dataOffset is where its (compressed) data starts.
+def write_index(zipname):
+    entries = []
+    with open(zipname, 'rb') as f:
+        for info in zipfile.ZipFile(f).infolist():
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack('<2H', f.read(4))
+            entries.append({
+                'filename': info.filename,
+                'offset': info.header_offset,
+                'dataOffset': info.header_offset + 30 + name_length + extra_length,
+                'compressionMethod': info.compress_type,
+                'compressedSize': info.compress_size,
+                'uncompressedSize': info.file_size,
+                'crc32': info.CRC
+            })
+    index = {'version': INDEX_VERSION, 'size': os.path.getsize(zipname),
+             'entries': entries}
+    with open(get_index_name(zipname), 'w') as f:
+        json.dump(index, f, sort_keys=True, separators=(',', ':'))
+
+def get_tiers_name(zipname):
+    return os.path.splitext(zipname)[0] + TIERS_SUFFIX
+
+def get_tier_suffix(scale):
+    return '.lod%d' % scale
+
+def get_tier_zipname(zipname, scale):
+    return os.path.splitext(zipname)[0] + get_tier_suffix(scale) + '.zip'
+
+# Files written by write_archive: the archive, its index and sidecars and,
+# with tiers, the same for every lower tier and the list of tiers
+def get_archive_outputs(zipname, sidecars=(), tiers=False):
+    zipnames = [zipname]
+    if tiers:
+        zipnames.extend(get_tier_zipname(zipname, scale) for scale in TIER_SCALES)
+    outputs = []
+    for name in zipnames:
+        outputs.append(name)
+        outputs.append(get_index_name(name))
+        outputs.extend(name + '.' + sidecar for sidecar in sorted(sidecars))
+    if tiers:
+        outputs.append(get_tiers_name(zipname))
+    return outputs
+
+# Writes lower tiers of the archive and their list (see TIER_SCALES)
+def write_tiers(entries, zipname, cache, pool=None, generated=(),
+                level=DEFLATE_LEVEL, sidecars=(), texture_format=None):
+    tiers = []
+    for scale in TIER_SCALES:
+        if tiers:
+            entries = [e for e in entries if is_texture(e[0])]
+            generated = ()
+        write_archive(entries, get_tier_zipname(zipname, scale), cache,
+                      pool, generated, level, sidecars, texture_format, scale)
+        tiers.append({'suffix': get_tier_suffix(scale), 'scale': scale})
+    tiers.append({'suffix': '', 'scale': 1})
+    with open(get_tiers_name(zipname), 'w') as f:
+        json.dump({'version': TIERS_VERSION, 'tiers': tiers}, f, sort_keys=True,
+                  separators=(',', ':'))
+
+# Writes entries (from collect_files) and generated (name, data) pairs to the
+# archive, ordered by get_priority; the order of entries with the same
+# priority is kept. Textures are converted by the pool, if given, while this
+# process writes finished files; they are downscaled by scale. Entries are
+# compressed according to COMPRESSED_EXTENSIONS; level 0 stores everything.
+# The index is written next to the archive; with tiers, lower tiers too.
+def write_archive(entries, zipname, cache, pool=None, generated=(),
+                  level=DEFLATE_LEVEL, sidecars=(), texture_format=None, scale=1,
+                  tiers=False):
+    # (name, entry to convert or None, generated data)
+    ordered = [(e[0], e, None) for e in entries]
+    ordered.extend((name, None, data) for name, data in generated)
+    ordered.sort(key=lambda item: get_priority(item[0]))
+
+    convert = functools.partial(convert_entry, cache=cache,
+                                texture_format=texture_format, scale=scale)
+    to_convert = [entry for name, entry, data in ordered if entry is not None]
+    if pool is not None:
+        converted = pool.imap(convert, to_convert)
+    else:
+        converted = itertools.imap(convert, to_convert)
+
+    with zipfile.ZipFile(zipname, 'w', zipfile.ZIP_STORED) as archive:
+        for name, entry, data in ordered:
+            if entry is not None:
+                name, path = next(converted)
+                data = vfs.read(path)
+            write_entry(archive, name, data, get_compression(name, level))
+    write_index(zipname)
+    write_sidecars(zipname, sidecars)
+    if tiers:
+        write_tiers(entries, zipname, cache, pool, generated, level, sidecars,
+                    texture_format)
+
+def pack_files(files, baseoa, zipname, jobs=None, cache_dir=None,
+               cache_size=texcache.DEFAULT_MAX_SIZE, generated=(), pool=None,
+               cache=None, level=DEFLATE_LEVEL, sidecars=(), texture_format=None,
+               tiers=False):
+    """Packs files into zip archive.
+
+    Textures are converted by a pool of jobs processes (all cores by default),
+    while this process writes finished files to the archive. Entries are
+    written in their order, no matter which conversion ends first.
+    Converted textures are kept in cache_dir (by default 'cache' directory
+    next to baseoa), source tree is never modified. generated is a list of
+    (name, data) pairs produced by the packer. Entries and generated files
+    are ordered by load priority (see write_archive); index of the archive
+    is written next to it.
+    Pool and cache may be passed by the caller; then they are left open.
+    Entries are deflated at level (see get_compression); sidecars ('gz',
+    'br') are compressed copies of the whole archive written next to it.
+    texture_format is as in collect_files. With tiers, archives with
+    downscaled textures are written too (see TIER_SCALES).
+
+    Returns list of packed entries, as returned by collect_files.
+    """
+    baseoa = baseoa + '/' #just in case
+    vfs.mount(baseoa)
+    own_cache = cache is None
+    if own_cache:
+        if cache_dir is None:
+            cache_dir = os.path.join(baseoa, '..', 'cache', 'textures')
+        cache = texcache.TextureCache(cache_dir, cache_size)
+    entries = collect_files(files, baseoa, texture_format)
+
+    own_pool = pool is None and jobs != 1
+    if own_pool:
+        pool = multiprocessing.Pool(jobs)
+    try:
+        write_archive(entries, zipname, cache, pool, generated, level, sidecars,
+                      texture_format, tiers=tiers)
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
 
-            archive.write(baseoa + f, f, zipfile.ZIP_STORED)
+    if own_cache:
+        cache.evict()
+    return entries
 
-def pack_bsp(bsp_file, baseoa, zipname):
+# Name of generated script with code of all shaders used by the archive
+SHADER_SCRIPT = 'scripts/' + shaderindex.GENERATED_SCRIPT
+
+# The same shaders parsed by shadercompiler; replaces SHADER_SCRIPT
+COMPILED_SHADER_SCRIPT = os.path.splitext(SHADER_SCRIPT)[0] + '.cshader'
+
+# Returns generated entry with shader code, with compile_shaders parsed
+# already, with GLSL programs of stages, so the client doesn't tokenize it
+def shader_script_entry(code, compile_shaders=False):
+     if compile_shaders:
+          import shadercompiler
+          stats = {}
+          data = shadercompiler.compile_shaders(code, stats)
+          print '  %d shader stages, %d distinct programs' % (stats['stages'],
+                                                              stats['programs'])
+          return (COMPILED_SHADER_SCRIPT, data)
+     return (SHADER_SCRIPT, code)
+
+# Returns files generated for the map. With compile_map it's geometry
+# precompiled by bspcompiler (.cbsp) and table of faces visible from every
+# cluster (.pvs), with bake_lightmaps the lightmap atlas baked by it
+# (.lightmap). Both require NumPy.
+def generate_for_bsp(bsp_file, baseoa, compile_map=False, bake_lightmaps=False):
+     generated = []
+     name = os.path.splitext(bsp_file)[0]
+     path = baseoa + '/' + bsp_file
+     if compile_map or bake_lightmaps:
+          import bspcompiler
+     if compile_map:
+          print 'Compiling', bsp_file
+          generated.append((name + '.cbsp', bspcompiler.compile_bsp(path)))
+          visibility = bspcompiler.compile_bsp_visibility(path)
+          if visibility is not None:
+               generated.append((name + '.pvs', visibility))
+          generated.append((name + '.ccol', bspcompiler.compile_bsp_collision(path)))
+     if bake_lightmaps:
+          print 'Baking lightmaps', bsp_file
+          generated.append((name + '.lightmap', bspcompiler.bake_bsp_lightmaps(path)))
+     return generated
+
+def pack_bsp(bsp_file, baseoa, zipname, compile_map=False, bake_lightmaps=False,
+             **options):
      print 'Packing', bsp_file
-     pack_files(bsp.get_files_for_bsp(bsp_file, baseoa), baseoa, zipname)
+     files, code = bsp.get_files_for_bsp(bsp_file, baseoa)
+     generated = [shader_script_entry(code, compile_map)]
+     generated.extend(generate_for_bsp(bsp_file, baseoa, compile_map, bake_lightmaps))
+     return pack_files(files, baseoa, zipname, generated=generated, **options)
+
+# Returns models compiled by md3compiler (.cmd3) for md3 files among files.
+# With anim_error their animation is compressed: every vertex stays within
+# anim_error units. Requires NumPy.
+def generate_for_md3s(files, baseoa, compile_models=False, anim_error=None):
+     generated = []
+     if not compile_models:
+          return generated
+     import md3compiler
+     names = set()
+     for f in files:
+          name = os.path.splitext(f)[0] + '.cmd3'
+          if f[-4:] != '.md3' or name in names or not vfs.isfile(baseoa + '/' + f):
+               continue
+          print 'Compiling', f
+          names.add(name)
+          stats = {}
+          try:
+               data = md3compiler.compile_md3(baseoa + '/' + f, anim_error, stats)
+          except Exception as e: # the client parses the md3 then
+               print 'Warning: can\'t compile', f + ':', e
+               continue
+          generated.append((name, data))
+          if anim_error is not None:
+               report_compressed_md3(f, baseoa + '/' + f, data, stats)
+     return generated
 
-def pack_player(player_dir, baseoa, zipname):
-     pack_files(bsp.get_files_for_player(player_dir, baseoa), baseoa, zipname)
-                
-def pack_md3(md3_file, baseoa, zipname):
-     pack_files(bsp.get_files_for_md3(md3_file, baseoa), baseoa, zipname)
+def report_compressed_md3(name, md3_path, data, stats):
+     md3_size = len(zlib.compress(vfs.read(md3_path), DEFLATE_LEVEL))
+     size = len(zlib.compress(data, DEFLATE_LEVEL))
+     print '  %s: %d of %d surface frames kept, deflated %.1f kB -> %.1f kB ' \
+         '(%.0f%% saved)' % (name, stats['keys'], stats['frames'], md3_size / 1024.0,
+                             size / 1024.0, 100.0 - 100.0 * size / max(md3_size, 1))
+
+# Returns names of md3 files replaced by compiled models among generated
+def get_replaced_md3s(generated):
+     return set(os.path.splitext(name)[0] + '.md3' for name, data in generated
+                if name.endswith('.cmd3'))
+
+# With anim_error, models are compiled with compressed animation (see
+# generate_for_md3s) and md3 files are left out of the archive.
+def pack_player(player_dir, baseoa, zipname, compile_models=False, anim_error=None,
+                **options):
+     files, code = bsp.get_files_for_player(player_dir, baseoa)
+     compile_models = compile_models or anim_error is not None
+     generated = [shader_script_entry(code, compile_models)]
+     generated.extend(generate_for_md3s(files, baseoa, compile_models, anim_error))
+     if anim_error is not None:
+          replaced = get_replaced_md3s(generated)
+          files = [f for f in files if f not in replaced]
+     return pack_files(files, baseoa, zipname, generated=generated, **options)
+
+def pack_md3(md3_file, baseoa, zipname, compile_models=False, **options):
+     files, code = bsp.get_files_for_md3(md3_file, baseoa)
+     generated = [shader_script_entry(code, compile_models)]
+     generated.extend(generate_for_md3s(files, baseoa, compile_models))
+     return pack_files(files, baseoa, zipname, generated=generated, **options)
 
 def find_files_in_tree(root, subdir, filter_fun):
      result = []
-     files = os.listdir(root + '/' + subdir)
+     files = vfs.listdir(root + '/' + subdir)
      for f in files:
           path = subdir + '/' + f
-          if os.path.isdir(root + '/' + path):
+          if vfs.isdir(root + '/' + path):
                result.extend(find_files_in_tree(root, path, filter_fun))
           elif filter_fun(path):
                result.append(path)
      return result
 
-def pack_weapons(weapon_dir, baseoa, zipname):
+# Returns (files, code of used shaders) for all md3 models in weapon_dir
+def get_files_for_weapons(weapon_dir, baseoa):
      md3s = find_files_in_tree(baseoa, weapon_dir, lambda f: f.find('.md3') != -1)
      files = []
      shader = ''
      
      for md3 in md3s:
-          files.extend(bsp.get_files_for_md3(md3, baseoa))
-          with open(baseoa + '/scripts/__all__.shader', 'r') as script:
-               shader = shader + script.read() + '\n'
-     
-     with open(baseoa + '/scripts/__all__.shader', 'w') as script:
-          script.write(shader)
+          md3_files, code = bsp.get_files_for_md3(md3, baseoa)
+          files.extend(md3_files)
+          shader = shader + code + '\n'
           
-     pack_files(files, baseoa, zipname)
-     
-     
+     return files, shader
+
+def pack_weapons(weapon_dir, baseoa, zipname, compile_models=False, **options):
+     files, code = get_files_for_weapons(weapon_dir, baseoa)
+     generated = [shader_script_entry(code, compile_models)]
+     generated.extend(generate_for_md3s(files, baseoa, compile_models))
+     return pack_files(files, baseoa, zipname, generated=generated, **options)
+
+
+# Batch packing
+#
+# All targets are packed in one process, sharing the shader index, file checks,
+# texture cache and conversion pool. Manifest (json) records for every target
+# its archive, options, names of its entries and mtime/size of every input, so
+# targets whose inputs and entries didn't change are skipped on the next run.
+#
+# With a share threshold, textures used by at least that many targets are
+# moved to one shared archive. Every target lists shared textures it uses in
+# SHARED_LIST, so the client loads the shared archive along with it.
+
+MANIFEST_VERSION = 4
+
+SHARED_LIST = 'shared.json'
+
+# Only textures are moved to the shared archive
+SHARED_EXTENSIONS = TEXTURE_EXTENSIONS
+
+class Target(object):
+    def __init__(self, kind, source, zipname):
+        self.kind = kind # 'map', 'player', 'weapons' or 'shared'
+        self.source = source # relative to baseoa
+        self.zipname = zipname
+
+    # Returns (files, code of used shaders)
+    def get_files(self, baseoa):
+        if self.kind == 'map':
+            return bsp.get_files_for_bsp(self.source, baseoa)
+        elif self.kind == 'player':
+            return bsp.get_files_for_player(self.source, baseoa)
+        else:
+            return get_files_for_weapons(self.source, baseoa)
+
+def find_targets(baseoa, output, maps=(), players=(), weapons=()):
+    """Expands map and player name patterns (globs, e.g. 'oa_*') and weapon
+    directories ('[archive name=]models/weapons2') to targets."""
+    baseoa = os.path.normpath(baseoa)
+    vfs.mount(baseoa)
+    targets = []
+    for pattern in maps:
+        paths = sorted(vfs.glob(os.path.join(baseoa, 'maps', pattern + '.bsp')))
+        if not paths:
+            print 'Warning: no map matches', pattern
+        for path in paths:
+            name = os.path.splitext(os.path.basename(path))[0]
+            targets.append(Target('map', 'maps/' + name + '.bsp',
+                                  os.path.join(output, 'maps', name + '.zip')))
+    for pattern in players:
+        paths = sorted(p for p in vfs.glob(os.path.join(baseoa, 'models', 'players',
+                                                        pattern))
+                       if vfs.isdir(p))
+        if not paths:
+            print 'Warning: no player matches', pattern
+        for path in paths:
+            name = os.path.basename(path)
+            targets.append(Target('player', 'models/players/' + name + '/',
+                                  os.path.join(output, 'players', name + '.zip')))
+    for weapon in weapons:
+        if '=' in weapon:
+            name, weapon_dir = weapon.split('=', 1)
+        else:
+            weapon_dir = weapon
+            name = os.path.basename(os.path.normpath(weapon_dir))
+        targets.append(Target('weapons', weapon_dir,
+                              os.path.join(output, name + '.zip')))
+    return targets
+
+def stat_inputs(baseoa, paths):
+    inputs = {}
+    for path in paths:
+        try:
+            inputs[path] = list(vfs.stat(os.path.join(baseoa, path)))
+        except OSError:
+            inputs[path] = None
+    return inputs
+
+# Inputs of a target: packed source files and all shader scripts (a change in
+# any script may change what is found for target's shaders)
+def get_target_inputs(baseoa, entries):
+    baseoa = os.path.normpath(baseoa)
+    paths = set(os.path.relpath(path, baseoa) for name, path, ext in entries)
+    paths.discard(os.path.join('scripts', shaderindex.GENERATED_SCRIPT))
+    paths.update('scripts/' + s for s in bsp.get_shader_index(baseoa).scripts)
+    return stat_inputs(baseoa, paths)
+
+# Returns key of the target's record in the manifest; there may be more
+# targets with the same source (e.g. weapons), packed to different archives
+def get_record_key(target):
+    return target.kind + ':' + target.source + ':' + target.zipname
+
+# Size and modification time of every output of the target (see
+# get_archive_outputs); None for files which are missing
+def stat_outputs(target, options):
+    outputs = {}
+    for path in get_archive_outputs(target.zipname, options['sidecars'],
+                                    options['tiers']):
+        try:
+            st = os.stat(path)
+            outputs[path] = [st.st_size, st.st_mtime]
+        except OSError:
+            outputs[path] = None
+    return outputs
+
+# Names of entries are compared too: a target has the same inputs, but fewer
+# entries, when its textures are moved to the shared archive, and the shared
+# archive gets more entries when another target starts to use its textures
+def is_up_to_date(baseoa, target, record, options, entries):
+    return (record is not None and record['output'] == target.zipname and
+            record['options'] == options and
+            record['entries'] == sorted(e[0] for e in entries) and
+            stat_outputs(target, options) == record['outputs'] and
+            stat_inputs(baseoa, record['inputs']) == record['inputs'])
+
+def load_manifest(path):
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('version') == MANIFEST_VERSION:
+            return manifest
+    except (IOError, ValueError):
+        pass
+    return {'version': MANIFEST_VERSION, 'targets': {}}
+
+def save_manifest(path, manifest):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(tmp, path)
+
+# Returns set of (name, source path) of textures used by at least threshold
+# targets; resolved is a list of entries lists
+def find_shared_textures(resolved, threshold):
+    counts = {}
+    for entries in resolved:
+        for name, path, ext in entries:
+            if os.path.splitext(name)[1] in SHARED_EXTENSIONS:
+                counts[(name, path)] = counts.get((name, path), 0) + 1
+    return set(key for key, count in counts.iteritems() if count >= threshold)
+
+def pack_batch(targets, baseoa, manifest_path, force=False, jobs=None,
+               cache_dir=None, cache_size=texcache.DEFAULT_MAX_SIZE,
+               compile_map=False, bake_lightmaps=False, share_threshold=None,
+               shared_zipname=None, compile_models=False, level=DEFLATE_LEVEL, sidecars=(),
+               texture_format=None, anim_error=None, tiers=False):
+    """Packs targets, skipping those which are up to date according to the
+    manifest. Returns list of targets which were packed.
+
+    With share_threshold, files of all targets are resolved first and textures
+    used by at least share_threshold targets are packed once, to
+    shared_zipname, instead of into every target. level, sidecars,
+    texture_format and tiers are as in pack_files. compile_models adds compiled models
+    to players and weapons. anim_error is as in pack_player.
+    """
+    vfs.mount(baseoa)
+    manifest = load_manifest(manifest_path)
+    records = manifest['targets']
+    if cache_dir is None:
+        cache_dir = os.path.join(baseoa, '..', 'cache', 'textures')
+    cache = texcache.TextureCache(cache_dir, cache_size)
+    pool = multiprocessing.Pool(jobs) if jobs != 1 else None
+    packed = []
+    # recorded options are only those that change the archive
+    base_options = {'conversion': CONVERSION_PARAMS, 'level': level,
+                    'sidecars': sorted(sidecars), 'textures': texture_format,
+                    'tiers': tiers}
+
+    def pack(target, entries, options, generated_fun):
+        key = get_record_key(target)
+        if not force and is_up_to_date(baseoa, target, records.get(key), options,
+                                       entries):
+            print 'Up to date:', target.source
+            return
+
+        print 'Packing', target.source
+        directory = os.path.dirname(target.zipname)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        generated = generated_fun()
+        written = entries
+        if options.get('anim_error') is not None:
+            replaced = get_replaced_md3s(generated)
+            written = [e for e in entries if e[0] not in replaced]
+        write_archive(written, target.zipname, cache, pool, generated,
+                      level, sidecars, texture_format, tiers=tiers)
+
+        records[key] = {
+            'output': target.zipname,
+            'outputs': stat_outputs(target, options),
+            'options': options,
+            'entries': sorted(e[0] for e in entries),
+            'inputs': get_target_inputs(baseoa, entries)
+        }
+        save_manifest(manifest_path, manifest)
+        packed.append(target)
+
+    try:
+        resolved = []
+        for target in targets:
+            files, code = target.get_files(baseoa)
+            resolved.append((collect_files(files, baseoa + '/', texture_format),
+                             code))
+
+        shared = set()
+        if share_threshold:
+            shared = find_shared_textures([e for e, c in resolved], share_threshold)
+        shared_name = None
+        if shared:
+            shared_name = os.path.splitext(os.path.basename(shared_zipname))[0]
+
+        shared_entries = []
+        shared_names = set()
+        for target, (entries, code) in zip(targets, resolved):
+            own = [e for e in entries if (e[0], e[1]) not in shared]
+            used = sorted(e[0] for e in entries if (e[0], e[1]) in shared)
+            for e in entries:
+                if (e[0], e[1]) in shared and e[0] not in shared_names:
+                    shared_names.add(e[0])
+                    shared_entries.append(e)
+
+            options = dict(base_options)
+            if target.kind == 'map':
+                options['compile_map'] = compile_map
+                options['bake_lightmaps'] = bake_lightmaps
+            elif target.kind == 'player' and anim_error is not None:
+                options['compile_models'] = True
+                options['anim_error'] = anim_error
+            else:
+                options['compile_models'] = compile_models
+            if used:
+                options['shared'] = {shared_name: used}
+
+            def generated_fun(target=target, code=code, options=options,
+                              entries=entries):
+                compile_shaders = (compile_map if target.kind == 'map' else
+                                   options['compile_models'])
+                generated = [shader_script_entry(code, compile_shaders)]
+                if 'shared' in options:
+                    generated.append((SHARED_LIST, json.dumps(options['shared'])))
+                if target.kind == 'map':
+                    generated.extend(generate_for_bsp(target.source, baseoa,
+                                                      compile_map, bake_lightmaps))
+                else:
+                    generated.extend(generate_for_md3s([e[0] for e in entries], baseoa,
+                                                       options['compile_models'],
+                                                       options.get('anim_error')))
+                return generated
+            pack(target, own, options, generated_fun)
+
+        if shared:
+            pack(Target('shared', shared_name, shared_zipname),
+                 shared_entries,
+                 dict(base_options), lambda: [])
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    cache.evict()
+    return packed
+
+def main():
+    parser = optparse.OptionParser('usage: %prog [options]\n\n'
+                                   'Packs maps, players and weapons in one run.')
+    parser.add_option('--baseoa', default='../resources/baseoa/',
+                      help='Game resources: unpacked files and/or pk3 '
+                      'archives. Default: %default')
+    parser.add_option('--output', default='../resources/converted/',
+                      help='Output directory. Default: %default')
+    parser.add_option('--map', dest='maps', action='append', default=[],
+                      help='Map name or glob pattern, e.g. "oa_*". '
+                      'May be given multiple times.')
+    parser.add_option('--player', dest='players', action='append', default=[],
+                      help='Player name or glob pattern. '
+                      'May be given multiple times.')
+    parser.add_option('--weapons', action='append', default=[],
+                      help='Weapons directory, optionally preceded by archive '
+                      'name, e.g. "weapons=models/weapons2". '
+                      'May be given multiple times.')
+    parser.add_option('--manifest',
+                      help='Manifest path. Default: manifest.json in output.')
+    parser.add_option('--force', action='store_true', default=False,
+                      help='Pack all targets, even if up to date.')
+    parser.add_option('--jobs', type='int',
+                      help='Number of conversion processes. Default: all cores.')
+    parser.add_option('--compile', action='store_true', default=False,
+                      help='Add precompiled geometry, visibility tables and '
+                      'collision trees to maps and precompiled models; '
+                      'replace shader scripts with parsed shaders.')
+    parser.add_option('--anim-error', type='float',
+                      help='Compile player models with animation compressed '
+                      'to that many units of error, instead of md3 files. '
+                      'Needs NumPy.')
+    parser.add_option('--lightmaps', dest='bake_lightmaps', action='store_true',
+                      default=False, help='Add baked lightmap atlas to maps.')
+    parser.add_option('--shared', dest='share_threshold', type='int',
+                      help='Move textures used by at least that many targets '
+                      'to the shared archive.')
+    parser.add_option('--level', type='int', default=DEFLATE_LEVEL,
+                      help='Deflate level of bsp, md3, script and config '
+                      'entries; 0 stores all entries. Default: %default')
+    parser.add_option('--sidecar', dest='sidecars', action='append', default=[],
+                      choices=SIDECARS,
+                      help='Also write the archive compressed with gz or br '
+                      '(needs brotli module). May be given multiple times.')
+    parser.add_option('--textures', dest='texture_format', choices=TEXTURE_FORMATS,
+                      help='Convert textures to GPU compressed KTX with mipmaps: '
+                      'dxt (desktop) or etc1 (mobile; textures with alpha '
+                      'stay png). Needs NumPy.')
+    parser.add_option('--tiers', action='store_true', default=False,
+                      help='Also write archives with textures downscaled 4x '
+                      '(and everything else needed to start) and 2x, loaded '
+                      'before the full one.')
+    parser.add_option('--shared-name', default='common',
+                      help='Name of the shared archive. Default: %default')
+    options, args = parser.parse_args()
+
+    targets = find_targets(options.baseoa, options.output, options.maps,
+                           options.players, options.weapons)
+    if not targets:
+        parser.error('nothing to pack')
+    if not os.path.isdir(options.output):
+        os.makedirs(options.output)
+    manifest = options.manifest or os.path.join(options.output, 'manifest.json')
+    packed = pack_batch(targets, options.baseoa, manifest, options.force,
+                        options.jobs, compile_map=options.compile,
+                        compile_models=options.compile,
+                        bake_lightmaps=options.bake_lightmaps,
+                        share_threshold=options.share_threshold,
+                        shared_zipname=os.path.join(options.output,
+                                                    options.shared_name + '.zip'),
+                        level=options.level, sidecars=options.sidecars,
+                        texture_format=options.texture_format,
+                        anim_error=options.anim_error, tiers=options.tiers)
+    print 'Packed', len(packed), 'archives'
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,531 @@
+# Compiles Quake 3 shader scripts into what files.ShaderScriptLoader parses
+# and generates from them in the browser (.cshader), so the client neither
+# parses scripts nor builds GLSL sources of stages.
+#
+# Scripts are split into tokens as the game does it: by whitespace, skipping
+# // and /* */ comments, with "quoted strings" as single tokens. Braces are
+# tokens even when they aren't separated by whitespace. Arguments of every
+# keyword end with its line, so a missing argument doesn't eat the next line
+# and unknown keywords (e.g. q3map_*) are skipped with all their arguments.
+# Keywords and their options are case insensitive.
+#
+# GLSL programs of stages are generated here as well, the same as
+# files.ShaderScriptLoader.buildShaderSource does it, only without the comment
+# with the shader name, so stages of different shaders often get identical
+# programs. Every distinct program is stored once.
+#
+# Format: JSON {"version": 2, "programs": [{"vertex": src, "fragment": src}...],
+# "shaders": [shader...]}, every shader and its stages with only the fields
+# which differ from DEFAULT_SHADER and DEFAULT_STAGE (the defaults of
+# files.ShaderScriptLoader). shaderSrc of every stage is an index of its
+# program.
+#
+# Usage: shadercompiler.py script.shader... > out.cshader
+
+import re
+import json
+import decimal
+from collections import OrderedDict
+
+VERSION = 2
+
+DEFAULT_SHADER = {
+    'isDefault': False,
+    'cull': 'back',
+    'sky': False,
+    'blend': False,
+    'opaque': False,
+    'sort': 0,
+    'vertexDeforms': [],
+    'stages': []
+}
+
+DEFAULT_STAGE = {
+    'map': None,
+    'clamp': False,
+    'tcGen': 'base',
+    'rgbGen': 'identity',
+    'rgbWaveform': None,
+    'alphaGen': '1.0',
+    'alphaFunc': None,
+    'alphaWaveform': None,
+    'blendSrc': 'GL_ONE',
+    'blendDest': 'GL_ZERO',
+    'hasBlendFunc': False,
+    'tcMods': [],
+    'animMaps': [],
+    'animFreq': 0,
+    'depthFunc': 'lequal',
+    'depthWrite': True,
+    'isLightmap': False
+}
+
+SORTS = {
+    'portal': 1,
+    'sky': 2,
+    'opaque': 3,
+    'banner': 6,
+    'underwater': 8,
+    'additive': 9,
+    'nearest': 16
+}
+
+# blendFunc shortcuts
+BLEND_FUNCS = {
+    'add': ('GL_ONE', 'GL_ONE'),
+    'blend': ('GL_SRC_ALPHA', 'GL_ONE_MINUS_SRC_ALPHA'),
+    'filter': ('GL_DST_COLOR', 'GL_ZERO')
+}
+
+# comment, quoted string, brace, word or new line
+_TOKEN_PATTERN = re.compile(r'//[^\n]*|/\*.*?(?:\*/|\Z)|"([^"\n]*)"?|([{}])|'
+                            r'((?:[^\s{}"/]|/(?![/*]))+)|\n', re.S)
+
+_IMAGE_PATTERN = re.compile(r'(\.jpg|\.tga)')
+
+_TEXTURE_PATTERN = re.compile(r'([a-zA-Z0-9/_\.-]+\.(?:tga|jpg))')
+
+_NUMBER_PATTERN = re.compile(r'[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?')
+
+# Returns list of (token, line, start, end) for every token in data
+def tokenize(data):
+    tokens = []
+    line = 1
+    for match in _TOKEN_PATTERN.finditer(data):
+        text = match.group(0)
+        if text == '\n':
+            line += 1
+        elif text[:2] in ('//', '/*'):
+            line += text.count('\n')
+        else:
+            token = text if match.group(1) is None else match.group(1)
+            tokens.append((token, line, match.start(), match.end()))
+    return tokens
+
+# Number at the start of token, as parseFloat reads it; 0 if there's none
+def atof(token):
+    match = _NUMBER_PATTERN.match(token)
+    return float(match.group(0)) if match else 0.0
+
+def strip_image_extension(name):
+    return _IMAGE_PATTERN.sub('', name, 1)
+
+class _Reader(object):
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.index = 0
+
+    def eof(self):
+        return self.index >= len(self.tokens)
+
+    def peek(self):
+        return self.tokens[self.index][0]
+
+    def next(self):
+        self.index += 1
+        return self.tokens[self.index - 1][0]
+
+    # Returns tokens following the last one on its line, up to a brace
+    def rest_of_line(self):
+        line = self.tokens[self.index - 1][1]
+        args = []
+        while (not self.eof() and self.tokens[self.index][1] == line and
+               self.peek() not in ('{', '}')):
+            args.append(self.next())
+        return args
+
+    # Offset after the line of the last token
+    def line_end(self, data):
+        end = data.find('\n', self.tokens[self.index - 1][3])
+        return len(data) if end == -1 else end + 1
+
+def parse_waveform(args):
+    args = args + [''] * (5 - len(args))
+    return {
+        'funcName': args[0].lower(),
+        'base': atof(args[1]),
+        'amp': atof(args[2]),
+        'phase': atof(args[3]),
+        'freq': atof(args[4])
+    }
+
+def parse_tcmod(args):
+    args = args + [''] * (5 - len(args))
+    tcmod = {'type': args[0].lower()}
+    if tcmod['type'] == 'rotate':
+        tcmod['angle'] = atof(args[1]) * (3.1415 / 180)
+    elif tcmod['type'] == 'scale':
+        tcmod['scaleX'] = atof(args[1])
+        tcmod['scaleY'] = atof(args[2])
+    elif tcmod['type'] == 'scroll':
+        tcmod['sSpeed'] = atof(args[1])
+        tcmod['tSpeed'] = atof(args[2])
+    elif tcmod['type'] == 'stretch':
+        tcmod['waveform'] = parse_waveform(args[1:])
+    elif tcmod['type'] == 'turb':
+        tcmod['turbulance'] = {
+            'base': atof(args[1]),
+            'amp': atof(args[2]),
+            'phase': atof(args[3]),
+            'freq': atof(args[4])
+        }
+    else:
+        return None
+    return tcmod
+
+# Parses stage up to its closing brace; same as parseStage. Textures referred
+# by the stage are added to textures.
+def parse_stage(reader, textures):
+    stage = dict(DEFAULT_STAGE, tcMods=[], animMaps=[])
+    depth_write_override = False
+    while not reader.eof():
+        token = reader.next()
+        if token == '}':
+            break
+        args = reader.rest_of_line()
+        textures.extend(match.group(1) for match in
+                        (_TEXTURE_PATTERN.search(arg.lower()) for arg in args) if match)
+        keyword = token.lower()
+        if keyword == 'clampmap':
+            stage['clamp'] = True
+        elif keyword == 'depthwrite':
+            stage['depthWrite'] = True
+            depth_write_override = True
+        if not args:
+            continue
+
+        if keyword in ('map', 'clampmap'):
+            stage['map'] = strip_image_extension(args[0])
+        elif keyword == 'animmap':
+            stage['map'] = 'anim'
+            stage['animFreq'] = atof(args[0])
+            for arg in args[1:]:
+                if not _IMAGE_PATTERN.search(arg):
+                    break
+                stage['animMaps'].append(strip_image_extension(arg))
+        elif keyword == 'rgbgen':
+            stage['rgbGen'] = args[0].lower()
+            if stage['rgbGen'] == 'wave':
+                stage['rgbWaveform'] = parse_waveform(args[1:])
+        elif keyword == 'alphagen':
+            stage['alphaGen'] = args[0].lower()
+            if stage['alphaGen'] == 'wave':
+                stage['alphaWaveform'] = parse_waveform(args[1:])
+        elif keyword == 'alphafunc':
+            stage['alphaFunc'] = args[0].upper()
+        elif keyword == 'blendfunc':
+            stage['hasBlendFunc'] = True
+            if not depth_write_override:
+                stage['depthWrite'] = False
+            if args[0].lower() in BLEND_FUNCS:
+                stage['blendSrc'], stage['blendDest'] = BLEND_FUNCS[args[0].lower()]
+            else:
+                stage['blendSrc'] = args[0].upper()
+                if len(args) > 1:
+                    stage['blendDest'] = args[1].upper()
+        elif keyword == 'depthfunc':
+            stage['depthFunc'] = args[0].lower()
+        elif keyword == 'tcmod':
+            tcmod = parse_tcmod(args)
+            if tcmod:
+                stage['tcMods'].append(tcmod)
+        elif keyword == 'tcgen':
+            stage['tcGen'] = args[0].lower()
+
+    if stage['blendSrc'] == 'GL_ONE' and stage['blendDest'] == 'GL_ZERO':
+        stage['hasBlendFunc'] = False
+        stage['depthWrite'] = True
+    stage['isLightmap'] = stage['map'] == '$lightmap'
+    return stage
+
+# Parses shader body after its opening brace; same as parseShader
+def parse_shader(name, reader, textures):
+    shader = dict(DEFAULT_SHADER, name=name, vertexDeforms=[], stages=[])
+    while not reader.eof():
+        token = reader.next()
+        if token == '}':
+            break
+        if token == '{':
+            stage = parse_stage(reader, textures)
+            # the same adjustments as parseShader does
+            if stage['isLightmap'] and stage['hasBlendFunc']:
+                stage['blendSrc'] = 'GL_DST_COLOR'
+                stage['blendDest'] = 'GL_ZERO'
+            if stage['alphaGen'] == 'lightingspecular':
+                stage['blendSrc'] = 'GL_ONE'
+                stage['blendDest'] = 'GL_ZERO'
+                stage['hasBlendFunc'] = False
+                stage['depthWrite'] = True
+                shader['stages'] = []
+            if stage['hasBlendFunc']:
+                shader['blend'] = True
+            else:
+                shader['opaque'] = True
+            shader['stages'].append(stage)
+            continue
+
+        args = reader.rest_of_line()
+        keyword = token.lower()
+        if not args:
+            continue
+        if keyword == 'cull':
+            shader['cull'] = args[0].lower()
+        elif keyword == 'deformvertexes' and args[0].lower() == 'wave':
+            # as the game does, 0 is taken as 0.01
+            spread = atof(args[1]) if len(args) > 1 else 0.0
+            shader['vertexDeforms'].append({
+                'type': 'wave',
+                'spread': 1.0 / spread if spread else 100.0,
+                'waveform': parse_waveform(args[2:])
+            })
+        elif keyword == 'sort':
+            sort = args[0].lower()
+            match = re.match(r'[+-]?\d+', sort)
+            shader['sort'] = SORTS.get(sort, int(match.group(0)) if match else 0)
+        elif keyword == 'surfaceparm' and args[0].lower() == 'sky':
+            shader['sky'] = True
+
+    if not shader['sort']:
+        shader['sort'] = 3 if shader['opaque'] else 9
+    return shader
+
+# Returns list of (name, start, end, textures, shader) for every shader in
+# data. Code of the shader is data[start:end]; it includes comments preceding
+# it and ends with the line of its closing brace.
+def parse_script(data):
+    reader = _Reader(tokenize(data))
+    shaders = []
+    start = 0
+    while not reader.eof():
+        name = reader.next()
+        if name in ('{', '}') or reader.eof() or reader.peek() != '{':
+            continue # not a shader definition
+        reader.next()
+        textures = []
+        shader = parse_shader(name, reader, textures)
+        end = reader.line_end(data)
+        shaders.append((name, start, end, textures, shader))
+        start = end
+    return shaders
+
+# GLSL generation
+
+# Number as toFixed(4) formats it: halves are rounded away from zero
+def to_fixed(value):
+    if value == 0:
+        return '0.0000'
+    return str(decimal.Decimal(value).quantize(decimal.Decimal('0.0001'),
+                                               decimal.ROUND_HALF_UP))
+
+# Same as files.ShaderBuilder
+class ShaderBuilder(object):
+    def __init__(self):
+        self.attribs = OrderedDict()
+        self.varyings = OrderedDict()
+        self.uniforms = OrderedDict()
+        self.functions = OrderedDict()
+        self.statements = []
+
+    def add_attribs(self, *attribs):
+        for name, type_name in attribs:
+            self.attribs[name] = 'attribute %s %s;' % (type_name, name)
+
+    def add_varyings(self, *varyings):
+        for name, type_name in varyings:
+            self.varyings[name] = 'varying %s %s;' % (type_name, name)
+
+    def add_uniforms(self, *uniforms):
+        for name, type_name in uniforms:
+            self.uniforms[name] = 'uniform %s %s;' % (type_name, name)
+
+    def add_lines(self, *statements):
+        self.statements.extend(statements)
+
+    # phase, if given, is a GLSL expression used instead of waveform's phase
+    def add_waveform(self, name, waveform, phase=None):
+        if phase is None:
+            phase = to_fixed(waveform['phase'])
+        time = 'time * ' + to_fixed(waveform['freq'])
+        base = to_fixed(waveform['base'])
+        amp = to_fixed(waveform['amp'])
+        func_name = waveform['funcName']
+        if func_name == 'sin':
+            self.statements.append('float %s = %s + sin((%s + %s) * 6.283) * %s;' %
+                                   (name, base, phase, time, amp))
+            return
+        elif func_name == 'square':
+            self.functions['square'] = '\n'.join([
+                'float square(float val) {',
+                '   return (mod(floor(val*2.0)+1.0, 2.0) * 2.0) - 1.0;',
+                '}'])
+        elif func_name == 'triangle':
+            self.functions['triangle'] = '\n'.join([
+                'float triangle(float val) {',
+                '   return abs(2.0 * fract(val) - 1.0);',
+                '}'])
+        elif func_name == 'sawtooth':
+            func_name = 'fract'
+        elif func_name == 'inversesawtooth':
+            func_name = '1.0 - fract'
+        else:
+            self.statements.append('float %s = 0.0;' % name)
+            return
+        self.statements.append('float %s = %s + %s(%s + %s) * %s;' %
+                               (name, base, func_name, phase, time, amp))
+
+    def get_source(self):
+        src = ['#ifdef GL_ES \nprecision highp float; \n#endif \n']
+        for lines in (self.attribs, self.varyings, self.uniforms, self.functions):
+            src.extend(line + '\n' for line in lines.itervalues())
+        src.append('void main(void) {\n\t')
+        src.append('\n\t'.join(self.statements))
+        src.append('\n}\n')
+        return ''.join(src)
+
+# Same as files.ShaderScriptLoader.buildVertexShader
+def build_vertex_shader(shader, stage):
+    builder = ShaderBuilder()
+    builder.add_attribs(('position', 'vec3'), ('normal', 'vec3'), ('color', 'vec4'))
+    builder.add_varyings(('vTexCoord', 'vec2'), ('vColor', 'vec4'))
+    builder.add_uniforms(('mvpMat', 'mat4'), ('time', 'float'))
+    if stage['isLightmap']:
+        builder.add_attribs(('lightCoord', 'vec2'))
+    else:
+        builder.add_attribs(('texCoord', 'vec2'))
+
+    builder.add_lines('vec3 defPosition = position;')
+    for i, deform in enumerate(shader['vertexDeforms']):
+        if deform['type'] != 'wave':
+            continue
+        builder.add_lines('float deformOff%d = (position.x + position.y + position.z) '
+                          '* %s;' % (i, to_fixed(deform['spread'])))
+        builder.add_waveform('deform%d' % i, deform['waveform'],
+                             to_fixed(deform['waveform']['phase']) + ' + deformOff%d' % i)
+        builder.add_lines('defPosition += normal * deform%d;' % i)
+
+    builder.add_lines('vColor = color;')
+    if stage['tcGen'] == 'environment':
+        builder.add_lines('vTexCoord = vec2(0.5, 0.5);')
+    elif stage['isLightmap']:
+        builder.add_lines('vTexCoord = lightCoord;')
+    else:
+        builder.add_lines('vTexCoord = texCoord;')
+
+    for i, tcmod in enumerate(stage['tcMods']):
+        if tcmod['type'] == 'rotate':
+            builder.add_lines(
+                'float r = %s * time;' % to_fixed(tcmod['angle']),
+                'vTexCoord -= vec2(0.5, 0.5);',
+                'vTexCoord = vec2(vTexCoord.s * cos(r) - vTexCoord.t * sin(r), '
+                'vTexCoord.t * cos(r) + vTexCoord.s * sin(r));',
+                'vTexCoord += vec2(0.5, 0.5);')
+        elif tcmod['type'] == 'scroll':
+            builder.add_lines('vTexCoord += vec2(%s * time, %s * time);' %
+                              (to_fixed(tcmod['sSpeed']), to_fixed(tcmod['tSpeed'])))
+        elif tcmod['type'] == 'scale':
+            builder.add_lines('vTexCoord *= vec2(%s, %s);' %
+                              (to_fixed(tcmod['scaleX']), to_fixed(tcmod['scaleY'])))
+        elif tcmod['type'] == 'stretch':
+            builder.add_waveform('stretchWave', tcmod['waveform'])
+            builder.add_lines(
+                'stretchWave = 1.0 / stretchWave;',
+                'vTexCoord *= stretchWave;',
+                'vTexCoord += vec2(0.5 - (0.5 * stretchWave), 0.5 - (0.5 * stretchWave));')
+        elif tcmod['type'] == 'turb':
+            turb = tcmod['turbulance']
+            name = 'turbTime%d' % i
+            amp = to_fixed(turb['amp'])
+            builder.add_lines(
+                'float %s = %s + time * %s;' % (name, to_fixed(turb['phase']),
+                                                to_fixed(turb['freq'])),
+                'vTexCoord.s += sin( ( ( position.x + position.z )* 1.0/128.0 * 0.125 '
+                '+ %s ) * 6.283) * %s;' % (name, amp),
+                'vTexCoord.t += sin( ( position.y * 1.0/128.0 * 0.125 + %s ) * 6.283) '
+                '* %s;' % (name, amp))
+
+    if stage['alphaGen'] == 'lightingspecular':
+        builder.add_attribs(('lightCoord', 'vec2'))
+        builder.add_varyings(('vLightCoord', 'vec2'))
+        builder.add_lines('vLightCoord = lightCoord;')
+
+    builder.add_lines('gl_Position = mvpMat * vec4(defPosition, 1.0);')
+    return builder.get_source()
+
+# Same as files.ShaderScriptLoader.buildFragmentShader
+def build_fragment_shader(shader, stage):
+    builder = ShaderBuilder()
+    builder.add_varyings(('vTexCoord', 'vec2'), ('vColor', 'vec4'))
+    builder.add_uniforms(('texture', 'sampler2D'), ('time', 'float'))
+    builder.add_lines('vec4 texColor = texture2D(texture, vTexCoord.st);')
+
+    if stage['rgbGen'] == 'vertex':
+        builder.add_lines('vec3 rgb = texColor.rgb * vColor.rgb;')
+    elif stage['rgbGen'] == 'wave':
+        builder.add_waveform('rgbWave', stage['rgbWaveform'])
+        builder.add_lines('vec3 rgb = texColor.rgb * rgbWave;')
+    else:
+        builder.add_lines('vec3 rgb = texColor.rgb;')
+
+    if stage['alphaGen'] == 'wave':
+        builder.add_waveform('alpha', stage['alphaWaveform'])
+    elif stage['alphaGen'] == 'lightingspecular':
+        builder.add_uniforms(('lightmap', 'sampler2D'))
+        builder.add_varyings(('vLightCoord', 'vec2'), ('vLight', 'float'))
+        builder.add_lines(
+            'vec4 light = texture2D(lightmap, vLightCoord.st);',
+            'rgb *= light.rgb;',
+            'rgb += light.rgb * texColor.a * 0.6;',
+            'float alpha = 1.0;')
+    else:
+        builder.add_lines('float alpha = texColor.a;')
+
+    if stage['alphaFunc'] == 'GT0':
+        builder.add_lines('if(alpha == 0.0) { discard; }')
+    elif stage['alphaFunc'] == 'LT128':
+        builder.add_lines('if(alpha >= 0.5) { discard; }')
+    elif stage['alphaFunc'] == 'GE128':
+        builder.add_lines('if(alpha < 0.5) { discard; }')
+
+    builder.add_lines('gl_FragColor = vec4(rgb, alpha);')
+    return builder.get_source()
+
+def compact(values, defaults):
+    return dict((key, value) for key, value in values.iteritems()
+                if key not in defaults or defaults[key] != value)
+
+# Returns compiled shaders of script code, as string. The stats dict gets
+# counts of stages and their distinct programs.
+def compile_shaders(code, stats=None):
+    shaders = []
+    programs = []
+    program_indices = {}
+    stages_count = 0
+    for name, start, end, textures, shader in parse_script(code):
+        stages = []
+        for stage in shader['stages']:
+            program = (build_vertex_shader(shader, stage),
+                       build_fragment_shader(shader, stage))
+            if program not in program_indices:
+                program_indices[program] = len(programs)
+                programs.append({'vertex': program[0], 'fragment': program[1]})
+            stages.append(dict(compact(stage, DEFAULT_STAGE),
+                               shaderSrc=program_indices[program]))
+        stages_count += len(stages)
+        shader = compact(shader, DEFAULT_SHADER)
+        if stages:
+            shader['stages'] = stages
+        shaders.append(shader)
+
+    if stats is not None:
+        stats['stages'] = stages_count
+        stats['programs'] = len(programs)
+    return json.dumps({'version': VERSION, 'programs': programs, 'shaders': shaders},
+                      sort_keys=True, separators=(',', ':'))
+
+if __name__ == '__main__':
+    import sys
+    code = []
+    for path in sys.argv[1:]:
+        with open(path, 'rb') as script:
+            code.append(script.read())
+    sys.stdout.write(compile_shaders('\n'.join(code)))
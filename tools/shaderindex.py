@@ -0,0 +1,99 @@
+# Persistent index of shader scripts.
+# Maps shader name to the script defining it, byte range of its code and
+# textures it references. Index is stored as json and every script is
+# rescanned only when its mtime or size changes.
+
+import os
+import json
+
+import shadercompiler
+import vfs
+
+INDEX_VERSION = 2
+
+# Script with code of all shaders used by an archive, generated by the packer.
+# Older packers wrote it into scripts directory, so it's never indexed.
+GENERATED_SCRIPT = '__all__.shader'
+
+# Returns list of (shader name, start, end, textures) for every shader in file.
+# Code of the shader is data[start:end]; it includes comments preceding it.
+def scan_shader_file(script_path):
+    data = vfs.read(script_path)
+    return [(name.lower(), start, end, textures) for name, start, end, textures, shader
+            in shadercompiler.parse_script(data)]
+
+# Reads code of the shader converting line endings to unix format
+def read_shader_code(script_path, start, end):
+    with vfs.open_file(script_path) as script:
+        script.seek(start)
+        return '\n'.join(script.read(end - start).splitlines())
+
+class ShaderIndex(object):
+    def __init__(self, scripts_dir, index_path=None):
+        self.scripts_dir = scripts_dir
+        self.index_path = index_path
+        self.scripts = {}
+        self.shaders = {}
+        self.load()
+        self.update()
+
+    def load(self):
+        if self.index_path is None or not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except ValueError:
+            print 'Warning: broken shader index', self.index_path
+            return
+        if index.get('version') == INDEX_VERSION:
+            self.scripts = index['scripts']
+
+    def save(self):
+        if self.index_path is None:
+            return
+        directory = os.path.dirname(self.index_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'scripts': self.scripts}, f)
+        os.rename(tmp, self.index_path)
+
+    # Rescans scripts which changed since the index was built
+    def update(self):
+        names = sorted(s for s in vfs.listdir(self.scripts_dir)
+                       if s[-7:] == '.shader' and s != GENERATED_SCRIPT)
+        removed = set(self.scripts).difference(names)
+        for s in removed:
+            del self.scripts[s]
+        changed = bool(removed)
+
+        for s in names:
+            mtime, size = vfs.stat(os.path.join(self.scripts_dir, s))
+            entry = self.scripts.get(s)
+            if entry is None or entry['mtime'] != mtime or entry['size'] != size:
+                self.scripts[s] = {
+                    'mtime': mtime,
+                    'size': size,
+                    'shaders': scan_shader_file(os.path.join(self.scripts_dir, s))
+                }
+                changed = True
+
+        self.shaders = {}
+        for s in names:
+            for name, start, end, textures in self.scripts[s]['shaders']:
+                # json gives unicode strings
+                self.shaders.setdefault(str(name), []).append(
+                    (str(s), start, end, [str(t) for t in textures]))
+
+        if changed:
+            self.save()
+
+    # Returns list of (script, start, end, textures) for every definition of
+    # the shader, in scripts order
+    def find(self, name):
+        return self.shaders.get(name, [])
+
+    def read_code(self, script, start, end):
+        return read_shader_code(os.path.join(self.scripts_dir, script), start, end)
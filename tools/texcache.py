@@ -0,0 +1,74 @@
+# On-disk cache of converted textures.
+# Entries are keyed by hash of the source file contents and conversion
+# parameters, so the same texture used by many maps and models is converted
+# only once. Cache size is bounded; least recently used entries are evicted.
+
+import os
+import hashlib
+import tempfile
+
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+class TextureCache(object):
+    def __init__(self, root, max_size=DEFAULT_MAX_SIZE):
+        self.root = root
+        self.max_size = max_size
+
+    def key(self, data, *params):
+        h = hashlib.sha1(data)
+        for p in params:
+            h.update('\x00' + str(p))
+        return h.hexdigest()
+
+    def path(self, key, ext):
+        return os.path.join(self.root, key[:2], key + ext)
+
+    # Returns path of cached file or None. Hit refreshes entry's LRU position.
+    def get(self, key, ext):
+        path = self.path(key, ext)
+        try:
+            os.utime(path, None)
+            return path
+        except OSError:
+            return None
+
+    # Stores data produced by write_fun(tmp_path) under key and returns its path.
+    # File is renamed into place, so concurrent workers never see partial entries.
+    def put(self, key, ext, write_fun):
+        path = self.path(key, ext)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory): # created by other worker
+                    raise
+        fd, tmp = tempfile.mkstemp(ext, '.tmp', directory)
+        os.close(fd)
+        try:
+            write_fun(tmp)
+            os.rename(tmp, path)
+        except:
+            os.remove(tmp)
+            raise
+        return path
+
+    # Removes least recently used entries until cache fits in max_size
+    def evict(self):
+        entries = []
+        total = 0
+        if not os.path.isdir(self.root):
+            return
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for f in filenames:
+                path = os.path.join(dirpath, f)
+                st = os.stat(path)
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            os.remove(path)
+            total -= size
@@ -0,0 +1,264 @@
+# Encodes textures to GPU compressed formats with full mip chains.
+# DXT1 (opaque) and DXT5 (with alpha) for WEBGL_compressed_texture_s3tc,
+# ETC1 (opaque only) for WEBGL_compressed_texture_etc1. Encoders are simple
+# range fits done for all 4x4 blocks of a level at once; quality is close to
+# fast modes of the usual encoders.
+#
+# Output is KTX 1 file (http://www.khronos.org/opengles/sdk/tools/KTX/):
+# 64 byte header, no key/value data, then for every mip level its size
+# (uint32) and blocks, padded to 4 bytes. Level 0 is the largest.
+
+import struct
+import numpy as np
+
+# Part of the texture cache key; bump when encoded output changes
+VERSION = 1
+
+KTX_IDENTIFIER = '\xabKTX 11\xbb\r\n\x1a\n'
+KTX_ENDIANNESS = 0x04030201
+
+GL_RGB = 0x1907
+GL_RGBA = 0x1908
+GL_COMPRESSED_RGB_S3TC_DXT1_EXT = 0x83F0
+GL_COMPRESSED_RGBA_S3TC_DXT5_EXT = 0x83F3
+GL_ETC1_RGB8_OES = 0x8D64
+
+# format name: (internal format, base internal format, bytes per block)
+FORMATS = {
+    'dxt1': (GL_COMPRESSED_RGB_S3TC_DXT1_EXT, GL_RGB, 8),
+    'dxt5': (GL_COMPRESSED_RGBA_S3TC_DXT5_EXT, GL_RGBA, 16),
+    'etc1': (GL_ETC1_RGB8_OES, GL_RGB, 8)
+}
+
+# Returns list of (height, width, 4) uint8 arrays: image and its mipmaps down
+# to 1x1, each made by averaging 2x2 texels of the previous one
+def build_mipmaps(rgba):
+    levels = [rgba]
+    level = rgba.astype(np.float32)
+    while level.shape[0] > 1 or level.shape[1] > 1:
+        if level.shape[0] > 1:
+            level = (level[0::2] + level[1::2]) * 0.5
+        if level.shape[1] > 1:
+            level = (level[:, 0::2] + level[:, 1::2]) * 0.5
+        levels.append(np.round(level).astype(np.uint8))
+    return levels
+
+# Returns (blocks, 16, channels) array; images smaller than a block are
+# padded by repeating edge texels
+def split_blocks(image):
+    height, width, channels = image.shape
+    bh = (height + 3) // 4
+    bw = (width + 3) // 4
+    if bh * 4 != height or bw * 4 != width:
+        image = np.pad(image, ((0, bh * 4 - height), (0, bw * 4 - width), (0, 0)),
+                       'edge')
+    blocks = image.reshape(bh, 4, bw, 4, channels).transpose(0, 2, 1, 3, 4)
+    return blocks.reshape(bh * bw, 16, channels)
+
+#
+# DXT
+#
+
+def _to_565(colors):
+    c = np.clip(np.round(colors), 0, 255).astype(np.uint32)
+    return (((c[..., 0] * 31 + 127) // 255) << 11 |
+            ((c[..., 1] * 63 + 127) // 255) << 5 |
+            ((c[..., 2] * 31 + 127) // 255))
+
+def _from_565(packed):
+    r = (packed >> 11) & 31
+    g = (packed >> 5) & 63
+    b = packed & 31
+    return np.stack(((r << 3) | (r >> 2), (g << 2) | (g >> 4),
+                     (b << 3) | (b >> 2)), axis=-1).astype(np.float32)
+
+# Returns (blocks, 2) endpoints: extremes of block colors projected on their
+# principal axis
+def _fit_endpoints(colors):
+    mean = colors.mean(axis=1)
+    centered = colors - mean[:, np.newaxis]
+    cov = np.einsum('bpi,bpj->bij', centered, centered)
+    axis = np.ones((len(colors), 3), np.float32)
+    for i in range(8): # power iteration
+        axis = np.einsum('bij,bj->bi', cov, axis)
+        norm = np.sqrt((axis * axis).sum(axis=1))[:, np.newaxis]
+        axis = np.where(norm > 1e-6, axis / np.maximum(norm, 1e-6), 0.0)
+    t = np.einsum('bpi,bi->bp', centered, axis)
+    c0 = mean + axis * t.max(axis=1)[:, np.newaxis]
+    c1 = mean + axis * t.min(axis=1)[:, np.newaxis]
+    return _to_565(c0), _to_565(c1)
+
+# Returns (blocks, 8) uint8 array of DXT1 color blocks (4 color mode)
+def encode_color_blocks(colors):
+    colors = colors.astype(np.float32)
+    c0, c1 = _fit_endpoints(colors)
+    swap = c0 < c1
+    c0, c1 = np.where(swap, c1, c0), np.where(swap, c0, c1)
+
+    e0 = _from_565(c0)
+    e1 = _from_565(c1)
+    palette = np.stack((e0, e1, (2 * e0 + e1) / 3, (e0 + 2 * e1) / 3), axis=1)
+    dist = ((colors[:, :, np.newaxis] - palette[:, np.newaxis]) ** 2).sum(axis=-1)
+    indices = dist.argmin(axis=-1).astype(np.uint32)
+    indices[c0 == c1] = 0
+
+    bits = (indices << (2 * np.arange(16, dtype=np.uint32))).sum(axis=1)
+    out = np.empty(len(colors), [('c0', '<u2'), ('c1', '<u2'), ('indices', '<u4')])
+    out['c0'] = c0
+    out['c1'] = c1
+    out['indices'] = bits
+    return out.view(np.uint8).reshape(-1, 8)
+
+# Returns (blocks, 8) uint8 array of DXT5 alpha blocks (8 alpha mode)
+def encode_alpha_blocks(alpha):
+    alpha = alpha.astype(np.float32)
+    a0 = alpha.max(axis=1)
+    a1 = alpha.min(axis=1)
+    # index 0 is a0, 1 is a1, 2-7 are interpolated from a0 to a1
+    weights = np.array([0, 7, 1, 2, 3, 4, 5, 6], np.float32) / 7
+    palette = a0[:, np.newaxis] * (1 - weights) + a1[:, np.newaxis] * weights
+    palette = np.floor(palette + 0.5) # as decoders round
+    dist = np.abs(alpha[:, :, np.newaxis] - palette[:, np.newaxis])
+    indices = dist.argmin(axis=-1).astype(np.uint64)
+    indices[a0 == a1] = 0
+
+    bits = (indices << (3 * np.arange(16, dtype=np.uint64))).sum(axis=1)
+    out = np.empty((len(alpha), 8), np.uint8)
+    out[:, 0] = a0
+    out[:, 1] = a1
+    for i in range(6):
+        out[:, 2 + i] = (bits >> np.uint64(8 * i)) & np.uint64(0xff)
+    return out
+
+def encode_dxt1(image):
+    return encode_color_blocks(split_blocks(image[..., :3])).tostring()
+
+def encode_dxt5(image):
+    blocks = split_blocks(image)
+    return np.hstack((encode_alpha_blocks(blocks[..., 3]),
+                      encode_color_blocks(blocks[..., :3]))).tostring()
+
+#
+# ETC1
+#
+
+ETC1_MODIFIERS = np.array([[2, 8], [5, 17], [9, 29], [13, 42],
+                           [18, 60], [24, 80], [33, 106], [47, 183]], np.float32)
+# modifier for pixel index 0-3: a, b, -a, -b
+ETC1_TABLES = np.stack((ETC1_MODIFIERS[:, 0], ETC1_MODIFIERS[:, 1],
+                        -ETC1_MODIFIERS[:, 0], -ETC1_MODIFIERS[:, 1]), axis=1)
+
+# Texel numbers (row * 4 + column) of both subblocks; flip 0 splits block to
+# left and right half, flip 1 to top and bottom
+ETC1_SUBBLOCKS = [
+    [[r * 4 + c for r in range(4) for c in range(2)],
+     [r * 4 + c for r in range(4) for c in range(2, 4)]],
+    [[r * 4 + c for r in range(2) for c in range(4)],
+     [r * 4 + c for r in range(2, 4) for c in range(4)]]
+]
+
+# Returns (table, pixel indices, error) of best table for every subblock.
+# colors: (blocks, 8, 3), bases: (blocks, 3)
+def _etc1_fit_subblocks(colors, bases):
+    # (blocks, table, index, channel)
+    palette = np.clip(bases[:, np.newaxis, np.newaxis, :] +
+                      ETC1_TABLES[np.newaxis, :, :, np.newaxis], 0, 255)
+    # (blocks, table, pixel, index)
+    dist = ((colors[:, np.newaxis, :, np.newaxis, :] -
+             palette[:, :, np.newaxis, :, :]) ** 2).sum(axis=-1)
+    indices = dist.argmin(axis=-1)
+    errors = dist.min(axis=-1).sum(axis=-1)
+    table = errors.argmin(axis=1)
+    rows = np.arange(len(colors))
+    return table, indices[rows, table], errors[rows, table]
+
+def _expand4(c):
+    return (c << 4) | c
+
+def _expand5(c):
+    return (c << 3) | (c >> 2)
+
+# Encodes blocks with given flip in individual and differential mode and
+# returns (bits, error) of the better one for every block
+def _etc1_encode_flip(blocks, flip):
+    subs = [blocks[:, ETC1_SUBBLOCKS[flip][i]] for i in range(2)]
+    avgs = [s.mean(axis=1) for s in subs]
+
+    # individual: two 444 colors
+    q4 = [np.clip(np.round(a * 15 / 255), 0, 15).astype(np.int64) for a in avgs]
+    # differential: 555 color and 333 signed difference
+    q5 = [np.clip(np.round(a * 31 / 255), 0, 31).astype(np.int64) for a in avgs]
+    delta = q5[1] - q5[0]
+    diff = np.all((delta >= -4) & (delta <= 3), axis=1)
+    q5[1] = np.where(diff[:, np.newaxis], q5[1], q5[0])
+
+    results = []
+    for mode, q, expand in ((0, q4, _expand4), (1, q5, _expand5)):
+        fits = [_etc1_fit_subblocks(subs[i], expand(q[i]).astype(np.float32))
+                for i in range(2)]
+        error = fits[0][2] + fits[1][2]
+        results.append((mode, q, fits, error))
+    use_diff = diff & (results[1][3] <= results[0][3])
+
+    bits = np.zeros(len(blocks), np.uint64)
+    for mode, q, fits, error in results:
+        selected = use_diff if mode == 1 else ~use_diff
+        if mode == 0:
+            fields = [(q[0][:, 0], 60), (q[1][:, 0], 56), (q[0][:, 1], 52),
+                      (q[1][:, 1], 48), (q[0][:, 2], 44), (q[1][:, 2], 40)]
+        else:
+            d = (q[1] - q[0]) & 7
+            fields = [(q[0][:, 0], 59), (d[:, 0], 56), (q[0][:, 1], 51),
+                      (d[:, 1], 48), (q[0][:, 2], 43), (d[:, 2], 40)]
+        fields.extend([(fits[0][0], 37), (fits[1][0], 34)])
+        # pixel index bits; texel at row r, column c is bit c * 4 + r
+        for i in range(2):
+            for k, texel in enumerate(ETC1_SUBBLOCKS[flip][i]):
+                index = fits[i][1][:, k]
+                bit = (texel % 4) * 4 + texel // 4
+                fields.extend([(index >> 1, bit + 16), (index & 1, bit)])
+
+        word = np.zeros(len(blocks), np.uint64) | np.uint64((mode << 1 | flip) << 32)
+        for value, shift in fields:
+            word |= value.astype(np.uint64) << np.uint64(shift)
+        bits = np.where(selected, word, bits)
+
+    error = np.where(use_diff, results[1][3], results[0][3])
+    return bits, error
+
+# Blocks encoded at once; fitting keeps a few arrays of 3 KB per block
+ETC1_CHUNK = 2048
+
+def encode_etc1(image):
+    blocks = split_blocks(image[..., :3]).astype(np.float32)
+    chunks = []
+    for start in range(0, len(blocks), ETC1_CHUNK):
+        chunk = blocks[start:start + ETC1_CHUNK]
+        bits0, error0 = _etc1_encode_flip(chunk, 0)
+        bits1, error1 = _etc1_encode_flip(chunk, 1)
+        chunks.append(np.where(error1 < error0, bits1, bits0))
+    return np.concatenate(chunks).astype('>u8').tostring()
+
+ENCODERS = {
+    'dxt1': encode_dxt1,
+    'dxt5': encode_dxt5,
+    'etc1': encode_etc1
+}
+
+# Returns KTX file with the image ((height, width, 4) uint8 array) and all its
+# mipmaps encoded in given format
+def encode_ktx(rgba, format):
+    internal, base, block_size = FORMATS[format]
+    encode = ENCODERS[format]
+    levels = build_mipmaps(rgba)
+    height, width = rgba.shape[:2]
+
+    data = [KTX_IDENTIFIER,
+            struct.pack('<13I', KTX_ENDIANNESS, 0, 1, 0, internal, base,
+                        width, height, 0, 0, 1, len(levels), 0)]
+    for level in levels:
+        blocks = encode(level)
+        data.append(struct.pack('<I', len(blocks)))
+        data.append(blocks)
+        data.append('\x00' * (-len(blocks) % 4))
+    return ''.join(data)
@@ -0,0 +1,261 @@
+# Virtual filesystem over game directories, as the engine sees them: loose
+# files and members of pk3 archives in the directory. Paks are applied in
+# order of their names, a later one wins; loose files win over all paks.
+# Lookups are case insensitive.
+#
+# A directory is mounted once per process (mount). Then paths under it are
+# resolved by functions of this module (isfile, open_file, listdir, ...) without
+# touching the disk; paths outside mounted directories go to the os.
+# Members are read straight from the pk3, nothing is extracted. Tables of
+# members are kept in a json index (by default cache/vfs.json next to the
+# directory); a pk3 is read again only when its mtime or size changes.
+
+import os
+import io
+import errno
+import json
+import struct
+import fnmatch
+import zipfile
+
+INDEX_VERSION = 1
+
+PAK_EXTENSION = '.pk3'
+
+# Returns table of pk3 members: [name, header offset, compression, compressed
+# size, size, crc32] for every file
+def read_pak_members(pak_path):
+    with zipfile.ZipFile(pak_path) as pak:
+        return [[info.filename, info.header_offset, info.compress_type,
+                 info.compress_size, info.file_size, info.CRC]
+                for info in pak.infolist() if not info.filename.endswith('/')]
+
+# Reads member (as in read_pak_members) from the pk3
+def read_pak_member(pak_path, member):
+    name, offset, compress_type, compress_size, file_size, crc = member
+    info = zipfile.ZipInfo(name)
+    info.compress_type = compress_type
+    info.compress_size = compress_size
+    info.file_size = file_size
+    info.CRC = crc
+    f = open(pak_path, 'rb')
+    try:
+        f.seek(offset + 26)
+        name_length, extra_length = struct.unpack('<2H', f.read(4))
+        f.seek(name_length + extra_length, os.SEEK_CUR)
+    except:
+        f.close()
+        raise
+    with zipfile.ZipExtFile(f, 'rb', info, close_fileobj=True) as member_file:
+        return member_file.read()
+
+def _not_found(error, path):
+    return error(errno.ENOENT, os.strerror(errno.ENOENT), path)
+
+class FileSystem(object):
+    def __init__(self, root, index_path=None):
+        self.root = os.path.normpath(root)
+        self.index_path = index_path
+        self.paks = {}
+        # lower case path -> (real path, pk3 name or None, member)
+        self.files = {}
+        # lower case path -> (real path, {lower case name: real name})
+        self.dirs = {'': ('', {})}
+        self.load()
+        self.update()
+
+    def load(self):
+        if self.index_path is None or not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except ValueError:
+            print 'Warning: broken pk3 index', self.index_path
+            return
+        if index.get('version') == INDEX_VERSION:
+            self.paks = index['paks']
+
+    def save(self):
+        if self.index_path is None:
+            return
+        directory = os.path.dirname(self.index_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'paks': self.paks}, f)
+        os.rename(tmp, self.index_path)
+
+    # Reads paks which changed since the index was built and builds the
+    # overlay of paks and loose files
+    def update(self):
+        names = sorted(p for p in os.listdir(self.root)
+                       if p.lower().endswith(PAK_EXTENSION) and
+                       os.path.isfile(os.path.join(self.root, p)))
+        removed = set(self.paks).difference(names)
+        for p in removed:
+            del self.paks[p]
+        changed = bool(removed)
+
+        for p in names:
+            st = os.stat(os.path.join(self.root, p))
+            entry = self.paks.get(p)
+            if (entry is None or entry['mtime'] != st.st_mtime or
+                entry['size'] != st.st_size):
+                print 'Indexing', p
+                self.paks[p] = {
+                    'mtime': st.st_mtime,
+                    'size': st.st_size,
+                    'members': read_pak_members(os.path.join(self.root, p))
+                }
+                changed = True
+
+        for p in names:
+            for member in self.paks[p]['members']:
+                # json gives unicode strings
+                name = str(member[0])
+                self.add(name, str(p), [name] + member[1:])
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            directory = os.path.relpath(dirpath, self.root).replace(os.sep, '/')
+            for f in filenames:
+                if directory == '.':
+                    if f.lower().endswith(PAK_EXTENSION):
+                        continue
+                    self.add(f, None, None)
+                else:
+                    self.add(directory + '/' + f, None, None)
+
+        if changed:
+            self.save()
+
+    def add(self, path, pak, member):
+        self.files[path.lower()] = (path, pak, member)
+        parts = path.split('/')
+        for i in range(len(parts)):
+            parent = '/'.join(parts[:i])
+            self.dirs.setdefault(parent.lower(), (parent, {}))[1][parts[i].lower()] = parts[i]
+
+    # Paths below are relative to the root, with '/' separators
+
+    def isfile(self, path):
+        return path.lower() in self.files
+
+    def isdir(self, path):
+        return path.lower() in self.dirs
+
+    def listdir(self, path):
+        directory = self.dirs.get(path.lower())
+        if directory is None:
+            raise _not_found(OSError, path)
+        return sorted(directory[1].values())
+
+    # Returns (mtime, size); the mtime of a member is the one of its pk3
+    def stat(self, path):
+        real_path, pak, member = self.lookup(path, OSError)
+        if pak is None:
+            st = os.stat(os.path.join(self.root, real_path))
+            return st.st_mtime, st.st_size
+        return self.paks[pak]['mtime'], member[4]
+
+    # Returns path of the loose file or None for a member of a pk3
+    def real_path(self, path):
+        real_path, pak, member = self.lookup(path, IOError)
+        if pak is None:
+            return os.path.join(self.root, real_path)
+        return None
+
+    def read(self, path):
+        real_path, pak, member = self.lookup(path, IOError)
+        if pak is None:
+            with open(os.path.join(self.root, real_path), 'rb') as f:
+                return f.read()
+        return read_pak_member(os.path.join(self.root, pak), member)
+
+    # Returns seekable file; members are read into memory
+    def open(self, path):
+        real_path, pak, member = self.lookup(path, IOError)
+        if pak is None:
+            return open(os.path.join(self.root, real_path), 'rb')
+        return io.BytesIO(read_pak_member(os.path.join(self.root, pak), member))
+
+    # Returns paths of files and directories matching the pattern; wildcards
+    # don't match '/', as in glob
+    def glob(self, pattern):
+        pattern = pattern.lower().split('/')
+        def match(key):
+            parts = key.split('/')
+            return (len(parts) == len(pattern) and
+                    all(fnmatch.fnmatchcase(p, q) for p, q in zip(parts, pattern)))
+        paths = [f[0] for key, f in self.files.iteritems() if match(key)]
+        paths.extend(d[0] for key, d in self.dirs.iteritems() if key and match(key))
+        return sorted(paths)
+
+    def lookup(self, path, error):
+        f = self.files.get(path.lower())
+        if f is None:
+            raise _not_found(error, path)
+        return f
+
+_mounts = {}
+
+# Mounts the directory and returns its FileSystem; mounting it again is free
+def mount(root, index_path=None):
+    root = os.path.abspath(root)
+    if root not in _mounts:
+        if index_path is None:
+            index_path = os.path.join(root, '..', 'cache', 'vfs.json')
+        _mounts[root] = FileSystem(root, os.path.normpath(index_path))
+    return _mounts[root]
+
+# Returns (FileSystem, path relative to its root) or (None, path) for paths
+# outside mounted directories
+def resolve(path):
+    path = os.path.abspath(path)
+    for root, fs in _mounts.iteritems():
+        if path == root:
+            return fs, ''
+        if path.startswith(root + os.sep):
+            return fs, path[len(root) + 1:].replace(os.sep, '/')
+    return None, path
+
+def isfile(path):
+    fs, path = resolve(path)
+    return fs.isfile(path) if fs else os.path.isfile(path)
+
+def isdir(path):
+    fs, path = resolve(path)
+    return fs.isdir(path) if fs else os.path.isdir(path)
+
+def listdir(path):
+    fs, path = resolve(path)
+    return fs.listdir(path) if fs else os.listdir(path)
+
+def stat(path):
+    fs, path = resolve(path)
+    if fs:
+        return fs.stat(path)
+    st = os.stat(path)
+    return st.st_mtime, st.st_size
+
+def real_path(path):
+    fs, rel_path = resolve(path)
+    return fs.real_path(rel_path) if fs else path
+
+def read(path):
+    fs, path = resolve(path)
+    if fs:
+        return fs.read(path)
+    with open(path, 'rb') as f:
+        return f.read()
+
+def open_file(path):
+    fs, path = resolve(path)
+    return fs.open(path) if fs else open(path, 'rb')
+
+def glob(pattern):
+    import glob as os_glob
+    fs, pattern = resolve(pattern)
+    if fs:
+        return [os.path.join(fs.root, p) for p in fs.glob(pattern)]
+    return os_glob.glob(pattern)